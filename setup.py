@@ -45,7 +45,7 @@ setup(
 
         # Indicate who your project is intended for
         'Intended Audience :: Developers',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
         'Operating System :: Microsoft :: Windows :: Windows 10',
         'Operating System :: POSIX :: Linux',
         'Topic :: Office/Business',
@@ -56,7 +56,7 @@ setup(
 
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     ],
 
     # What does your project relate to?
@@ -72,7 +72,11 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=['xmlmanip==1.1.8.dev0', 'requests>=2.20.0', 'zeep==2.3.0', 'bs4', 'pandas', 'xlsxwriter', 'xlrd'],
+    install_requires=['xmlmanip==1.1.8.dev0', 'requests>=2.20.0', 'zeep==2.3.0', 'bs4', 'pandas', 'xlsxwriter', 'xlrd',
+                      'lxml', 'xmltodict'],
 
-    python_requires='>=3.6',
+    # zeep 2.3's asyncio transport uses aiohttp.Timeout, which aiohttp 3 removed
+    extras_require={'async': ['aiohttp>=1.0,<3']},
+
+    python_requires='>=3.7',
 )
\ No newline at end of file
@@ -1,2 +1,3 @@
 from . api import ScheduleConnection, ScheduleManipulation, ProviderConnection, \
-    ProviderReport, LocationConnection, ScheduleWithData, ProviderLocations
\ No newline at end of file
+    ProviderReport, LocationConnection, ScheduleWithData, ProviderLocations, \
+    AsyncScheduleConnection, AsyncProviderConnection, AsyncLocationConnection
\ No newline at end of file
@@ -1,4 +1,5 @@
 from .schedule import ScheduleConnection
 from .location import LocationConnection
 from .provider import ProviderConnection
-from .specialty import ScheduleManipulation, ProviderReport, ScheduleWithData, ProviderLocations
\ No newline at end of file
+from .specialty import ScheduleManipulation, ProviderReport, ScheduleWithData, ProviderLocations
+from .asynchronous import AsyncScheduleConnection, AsyncProviderConnection, AsyncLocationConnection
\ No newline at end of file
@@ -0,0 +1,380 @@
+import asyncio
+import threading
+import time
+
+import zeep
+from zeep.wsdl.utils import etree_to_string
+
+from tangier_api import bulk
+from tangier_api import caches
+from tangier_api import clients
+from tangier_api import exceptions
+from tangier_api import helpers
+from tangier_api import policies
+from tangier_api import settings
+from tangier_api import wrappers
+from tangier_api.api import ScheduleConnection
+from tangier_api.api import ProviderConnection
+from tangier_api.api import LocationConnection
+
+try:
+    import aiohttp
+    from zeep.asyncio import AsyncTransport
+except ImportError:
+    AsyncTransport = None
+else:
+    class _AsyncTransport(AsyncTransport):
+        def _load_remote_data(self, url):
+            # AsyncTransport loads the WSDL with loop.run_until_complete, which fails when the connection is created
+            # from inside a running event loop. This only runs on a WSDL cache miss, so a blocking request is fine.
+            response = clients.get_session().get(url, timeout=clients.get_timeout())
+            response.raise_for_status()
+            return response.content
+
+        async def post(self, address, message, headers):
+            # same CallPolicy as the synchronous clients (see clients.PolicyTransport)
+            send = super(_AsyncTransport, self).post
+            return await clients.get_policy().async_call(lambda: send(address, message, headers),
+                                                         idempotent=policies.is_idempotent(message, headers))
+
+    class _AsyncCassetteTransport(_AsyncTransport):
+        # async counterpart of clients.CassetteTransport, so recordings are shared with the synchronous clients
+
+        def __init__(self, cassette, *args, **kwargs):
+            self.cassette = cassette
+            super(_AsyncCassetteTransport, self).__init__(*args, **kwargs)
+
+        async def post_xml(self, address, envelope, headers):
+            message = etree_to_string(envelope)
+            if not self.cassette.recording:
+                # the replay latency is slept off in a thread so the other requests on the loop keep going
+                return await asyncio.get_event_loop().run_in_executor(None, self.cassette.replay, address, message,
+                                                                      headers)
+            started = time.monotonic()
+            response = await super(_AsyncCassetteTransport, self).post_xml(address, envelope, headers)
+            self.cassette.record(address, message, headers, response, time.monotonic() - started)
+            return response
+
+        def load(self, url):
+            if not self.cassette.recording:
+                return self.cassette.document(url)
+            content = super(_AsyncCassetteTransport, self).load(url)
+            self.cassette.record_document(url, content)
+            return content
+
+
+# aiohttp sessions belong to one event loop, so there is one shared session per loop: {loop: [session, users]}
+_async_sessions = {}
+_async_sessions_lock = threading.Lock()
+
+
+def _async_session():
+    # aiohttp counterpart of clients.get_session, bound to the current event loop. aiohttp decompresses gzip
+    # responses by itself.
+    connector = aiohttp.TCPConnector(limit=settings.HTTP_POOL_MAXSIZE, force_close=not settings.HTTP_KEEP_ALIVE)
+    headers = {'Accept-Encoding': 'gzip, deflate' if settings.HTTP_COMPRESS else 'identity'}
+    return aiohttp.ClientSession(connector=connector, headers=headers)
+
+
+def _acquire_async_session(loop):
+    """
+    :return: (aiohttp.ClientSession) the session shared by the async connections on loop, created on first use
+    """
+    with _async_sessions_lock:
+        entry = _async_sessions.get(loop)
+        if entry is None or entry[0].closed:
+            entry = _async_sessions[loop] = [_async_session(), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+async def _release_async_session(loop, session):
+    """
+    Closes the shared session of loop once every connection that acquired it has released it
+    """
+    with _async_sessions_lock:
+        entry = _async_sessions.get(loop)
+        if entry is not None and entry[0] is session:
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del _async_sessions[loop]
+    await session.close()
+
+
+def _async_client(endpoint, loop, session):
+    # same WSDL cache, timeouts, CallPolicy and cassette as clients.get_client
+    cassette = clients.get_cassette()
+    connect_timeout, read_timeout = clients.get_timeout()
+    # aiohttp.Timeout covers the whole request, so it gets both timeouts
+    timeout = connect_timeout + read_timeout if connect_timeout and read_timeout else None
+    # the transport leaves closing the session it is given to _release_async_session
+    options = dict(loop=loop, cache=clients.get_cache(), timeout=timeout, operation_timeout=timeout, session=session)
+    transport = _AsyncCassetteTransport(cassette, **options) if cassette is not None else _AsyncTransport(**options)
+    return zeep.Client(endpoint, transport=transport)
+
+
+class _AsyncConnection:
+    """
+    Client creation and cleanup shared by the async connections. Every connection on an event loop sends its
+    requests through the same pooled aiohttp session, which is closed when the last of them is closed, either with
+    close() or by leaving an "async with" block.
+    """
+    _session = None
+
+    def _create_client(self, endpoint):
+        if AsyncTransport is None:
+            raise ImportError('The async connections require zeep\'s asyncio support (aiohttp) to be importable in '
+                              'your environment.')
+        if self._session is None:
+            self._session_loop = self.loop if self.loop else asyncio.get_event_loop()
+            self._session = _acquire_async_session(self._session_loop)
+        return _async_client(endpoint, self._session_loop, self._session)
+
+    async def close(self):
+        """
+        Releases the connection's share of the aiohttp session; the connection cannot be used afterwards
+        """
+        session, self._session = self._session, None
+        if session is not None:
+            await _release_async_session(self._session_loop, session)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class AsyncScheduleConnection(_AsyncConnection, ScheduleConnection):
+    """
+    asyncio version of ScheduleConnection; every method that makes a request is a coroutine
+    """
+
+    def __init__(self, *args, loop=None, **kwargs):
+        self.loop = loop
+        super(AsyncScheduleConnection, self).__init__(*args, **kwargs)
+
+    @wrappers.timed('network')
+    async def GetSchedule(self, xml_string=""):
+        """
+        WSDL GetSchedule method
+
+        :param xml_string: (xml str) fully formed xml string for GetSchedule request
+        :return:
+        """
+        response = await self.client.service.GetSchedule(xml_string)
+        return response.encode('utf-8')
+
+    async def get_schedule(self, start_date=None, end_date=None, site_id=None, emp_id=None, xml_string="", **tags):
+        """
+        See ScheduleConnection.get_schedule
+        """
+        with wrappers.timing_tags(method='get_schedule', site_id=site_id, emp_id=emp_id, start_date=start_date,
+                                  end_date=end_date):
+            return await self.GetSchedule(self._get_schedule_request(start_date, end_date, site_id, emp_id,
+                                                                     xml_string, **tags))
+
+    async def get_schedules(self, start_date=None, end_date=None, site_ids=None, xml_string="", max_workers=None,
+                            **tags):
+        """
+        See ScheduleConnection.get_schedules. Requests for every site are in flight at once unless limited by
+        max_workers.
+        """
+        if not site_ids:
+            site_ids = self.site_ids
+        if not (site_ids and start_date and end_date):
+            raise exceptions.APICallError("Required kwarg site_ids must be an enumerable object of site_id's.")
+        xml_string = xml_string if xml_string else self.base_xml
+
+        async def get_site_schedule(site_id):
+            return await self.get_schedule(site_id=site_id, start_date=start_date, end_date=end_date,
+                                           xml_string=xml_string)
+
+        return await helpers.async_concurrent_map(get_site_schedule, site_ids, max_workers=max_workers)
+
+    async def get_schedule_values_list(self, start_date=None, end_date=None, site_ids=None, emp_ids=None,
+                                       xml_string="", max_workers=None, parser='stream', **tags):
+        """
+        See ScheduleConnection.get_schedule_values_list. Requests for every id are in flight at once unless limited
+        by max_workers.
+        """
+        id_type, id_list = self._get_schedule_ids(site_ids, emp_ids)
+        xml_string = xml_string if xml_string else self.base_xml
+
+        async def get_id_values_list(_id):
+            id_kwargs = {id_type: _id}
+            with wrappers.timing_tags(method='get_schedule_values_list', start_date=start_date, end_date=end_date,
+                                      **id_kwargs):
+                schedule_response = await self.get_schedule(xml_string=xml_string, start_date=start_date,
+                                                            end_date=end_date, **id_kwargs, **tags)
+                return self._schedule_values_list(schedule_response, parser)
+
+        schedule_values_list = []
+        for id_values_list in await helpers.async_concurrent_map(get_id_values_list, id_list,
+                                                                 max_workers=max_workers):
+            schedule_values_list.extend(id_values_list)
+        return schedule_values_list
+
+
+class AsyncProviderConnection(_AsyncConnection, ProviderConnection):
+    """
+    asyncio version of ProviderConnection; every method that makes a request is a coroutine
+    """
+
+    def __init__(self, *args, loop=None, **kwargs):
+        self.loop = loop
+        super(AsyncProviderConnection, self).__init__(*args, **kwargs)
+
+    @wrappers.timed('network')
+    async def MaintainProviders(self, xml_string=""):
+        response = await self.client.service.MaintainProviders(xml_string)
+        if self.cache is not None and not caches.is_info_request(xml_string):
+            self.cache.invalidate()
+        return response
+
+    async def get_provider_info(self, provider_ids=None, use_primary_keys=True, all_providers=True, xml_string="",
+                                batch_size=100, max_workers=None, **tags):
+        """
+        See ProviderConnection.get_provider_info. Batches are all in flight at once unless limited by max_workers.
+        """
+        responses = await self._get_provider_info_responses(provider_ids, use_primary_keys, all_providers, xml_string,
+                                                            batch_size, max_workers, **tags)
+        return self._merge_provider_responses(responses)
+
+    async def _get_provider_info_responses(self, provider_ids=None, use_primary_keys=True, all_providers=True,
+                                           xml_string="", batch_size=100, max_workers=None, **tags):
+        async def get_batch_response(batch_ids):
+            return await self._get_provider_info_response(batch_ids, use_primary_keys, all_providers, xml_string,
+                                                          **tags)
+
+        return await helpers.async_concurrent_map(get_batch_response,
+                                                  self._provider_id_batches(provider_ids, all_providers, batch_size),
+                                                  max_workers=max_workers)
+
+    async def _get_provider_info_response(self, provider_ids=None, use_primary_keys=True, all_providers=True,
+                                          xml_string="", **tags):
+        xml_string = self._get_provider_info_request(provider_ids, use_primary_keys, all_providers, xml_string, **tags)
+        response = self.cache.get(xml_string) if self.cache is not None else None
+        if response is None:
+            response = wrappers.Response(await self.MaintainProviders(xml_string))
+            if self.cache is not None and not response.errors():
+                self.cache.set(xml_string, response)
+        return response
+
+    async def provider_info_values_list(self, use_primary_keys=True, **kwargs):
+        """
+        See ProviderConnection.provider_info_values_list
+        """
+        with wrappers.timing_tags(method='provider_info_values_list'):
+            responses = await self._get_provider_info_responses(use_primary_keys=use_primary_keys, **kwargs)
+            return self._provider_values_list(responses, use_primary_keys, **kwargs)
+
+    async def maintain_providers(self, operations, xml_string="", batch_size=100, max_workers=None):
+        """
+        See ProviderConnection.maintain_providers. Requests are all in flight at once unless limited by max_workers.
+        """
+        operations = list(operations)
+        results, batches = bulk.prepare(operations, self._provider_operation_tag, batch_size)
+
+        async def send_batch(batch):
+            batch_operations = [operations[i] for i, tag in batch]
+            try:
+                response = await self.MaintainProviders(self._provider_batch_request(batch, xml_string))
+                return bulk.map_results(batch_operations, response, 'providers', self.provider_id_labels)
+            except bulk.CALL_ERRORS as e:
+                return [bulk.operation_result(operation, error=e) for operation in batch_operations]
+
+        return bulk.collect(results, batches,
+                            await helpers.async_concurrent_map(send_batch, batches, max_workers=max_workers))
+
+
+class AsyncLocationConnection(_AsyncConnection, LocationConnection):
+    """
+    asyncio version of LocationConnection; every method that makes a request is a coroutine
+    """
+
+    def __init__(self, *args, loop=None, **kwargs):
+        self.loop = loop
+        super(AsyncLocationConnection, self).__init__(*args, **kwargs)
+
+    @wrappers.async_handle_response
+    async def MaintainLocations(self, xml_string):
+        """
+        WSDL GetLocation method
+
+        :param xml_string: (xml str) fully formed xml string for GetLocation request
+        :return:
+        """
+        return await self._maintain_locations(xml_string)
+
+    @wrappers.async_debug_options
+    @wrappers.timed('network')
+    async def _maintain_locations(self, xml_string):
+        response = await self.client.service.MaintainLocations(xml_string)
+        if self.cache is not None and not caches.is_info_request(xml_string):
+            self.cache.invalidate()
+        return response
+
+    async def get_locations_info(self, site_ids=None, xml_string=None):
+        """
+        See LocationConnection.get_locations_info
+        """
+        return (await self._get_locations_response(site_ids, xml_string)).encode('utf-8')
+
+    async def _get_locations_response(self, site_ids=None, xml_string=None):
+        xml_string = self._get_locations_info_request(site_ids, xml_string)
+        response = self.cache.get(xml_string) if self.cache is not None else None
+        if response is None:
+            response = await self.MaintainLocations(xml_string)
+            if self.cache is not None:
+                self.cache.set(xml_string, response)
+        return response
+
+    async def location_info_values_list(self, site_ids=None):
+        """
+        See LocationConnection.location_info_values_list
+        """
+        return self._location_values_list(await self._get_locations_response(site_ids))
+
+    async def add_location(self, site_id=None, xml_string=None, name=None, short_name=None, **kwargs):
+        """
+        See LocationConnection.add_location
+        """
+        xml_string = self._add_location_request(site_id, xml_string, name, short_name, **kwargs)
+        response = await self.MaintainLocations(xml_string)
+        return response.encode('utf-8')
+
+    async def update_location(self, site_id=None, new_site_id=None, xml_string=None, name=None, short_name=None,
+                              **kwargs):
+        """
+        See LocationConnection.update_location
+        """
+        xml_string = self._update_location_request(site_id, new_site_id, xml_string, name, short_name, **kwargs)
+        response = await self.MaintainLocations(xml_string)
+        return response.encode('utf-8')
+
+    async def delete_location(self, site_id=None, xml_string=None):
+        """
+        See LocationConnection.delete_location
+        """
+        response = await self.MaintainLocations(self._delete_location_request(site_id, xml_string))
+        return response.encode('utf-8')
+
+    async def maintain_locations(self, operations, xml_string=None, batch_size=100, max_workers=None):
+        """
+        See LocationConnection.maintain_locations. Requests are all in flight at once unless limited by max_workers.
+        """
+        operations = list(operations)
+        results, batches = bulk.prepare(operations, self._location_operation_tag, batch_size)
+
+        async def send_batch(batch):
+            batch_operations = [operations[i] for i, tag in batch]
+            try:
+                response = await self._maintain_locations(self._location_batch_request(batch, xml_string))
+                return bulk.map_results(batch_operations, response, 'locations', ('site_id',))
+            except bulk.CALL_ERRORS as e:
+                return [bulk.operation_result(operation, error=e) for operation in batch_operations]
+
+        return bulk.collect(results, batches,
+                            await helpers.async_concurrent_map(send_batch, batches, max_workers=max_workers))
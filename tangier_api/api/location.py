@@ -1,20 +1,26 @@
-import zeep
-import requests
 import xmlmanip
 
 from tangier_api import settings
+from tangier_api import bulk
+from tangier_api import caches
+from tangier_api import clients
 from tangier_api import exceptions
+from tangier_api import helpers
+from tangier_api import templates
 from tangier_api import wrappers
 
 
 class LocationConnection:
-    def __init__(self, xml_string="", endpoint=settings.LOCATION_ENDPOINT, show_xml_request=False, show_xml_response=False):
+    def __init__(self, xml_string="", endpoint=settings.LOCATION_ENDPOINT, show_xml_request=False, show_xml_response=False,
+                 cache=None):
         """
 
         :param xml_string: override the default xml, which is just <tangier method="schedule.request"/>
         :param endpoint: where the WSDL info is with routing info and SOAP API definitions
+        :param cache: (caches.BaseCache) caches get_locations_info responses; cleared by any add, update or delete
         """
-        super(self.__class__, self).__init__()
+        super(LocationConnection, self).__init__()
+        self.cache = cache
         if not xml_string:
             self.base_xml = """<tangier version="1.0" method="location.request"></tangier>"""
         else:
@@ -23,10 +29,12 @@ class LocationConnection:
         self.show_xml_request = show_xml_request
         self.show_xml_response = show_xml_response
         self.base_xml = xmlmanip.inject_tags(self.base_xml, admin_user=settings.TANGIER_USERNAME, admin_pwd=settings.TANGIER_PASSWORD)
-        self.client = zeep.Client(endpoint, transport=zeep.transports.Transport(session=requests.Session()))
+        self.client = self._create_client(endpoint)
+
+    def _create_client(self, endpoint):
+        return clients.get_client(endpoint)
 
     @wrappers.handle_response
-    @wrappers.debug_options
     def MaintainLocations(self, xml_string):
         """
         WSDL GetLocation method
@@ -34,13 +42,30 @@ class LocationConnection:
         :param xml_string: (xml str) fully formed xml string for GetLocation request
         :return:
         """
-        return self.client.service.MaintainLocations(xml_string)
+        return self._maintain_locations(xml_string)
+
+    @wrappers.debug_options
+    @wrappers.timed('network')
+    def _maintain_locations(self, xml_string):
+        # MaintainLocations without the error check, which maintain_locations makes per <location/> instead
+        response = self.client.service.MaintainLocations(xml_string)
+        if self.cache is not None and not caches.is_info_request(xml_string):
+            self.cache.invalidate()
+        return response
 
     def get_locations_info(self, site_ids=None, xml_string=None):
         """
         :param xml_string: (xml string) overrides the default credential and/or location injection into base_xml
         :return: xml response string with an error message or info about a location.
         """
+        with wrappers.timing_tags(method='get_locations_info'):
+            return self._get_locations_response(site_ids, xml_string).encode('utf-8')
+
+    def _get_locations_response(self, site_ids=None, xml_string=None):
+        xml_string = self._get_locations_info_request(site_ids, xml_string)
+        return caches.cached(self.cache, xml_string, lambda: self.MaintainLocations(xml_string))
+
+    def _get_locations_info_request(self, site_ids=None, xml_string=None):
         # sites = {"site_id": site_id for i, site_id in enumerate(site_ids)}
         if not site_ids:
             site_ids = 'ALL_SITE_IDS'
@@ -48,10 +73,7 @@ class LocationConnection:
             site_ids = [site_ids]
         tags = {f"location__{i}": {"action": "info", "__inner_tag": {"site_id": site_id}} for i, site_id in
                 enumerate(site_ids)}
-        xml_string = xml_string if xml_string else self.base_xml
-        xml_string = xmlmanip.inject_tags(xml_string, injection_index=2, locations="")
-        xml_string = xmlmanip.inject_tags(xml_string, parent_tag="locations", **tags)
-        return self.MaintainLocations(xml_string).encode('utf-8')
+        return self._locations_request(tags, xml_string)
 
     def location_info_values_list(self, site_ids=None):
         """
@@ -59,11 +81,13 @@ class LocationConnection:
         :param provider_ids: (list) of all emp_ids corresponding to desired locations info
         :return: (SearchableList) of all locations returned by get_locations_info
         """
-        xml_string = self.get_locations_info(site_ids)
-        schema = xmlmanip.XMLSchema(xml_string)
-        # kind of hacky way to get every element with a site_id tag
-        location_list = schema.search(site_id__contains='')
-        return location_list
+        with wrappers.timing_tags(method='location_info_values_list'):
+            return self._location_values_list(self._get_locations_response(site_ids))
+
+    @wrappers.timed('parse')
+    def _location_values_list(self, response):
+        # every element with a site_id tag, read from the tree MaintainLocations already parsed to check for errors
+        return wrappers.Response(response).find('site_id')
 
     def add_location(self, site_id=None, xml_string=None, name=None, short_name=None, **kwargs):
         """
@@ -73,14 +97,18 @@ class LocationConnection:
         :param kwargs: additional named properties to be provided in the creation request.
         :return: xml response string with an error message or info about a location.
         """
+        xml_string = self._add_location_request(site_id, xml_string, name, short_name, **kwargs)
+        return self.MaintainLocations(xml_string).encode('utf-8')
+
+    def _add_location_request(self, site_id=None, xml_string=None, name=None, short_name=None, **kwargs):
+        return self._locations_request({"location": self._add_location_tag(site_id, name, short_name, **kwargs)},
+                                       xml_string)
+
+    @staticmethod
+    def _add_location_tag(site_id=None, name=None, short_name=None, **kwargs):
         if not (site_id and name and short_name):
             raise exceptions.APICallError(f'site_id, name, and short_name are all required key-word arguments.')
-        tags = {f"location": {"action": "add", "__inner_tag": {"site_id": site_id,
-                                                               "name": name, 'short_name': short_name, **kwargs}}}
-        xml_string = xml_string if xml_string else self.base_xml
-        xml_string = xmlmanip.inject_tags(xml_string, injection_index=2, locations="")
-        xml_string = xmlmanip.inject_tags(xml_string, parent_tag="locations", **tags)
-        return self.MaintainLocations(xml_string).encode('utf-8')
+        return {"action": "add", "__inner_tag": {"site_id": site_id, "name": name, 'short_name': short_name, **kwargs}}
 
     def update_location(self, site_id=None, new_site_id=None, xml_string=None, name=None, short_name=None, **kwargs):
         """
@@ -91,19 +119,23 @@ class LocationConnection:
         :param kwargs: additional named properties to be provided in the creation request.
         :return: xml response string with an error message or info about a location.
         """
+        xml_string = self._update_location_request(site_id, new_site_id, xml_string, name, short_name, **kwargs)
+        return self.MaintainLocations(xml_string).encode('utf-8')
+
+    def _update_location_request(self, site_id=None, new_site_id=None, xml_string=None, name=None, short_name=None,
+                                 **kwargs):
+        return self._locations_request(
+            {"location": self._update_location_tag(site_id, new_site_id, name, short_name, **kwargs)}, xml_string)
+
+    @staticmethod
+    def _update_location_tag(site_id=None, new_site_id=None, name=None, short_name=None, **kwargs):
         if not (site_id and name and short_name):
             raise exceptions.APICallError(f'site_id, name, and short_name are all required key-word arguments.')
         if new_site_id:
-            tags = {f"location": {"action": "update",
-                                  "__inner_tag": {"site_id": site_id, 'new_site_id': new_site_id,
-                                                  "name": name, 'short_name': short_name, **kwargs}}}
-        else:
-            tags = {f"location": {"action": "update", "__inner_tag": {"site_id": site_id, "name": name,
-                                                                      'short_name': short_name, **kwargs}}}
-        xml_string = xml_string if xml_string else self.base_xml
-        xml_string = xmlmanip.inject_tags(xml_string, injection_index=2, locations="")
-        xml_string = xmlmanip.inject_tags(xml_string, parent_tag="locations", **tags)
-        return self.MaintainLocations(xml_string).encode('utf-8')
+            return {"action": "update", "__inner_tag": {"site_id": site_id, 'new_site_id': new_site_id,
+                                                        "name": name, 'short_name': short_name, **kwargs}}
+        return {"action": "update", "__inner_tag": {"site_id": site_id, "name": name, 'short_name': short_name,
+                                                    **kwargs}}
 
     def delete_location(self, site_id=None, xml_string=None):
         """
@@ -112,10 +144,56 @@ class LocationConnection:
         :param xml_string: (xml string) overrides the default credential and/or location injection into base_xml
         :return: xml response string with an error message or info about a location.
         """
+        return self.MaintainLocations(self._delete_location_request(site_id, xml_string)).encode('utf-8')
+
+    def _delete_location_request(self, site_id=None, xml_string=None):
+        return self._locations_request({"location": self._delete_location_tag(site_id)}, xml_string)
+
+    @staticmethod
+    def _delete_location_tag(site_id=None):
         if not site_id:
             raise exceptions.APICallError(f'site_id cannot be {site_id}')
-        tags = {f"location": {"action": "delete", "__inner_tag": {"site_id": site_id}}}
+        return {"action": "delete", "__inner_tag": {"site_id": site_id}}
+
+    def maintain_locations(self, operations, xml_string=None, batch_size=100, max_workers=None):
+        """
+        Sends many adds, updates and deletes with as few MaintainLocations requests as possible. Failures are reported
+        per operation instead of being raised, so one bad location does not stop the rest of the batch.
+
+        :param operations: (list) of dicts with an "action" of "add", "update" or "delete" and the key-word arguments
+            add_location, update_location or delete_location take, ex: {"action": "delete", "site_id": "OLD-SITE"}
+        :param xml_string: (xml string) overrides the default credential and/or location injection into base_xml
+        :param batch_size: (int or None) most operations sent in one request; None sends them all at once
+        :param max_workers: (int or None) number of requests sent concurrently; requests are sent one at a time if not provided
+        :return: (list) of dicts, one for every operation in the same order, with the "operation", the "result"
+            element Tangier returned for it and the "error" it failed with (None if it succeeded)
+        """
+        operations = list(operations)
+        results, batches = bulk.prepare(operations, self._location_operation_tag, batch_size)
+
+        def send_batch(batch):
+            batch_operations = [operations[i] for i, tag in batch]
+            try:
+                response = self._maintain_locations(self._location_batch_request(batch, xml_string))
+                return bulk.map_results(batch_operations, response, 'locations', ('site_id',))
+            except bulk.CALL_ERRORS as e:
+                return [bulk.operation_result(operation, error=e) for operation in batch_operations]
+
+        return bulk.collect(results, batches, helpers.concurrent_map(send_batch, batches, max_workers=max_workers))
+
+    def _location_operation_tag(self, operation):
+        operation = dict(operation)
+        tag_methods = {'add': self._add_location_tag, 'update': self._update_location_tag,
+                       'delete': self._delete_location_tag}
+        action = operation.pop('action', None)
+        if action not in tag_methods:
+            raise exceptions.APICallError(f'action must be one of {", ".join(tag_methods)}, not {action}.')
+        return tag_methods[action](**operation)
+
+    def _location_batch_request(self, batch, xml_string=None):
+        return self._locations_request({f'location__{j}': tag for j, (i, tag) in enumerate(batch)}, xml_string)
+
+    @wrappers.timed('build')
+    def _locations_request(self, tags, xml_string=None):
         xml_string = xml_string if xml_string else self.base_xml
-        xml_string = xmlmanip.inject_tags(xml_string, injection_index=2, locations="")
-        xml_string = xmlmanip.inject_tags(xml_string, parent_tag="locations", **tags)
-        return self.MaintainLocations(xml_string).encode('utf-8')
\ No newline at end of file
+        return templates.build_request(xml_string, "locations", **tags)
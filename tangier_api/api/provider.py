@@ -1,32 +1,48 @@
-import zeep
-import requests
 import xmlmanip
+from lxml import etree
 
 from tangier_api import settings
+from tangier_api import bulk
+from tangier_api import caches
+from tangier_api import clients
 from tangier_api import exceptions
+from tangier_api import helpers
+from tangier_api import templates
+from tangier_api import wrappers
 
 
 class ProviderConnection:
+    provider_id_labels = ('provider_primary_key', 'emp_id')  # either one identifies a provider
 
-    def __init__(self, xml_string="", endpoint=settings.PROVIDER_ENDPOINT):
+    def __init__(self, xml_string="", endpoint=settings.PROVIDER_ENDPOINT, cache=None):
         """
         Injects credentials into <tanger/> root schema and
 
         :param xml_string: override the base xml, which is just <tangier method="schedule.request"/>
         :param endpoint: where the WSDL info is with routing info and SOAP API definitions
+        :param cache: (caches.BaseCache) caches get_provider_info responses; cleared by any write sent through MaintainProviders
         """
+        self.cache = cache
         if not xml_string:
             self.base_xml = """<tangier version="1.0" method="provider.request"></tangier>"""
         else:
             self.base_xml = xml_string
         self.base_xml = xmlmanip.inject_tags(self.base_xml, admin_user=settings.TANGIER_USERNAME,
                                              admin_pwd=settings.TANGIER_PASSWORD)
-        self.client = zeep.Client(endpoint, transport=zeep.transports.Transport(session=requests.Session()))
+        self.client = self._create_client(endpoint)
 
+    def _create_client(self, endpoint):
+        return clients.get_client(endpoint)
+
+    @wrappers.timed('network')
     def MaintainProviders(self, xml_string=""):
-        return self.client.service.MaintainProviders(xml_string)
+        response = self.client.service.MaintainProviders(xml_string)
+        if self.cache is not None and not caches.is_info_request(xml_string):
+            self.cache.invalidate()
+        return response
 
-    def get_provider_info(self, provider_ids=None, use_primary_keys=True, all_providers=True, xml_string="", **tags):
+    def get_provider_info(self, provider_ids=None, use_primary_keys=True, all_providers=True, xml_string="",
+                          batch_size=100, max_workers=None, **tags):
         """
         Method to retrieve info on all providers corresponding to the list "provider_ids"
 
@@ -34,15 +50,56 @@ class ProviderConnection:
         :param use_primary_keys: (bool) indicates whether provider_ids should be treated as emp_id or provider_primary_key
         :param all_providers: (bool) indicates whether to return data on all existing providers
         :param xml_string: (xml string) overrides default xml string provided by the instantiation of the class object
+        :param batch_size: (int or None) most provider_ids sent in one request; longer lists are split into several requests whose <provider/> elements are merged into one response. None sends every id at once
+        :param max_workers: (int or None) number of batches to request concurrently; batches are requested one at a time if not provided
         :param tags: (kwargs) things to be injected into the request. ex: start_date="2017-05-01", end_date="2017-05-02"
         :return:
         """
+        with wrappers.timing_tags(method='get_provider_info'):
+            responses = self._get_provider_info_responses(provider_ids, use_primary_keys, all_providers, xml_string,
+                                                          batch_size, max_workers, **tags)
+            return self._merge_provider_responses(responses)
+
+    def _get_provider_info_responses(self, provider_ids=None, use_primary_keys=True, all_providers=True, xml_string="",
+                                     batch_size=100, max_workers=None, **tags):
+        def get_batch_response(batch_ids):
+            return self._get_provider_info_response(batch_ids, use_primary_keys, all_providers, xml_string, **tags)
+
+        return helpers.concurrent_map(get_batch_response, self._provider_id_batches(provider_ids, all_providers,
+                                                                                    batch_size),
+                                      max_workers=max_workers)
+
+    @staticmethod
+    def _provider_id_batches(provider_ids, all_providers, batch_size):
+        if all_providers or not isinstance(provider_ids, list) or not batch_size or len(provider_ids) <= batch_size:
+            return [provider_ids]
+        return [provider_ids[i:i + batch_size] for i in range(0, len(provider_ids), batch_size)]
+
+    @staticmethod
+    def _merge_provider_responses(responses):
+        if len(responses) == 1:
+            return responses[0].encode('utf-8')
+        roots = [etree.fromstring(response.encode('utf-8')) for response in responses]
+        containers = [next(root.iter('providers'), None) for root in roots]
+        if any(container is None for container in containers):
+            raise exceptions.APIError('Provider info responses without a <providers/> element cannot be merged.')
+        for container in containers[1:]:
+            containers[0].extend(list(container))
+        return etree.tostring(roots[0])
+
+    def _get_provider_info_response(self, provider_ids=None, use_primary_keys=True, all_providers=True, xml_string="",
+                                    **tags):
+        xml_string = self._get_provider_info_request(provider_ids, use_primary_keys, all_providers, xml_string, **tags)
+        # MaintainProviders has no error check, so error responses are returned as before but never cached
+        return caches.cached(self.cache, xml_string, lambda: wrappers.Response(self.MaintainProviders(xml_string)),
+                             cacheable=lambda response: not response.errors())
+
+    def _get_provider_info_request(self, provider_ids=None, use_primary_keys=True, all_providers=True, xml_string="",
+                                   **tags):
         if not provider_ids and not all_providers:
             raise exceptions.APICallError("You must provide either a list of provider_ids or set all_providers=True.")
         elif not isinstance(provider_ids, list):
             provider_ids = [provider_ids]
-        xml_string = xml_string if xml_string else self.base_xml
-        xml_string = xmlmanip.inject_tags(xml_string, injection_index=2, providers="")
         provider_dict = {}
         id_label = "provider_primary_key" if use_primary_keys else "emp_id"
         if not all_providers:
@@ -50,23 +107,75 @@ class ProviderConnection:
                 provider_dict[f'provider__{i}'] = {"action": "info", "__inner_tag": {id_label: f"{provider_id}"}}
         else:
             provider_dict[f'provider'] = {"action": "info", "__inner_tag": {id_label: "ALL"}}
-        xml_string = xmlmanip.inject_tags(xml_string, parent_tag="providers", **provider_dict)
+        return self._providers_request(provider_dict, xml_string)
 
-        # return xml_string
-        return self.MaintainProviders(xml_string).encode('utf-8')
+    @wrappers.timed('build')
+    def _providers_request(self, tags, xml_string=""):
+        xml_string = xml_string if xml_string else self.base_xml
+        return templates.build_request(xml_string, "providers", **tags)
 
     def provider_info_values_list(self, use_primary_keys=True, **kwargs):
         """
-        Wrapper for get_provider info which converts the xml response into a list of dicts
+        Wrapper for get_provider info which converts the xml response into a list of dicts. Long provider_ids lists
+        are requested in batches (see get_provider_info) and the providers of every batch are returned in one list.
         """
-        xml_string = self.get_provider_info(**kwargs)
-        schema = xmlmanip.XMLSchema(xml_string)
+        with wrappers.timing_tags(method='provider_info_values_list'):
+            return self._provider_values_list(self._get_provider_info_responses(use_primary_keys=use_primary_keys,
+                                                                                **kwargs),
+                                              use_primary_keys, **kwargs)
+
+    @wrappers.timed('parse')
+    def _provider_values_list(self, responses, use_primary_keys=True, **kwargs):
         if kwargs.get('all_providers'):
             id_label = 'provider_primary_key'
         else:
             id_label = "provider_primary_key" if use_primary_keys else "emp_id"
-        # using contains method here is kind of hacky way to get every element with an {id_label} tag, basically I'm
-        # just checking to see that the label even exists
-        label_dict = {f"{id_label}__contains": ""}
-        provider_list = schema.search(**label_dict)
-        return provider_list
+        # every element with an {id_label} tag; each response is only parsed once, however many lookups are made
+        if not isinstance(responses, list):
+            responses = [responses]
+        if len(responses) == 1:
+            return wrappers.Response(responses[0]).find(id_label)
+        providers = [provider for response in responses for provider in wrappers.Response(response).find(id_label)]
+        return wrappers.sort_elements(providers, id_label)
+
+    def maintain_providers(self, operations, xml_string="", batch_size=100, max_workers=None):
+        """
+        Sends many provider adds, updates and deletes with as few MaintainProviders requests as possible. Failures
+        are reported per provider instead of being raised, so one bad provider does not stop the rest of the batch.
+
+        :param operations: (list) of dicts with an "action" of "add", "update" or "delete", an "emp_id" and/or
+            "provider_primary_key" identifying the provider and any other provider fields to send,
+            ex: {"action": "update", "provider_primary_key": 12, "emp_id": "1234567890", "email": "dr@example.com"}
+        :param xml_string: (xml string) overrides default xml string provided by the instantiation of the class object
+        :param batch_size: (int or None) most providers sent in one request; None sends them all at once
+        :param max_workers: (int or None) number of requests sent concurrently; requests are sent one at a time if not provided
+        :return: (list) of dicts, one for every operation in the same order, with the "operation", the "result"
+            element Tangier returned for it and the "error" it failed with (None if it succeeded)
+        """
+        operations = list(operations)
+        results, batches = bulk.prepare(operations, self._provider_operation_tag, batch_size)
+
+        def send_batch(batch):
+            batch_operations = [operations[i] for i, tag in batch]
+            try:
+                response = self.MaintainProviders(self._provider_batch_request(batch, xml_string))
+                return bulk.map_results(batch_operations, response, 'providers', self.provider_id_labels)
+            except bulk.CALL_ERRORS as e:
+                return [bulk.operation_result(operation, error=e) for operation in batch_operations]
+
+        return bulk.collect(results, batches, helpers.concurrent_map(send_batch, batches, max_workers=max_workers))
+
+    def _provider_operation_tag(self, operation):
+        fields = dict(operation)
+        action = fields.pop('action', None)
+        if action not in ('add', 'update', 'delete'):
+            raise exceptions.APICallError(f'action must be one of add, update, delete, not {action}.')
+        if not any(fields.get(id_label) for id_label in self.provider_id_labels):
+            raise exceptions.APICallError(f'Every provider needs a provider_primary_key or emp_id to {action}.')
+        for id_label in self.provider_id_labels:
+            if fields.get(id_label):
+                fields[id_label] = f'{fields[id_label]}'
+        return {"action": action, "__inner_tag": fields}
+
+    def _provider_batch_request(self, batch, xml_string=""):
+        return self._providers_request({f'provider__{j}': tag for j, (i, tag) in enumerate(batch)}, xml_string)
@@ -1,14 +1,14 @@
 import re
-import datetime
 import pandas
 import numpy
 import xmlmanip
 
-from zeep import Client
-from zeep.transports import Transport
-from requests import Session
-
 from tangier_api import settings
+from tangier_api import clients
+from tangier_api import helpers
+from tangier_api import parsers
+from tangier_api import templates
+from tangier_api import wrappers
 from tangier_api.exceptions import APICallError
 
 
@@ -55,10 +55,14 @@ class ScheduleConnection:
                 print('Site ids must be in a column with the header "{0}"'.format(site_id_column_header))
 
         self.base_xml = xmlmanip.inject_tags(self.base_xml, user_name=settings.TANGIER_USERNAME, user_pwd=settings.TANGIER_PASSWORD)
-        self.client = Client(endpoint, transport=Transport(session=Session()))
+        self.client = self._create_client(endpoint)
         self.saved_schedule = None
         self.debug = debug
 
+    def _create_client(self, endpoint):
+        return clients.get_client(endpoint)
+
+    @wrappers.timed('network')
     def GetSchedule(self, xml_string=""):
         """
         WSDL GetSchedule method
@@ -68,49 +72,37 @@ class ScheduleConnection:
         """
         return self.client.service.GetSchedule(xml_string).encode('utf-8')
 
-    def _extract_shifts(self, shifts, in_date_format=in_date_format, out_date_format=date_format):
-        shifts_date_str = shifts["@shiftdate"]
-        shifts_date_in = datetime.datetime.strptime(shifts_date_str, in_date_format)
-        shifts_date = shifts_date_in.strftime(out_date_format)
-        if issubclass(shifts['shifts']['shift'].__class__, list):
-            shifts_list = shifts['shifts']['shift']
-        else:
-            shifts_list = [shifts['shifts']['shift']]
-
-        def to_iso(shift_time, shifts_date):
-            return self._time_and_date_to_iso(shift_time, shifts_date)
-
-        shifts_with_start_dates = list(map(lambda x: {"shift_start_date": to_iso(x['actualstarttime'],
-                                                                                 shifts_date),
-                                                      **x},
-                                           shifts_list))
-
-        def add_end_date(shift):
-            return ScheduleConnection._add_end_date('shift_start_date', 'reportedminutes', shift)
-
-        return list(map(lambda x: add_end_date(x), shifts_with_start_dates))
-
-    @staticmethod
-    def _add_end_date(start_datetime_key, duration_key, shift, start_datetime_format=datetime_format):
-        start_datetime_str = shift[start_datetime_key].strip()
-        start_datetime = datetime.datetime.strptime(f'{start_datetime_str}', f'{start_datetime_format}')
-        duration_str = shift[duration_key].strip()
-        duration = datetime.timedelta(minutes=int(float(duration_str)))
-        end_datetime = start_datetime + duration
-        end_datetime_str = end_datetime.isoformat()
-        return {"shift_end_date": end_datetime_str, **shift}
+    def _shift_start_end(self, shift_dates, shifts_list):
+        """
+        Works out the ISO formatted start and end of every shift, parsing the whole batch at once
 
-    def _time_and_date_to_iso(self, time, date):
+        :param shift_dates: (list) %m/%d/%Y @shiftdate of the <date/> each shift was listed under
+        :param shifts_list: (list) of shift dicts, one for each of shift_dates
+        :return: (tuple) of the shift_end_date and shift_start_date lists of the shifts
+        :raises: ValueError if the actualstarttime of a shift is missing or cannot be parsed
+        """
+        times = pandas.Series([shift.get('actualstarttime') for shift in shifts_list], dtype=object)
+        missing = numpy.flatnonzero(times.isna().values)
+        if len(missing):
+            # these would otherwise come out as "NaT"
+            raise ValueError(f'Shift without an actualstarttime: {dict(shifts_list[missing[0]])}')
         # Older Tangier API servers return just %I:%M %p while newer ones have been updated to use
-        # %m/%d/%Y %I:%M %p. This is is not consistent across API v1.0, unfortunately so
-        # we have to check.
-        if self.full_date_regex.match(time):
-            datetime_str = time
-            datetime_fmt = f'{self.in_date_format} {self.time_format}'
-        else:
-            datetime_str = f'{time} {date}'
-            datetime_fmt = f'{self.time_format} {self.date_format}'
-        return datetime.datetime.strptime(datetime_str, datetime_fmt).isoformat()
+        # %m/%d/%Y %I:%M %p. This is not consistent across API v1.0, unfortunately, so we have to check.
+        full_date = times.str.match(self.full_date_pattern).fillna(False).astype(bool).values
+        start_dates = numpy.empty(len(shifts_list), dtype='datetime64[s]')
+        if full_date.any():
+            start_dates[full_date] = pandas.to_datetime(times[full_date],
+                                                        format=f'{self.in_date_format} {self.time_format}').values
+        if not full_date.all():
+            times_and_dates = times[~full_date] + ' ' + pandas.Series(shift_dates, dtype=object)[~full_date]
+            start_dates[~full_date] = pandas.to_datetime(times_and_dates,
+                                                         format=f'{self.time_format} {self.in_date_format}').values
+        minutes = pandas.Series([shift['reportedminutes'] for shift in shifts_list], dtype=object)
+        minutes = minutes.str.strip().astype(float).astype(int).values
+        end_dates = start_dates + minutes.astype('timedelta64[m]')
+        start_strs = numpy.datetime_as_string(start_dates, unit='s')
+        end_strs = numpy.datetime_as_string(end_dates, unit='s')
+        return end_strs.tolist(), start_strs.tolist()
 
     def get_schedule(self, start_date=None, end_date=None, site_id=None, emp_id=None, xml_string="", **tags):
         """
@@ -123,6 +115,13 @@ class ScheduleConnection:
         :param tags: (kwargs) things to be injected into the request.
         :return: xml response string with an error message or a schedule.
         """
+        with wrappers.timing_tags(method='get_schedule', site_id=site_id, emp_id=emp_id, start_date=start_date,
+                                  end_date=end_date):
+            return self.GetSchedule(self._get_schedule_request(start_date, end_date, site_id, emp_id, xml_string,
+                                                               **tags))
+
+    @wrappers.timed('build')
+    def _get_schedule_request(self, start_date=None, end_date=None, site_id=None, emp_id=None, xml_string="", **tags):
         if not start_date and end_date and (site_id or emp_id):
             raise APICallError('kwargs start_date, end_date, and (site_id or emp_id) are all required.')
         xml_string = xml_string if xml_string else self.base_xml
@@ -132,13 +131,12 @@ class ScheduleConnection:
         if emp_id:
             base_tags.update({"emp_id": str(emp_id)})
         base_tags.update({"start_date": start_date, "end_date": end_date, **tags})
-        xml_string = xmlmanip.inject_tags(xml_string, injection_index=2, schedule="")
-        xml_string = xmlmanip.inject_tags(xml_string, parent_tag="schedule", **base_tags)
+        xml_string = templates.build_request(xml_string, "schedule", **base_tags)
         if self.debug:
             self.last_request = xml_string
-        return self.GetSchedule(xml_string)
+        return xml_string
 
-    def get_schedules(self, start_date=None, end_date=None, site_ids=None, xml_string="", **tags):
+    def get_schedules(self, start_date=None, end_date=None, site_ids=None, xml_string="", max_workers=None, **tags):
         """
         Wrapper for the GetSchedule method which facilitates adding necessary tags to the default xml string.
         Pulls schedule for multiple sites for a given date range. Makes multiple API calls to get schedules from multiple facilities.
@@ -147,6 +145,7 @@ class ScheduleConnection:
         :param end_date: (str) %Y-%m-%d date string indicating the ending of the range from which to pull the schedule
         :param site_ids: (list or None) list of ids corresponding to the site(s) that the schedule will be pulled from, defaults to the list pulled from site_file in the __init__ function
         :param xml_string: (xml string) overrides the default credential and/or schedule injection into base_xml
+        :param max_workers: (int or None) number of sites to request concurrently; sites are requested one at a time if not provided
         :param tags: (kwargs) things to be injected into the request.
         :return: xml response string with an error message or a schedule.
         """
@@ -155,13 +154,14 @@ class ScheduleConnection:
         if not (site_ids and start_date and end_date):
             raise APICallError("Required kwarg site_ids must be an enumerable object of site_id's.")
         xml_string = xml_string if xml_string else self.base_xml
-        schedules = []
-        for site_id in site_ids:
-            schedules.append(self.get_schedule(site_id=site_id, start_date=start_date,
-                                               end_date=end_date, xml_string=xml_string))
-        return schedules
 
-    def get_schedule_values_list(self, start_date=None, end_date=None, site_ids=None, emp_ids=None, xml_string="", **tags):
+        def get_site_schedule(site_id):
+            return self.get_schedule(site_id=site_id, start_date=start_date, end_date=end_date, xml_string=xml_string)
+
+        return helpers.concurrent_map(get_site_schedule, site_ids, max_workers=max_workers)
+
+    def get_schedule_values_list(self, start_date=None, end_date=None, site_ids=None, emp_ids=None, xml_string="",
+                                 max_workers=None, parser='stream', **tags):
         """
         Wrapper for the get_schedules function that returns the retrieved schedules as a list of dicts. This can easily be converted into a DataFrame
 
@@ -170,9 +170,42 @@ class ScheduleConnection:
         :param site_ids: (list or None) list of ids corresponding to the site(s) that the schedule will be pulled from, defaults to the list pulled from site_file in the __init__ function
         :param emp_ids: (list or None) list of emp_ids corresponding to the employee(s) that the schedule will be pulled for
         :param xml_string: (xml string) overrides the default credential and/or schedule injection into base_xml
+        :param max_workers: (int or None) number of ids to request concurrently; ids are requested one at a time if not provided
+        :param parser: (str) "stream" to read responses with parsers.iter_schedule_shifts, "schema" to read them with xmlmanip.XMLSchema
         :param tags: (kwargs) things to be injected into the request.
         :return: (OrderedDict) filled with schedules.
         """
+        return self._get_schedule_columns(start_date, end_date, site_ids, emp_ids, xml_string, max_workers, parser,
+                                          **tags).to_records()
+
+    def _get_schedule_columns(self, start_date=None, end_date=None, site_ids=None, emp_ids=None, xml_string="",
+                              max_workers=None, parser='stream', **tags):
+        """
+        get_schedule_values_list as a parsers.ColumnAccumulator, which save_schedule_from_range turns into a DataFrame
+        without a dict per shift
+        """
+        id_type, id_list = self._get_schedule_ids(site_ids, emp_ids)
+        xml_string = xml_string if xml_string else self.base_xml
+
+        def get_id_columns(_id):
+            id_kwargs = {id_type: _id}
+            with wrappers.timing_tags(method='get_schedule_values_list', start_date=start_date, end_date=end_date,
+                                      **id_kwargs):
+                schedule_response = self.get_schedule(xml_string=xml_string, start_date=start_date, end_date=end_date,
+                                                      **id_kwargs, **tags)
+                return self._schedule_columns(schedule_response, parser)
+
+        columns = parsers.ColumnAccumulator()
+        for id_columns in helpers.concurrent_map(get_id_columns, id_list, max_workers=max_workers):
+            columns.extend(id_columns)
+        return columns
+
+    def _get_schedule_ids(self, site_ids=None, emp_ids=None):
+        """
+        Determines whether a schedule query is on site_ids or emp_ids
+
+        :return: (tuple) of the id tag name and the list of ids to query
+        """
         if not site_ids and not hasattr(self, 'site_ids') and not emp_ids:
             raise APICallError("kwarg site_ids or emp_ids is required.")
         elif (site_ids or hasattr(self, 'site_ids')) and emp_ids:
@@ -182,13 +215,44 @@ class ScheduleConnection:
         id_type = 'site_id' if site_ids else 'emp_id'
         id_list = site_ids if site_ids else emp_ids
         id_list = id_list if issubclass(id_list.__class__, list) else [id_list]
-        xml_string = xml_string if xml_string else self.base_xml
-        schedule_values_list = []
-        for _id in id_list:
-            id_kwargs = {id_type: _id}
-            schedule_response = self.get_schedule(xml_string=xml_string, start_date=start_date, end_date=end_date,
-                                                  **id_kwargs, **tags)
+        return id_type, id_list
+
+    def _schedule_values_list(self, schedule_response, parser='stream'):
+        """
+        Converts a single GetSchedule response into a list of shift dicts
+
+        :param schedule_response: (bytes) GetSchedule response
+        :param parser: (str) "stream" to read the response with parsers.iter_schedule_shifts, "schema" to read it with xmlmanip.XMLSchema
+        :return: (list) of shift dicts
+        """
+        return self._schedule_columns(schedule_response, parser).to_records()
+
+    @wrappers.timed('parse')
+    def _schedule_columns(self, schedule_response, parser='stream'):
+        """
+        Converts a single GetSchedule response into a parsers.ColumnAccumulator of shifts, with the same rows (in the
+        same order) as _schedule_values_list
+        """
+        shift_dates, shifts_list = [], []
+        if parser == 'stream':
+            for shift_date, shift in parsers.iter_schedule_shifts(schedule_response):
+                shift_dates.append(shift_date)
+                shifts_list.append(shift)
+            # XMLSchema.search returns the <date/> elements sorted on @shiftdate; keep the same order
+            order = sorted(range(len(shift_dates)), key=shift_dates.__getitem__)
+            shift_dates = [shift_dates[i] for i in order]
+            shifts_list = [shifts_list[i] for i in order]
+        elif parser == 'schema':
             temp_values_list = xmlmanip.XMLSchema(schedule_response).search('@shiftdate', "", comparison='ne')
             for shifts in temp_values_list:
-                schedule_values_list.extend(self._extract_shifts(shifts))
-        return schedule_values_list
\ No newline at end of file
+                shift = shifts['shifts']['shift']
+                shift = shift if issubclass(shift.__class__, list) else [shift]
+                shift_dates.extend([shifts['@shiftdate']] * len(shift))
+                shifts_list.extend(shift)
+        else:
+            raise APICallError(f'parser must be "stream" or "schema", not "{parser}".')
+        columns = parsers.ColumnAccumulator()
+        if shifts_list:
+            end_strs, start_strs = self._shift_start_end(shift_dates, shifts_list)
+            columns.extend_rows(shifts_list, shift_end_date=end_strs, shift_start_date=start_strs)
+        return columns
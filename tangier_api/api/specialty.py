@@ -1,5 +1,11 @@
+import contextvars
+import datetime
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy
 import pandas
 import re
 import xmlmanip
@@ -9,11 +15,53 @@ from tangier_api.api import ProviderConnection
 from tangier_api.api import LocationConnection
 from tangier_api import helpers
 from tangier_api import exceptions
+from tangier_api import parsers
+from tangier_api import policies
+from tangier_api import wrappers
+
+
+def _pair_positions(counts):
+    """
+    Expands counts into every (i, j) position pair where j is one of the counts[i] positions directly following i
+
+    :param counts: (numpy.ndarray) number of positions following each position that it is paired with
+    :return: (tuple) of numpy.ndarrays holding the first and second position of every pair
+    """
+    first = numpy.repeat(numpy.arange(len(counts)), counts)
+    offsets = numpy.arange(len(first)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return first, first + offsets + 1
+
+
+SCHEDULE_CATEGORIES = ('providername', 'siteid', 'location')
+
+
+def typed_schedule(df):
+    """
+    Converts a schedule DataFrame of strings (like saved_schedule) to compact types: shift_start_date and
+    shift_end_date become datetime64, reportedminutes an integer (float if some are missing), and the repetitive
+    columns in SCHEDULE_CATEGORIES categoricals. Columns that are missing are left out.
+
+    :param df: (DataFrame) schedule as saved by save_schedule_from_range
+    :return: (DataFrame) a typed copy of df
+    """
+    df = df.copy()
+    for column in ('shift_start_date', 'shift_end_date'):
+        if column in df.columns:
+            df[column] = pandas.to_datetime(df[column], format=ScheduleConnection.datetime_format)
+    if 'reportedminutes' in df.columns:
+        minutes = pandas.to_numeric(df['reportedminutes'], errors='coerce')
+        df['reportedminutes'] = minutes.astype('int32') if minutes.notna().all() else minutes
+    for column in SCHEDULE_CATEGORIES:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    return df
 
 
 class ScheduleManipulation(ScheduleConnection):
+    schedule_keys = ['provider_primary_key', 'shift_start_date', 'shift_end_date']  # columns shifts are compared on
 
-    def save_schedule_from_range(self, start_date=None, end_date=None, site_ids=None, xml_string="", **tags):
+    def save_schedule_from_range(self, start_date=None, end_date=None, site_ids=None, xml_string="", max_workers=None,
+                                 store=None, settle_days=7, max_age_days=None, planner=None, typed=False, **tags):
         """
         Saves schedule for indicated date range and facilities to ScheduleConnection object
 
@@ -21,21 +69,107 @@ class ScheduleManipulation(ScheduleConnection):
         :param end_date: (str) %Y-%m-%d date string indicating the ending of the range from which to pull the schedule
         :param site_ids: (list or None) list of ids corresponding to the site(s) that the schedule will be pulled from, defaults to the list pulled from site_file in the __init__ function
         :param xml_string: (xml string) overrides the default credential and/or schedule injection into base_xml
+        :param max_workers: (int or None) number of sites to request concurrently for each date range
+        :param store: (store.ScheduleStore) if provided, only windows that are new, recent or stale are downloaded and the rest are read from the store
+        :param settle_days: (int) with store, number of days after a window ends that its schedule may still be edited
+        :param max_age_days: (int or None) with store, re-download windows whose stored copy is older than this
+        :param planner: (helpers.WindowPlanner) if provided, every site is requested in windows sized by the planner instead of 8 week windows, and its stats are saved afterwards
+        :param typed: (bool) whether to save the schedule with the compact types of typed_schedule instead of strings
         :param tags: (kwargs) things to be injected into the request.
         :return:
         """
-        schedule_values_list = []
-        ranges = helpers.date_ranges(start_date, end_date)
+        schedule_columns = parsers.ColumnAccumulator()
+        if store is not None and planner is not None:
+            raise exceptions.APICallError('store keeps 8 week windows and cannot be combined with a planner.')
+        anchor = store.window_anchor if store is not None else None
+        ranges = helpers.date_ranges(start_date, end_date, anchor=anchor) if planner is None else []
+        if store is not None or planner is not None:
+            site_ids = self._get_schedule_ids(site_ids)[1]
+        if planner is not None:
+            def get_planned_columns(site_id):
+                return self._planned_columns(planner, site_id, start_date, end_date, xml_string, **tags)
+
+            try:
+                for site_columns in helpers.concurrent_map(get_planned_columns, site_ids, max_workers=max_workers):
+                    schedule_columns.extend(site_columns)
+            finally:
+                planner.save()
         for date_range in ranges:
             print(str(date_range))
-            schedule_values_list.extend(
-                self.get_schedule_values_list(date_range[0], date_range[1], site_ids, xml_string, **tags))
-        df = pandas.DataFrame(schedule_values_list)
-        if df.empty:
-            raise exceptions.APICallError('No schedule was returned in the given range.')
-        df = df.sort_values(['shift_start_date', 'shift_end_date']).reset_index()
-        df = df.drop(['index'], axis=1)
-        self.saved_schedule = df.copy()
+            if store is not None:
+                schedule_columns.extend_rows(
+                    self._sync_schedule_window(store, date_range, site_ids, xml_string, max_workers, settle_days,
+                                               max_age_days, **tags))
+                continue
+            schedule_columns.extend(
+                self._get_schedule_columns(date_range[0], date_range[1], site_ids, xml_string=xml_string,
+                                           max_workers=max_workers, **tags))
+        with wrappers.timing_tags(method='save_schedule_from_range', start_date=start_date, end_date=end_date), \
+                wrappers.stage_timer('pandas'):
+            df = schedule_columns.to_frame()
+            if df.empty:
+                raise exceptions.APICallError('No schedule was returned in the given range.')
+            df = df.sort_values(['shift_start_date', 'shift_end_date']).reset_index()
+            df = df.drop(['index'], axis=1)
+            self.saved_schedule = typed_schedule(df) if typed else df.copy()
+
+    def _sync_schedule_window(self, store, date_range, site_ids, xml_string="", max_workers=None, settle_days=7,
+                              max_age_days=None, **tags):
+        """
+        Downloads the sites whose copy of date_range in store needs a refresh, saves them to the store, and returns
+        the shifts of every site in date_range in the same order get_schedule_values_list would. Every site is saved
+        as soon as it is downloaded, so the sites that failed are the only ones downloaded again on the next sync.
+        """
+        query = store.query_key(**tags)
+        stale_site_ids = [site_id for site_id in site_ids
+                          if store.needs_refresh(site_id, *date_range, query, settle_days, max_age_days)]
+
+        def sync_site(site_id):
+            site_values_list = self.get_schedule_values_list(date_range[0], date_range[1], [site_id],
+                                                             xml_string=xml_string, **tags)
+            store.save_window(site_id, *date_range, site_values_list, query)
+
+        helpers.concurrent_map(sync_site, stale_site_ids, max_workers=max_workers)
+        schedule_values_list = []
+        for site_id in site_ids:
+            schedule_values_list.extend(store.load_window(site_id, *date_range, query))
+        return schedule_values_list
+
+    def _planned_columns(self, planner, site_id, start_date, end_date, xml_string="", **tags):
+        """
+        Requests the schedule of one site from start_date to end_date in windows sized by planner, re-planning after
+        every window. A window that times out (see policies.is_window_error) is split in half and requested again
+        until it is min_days long; any other error is raised right away.
+
+        :return: (parsers.ColumnAccumulator) of the shifts of the site
+        """
+        start = datetime.datetime.strptime(start_date, self.date_format)
+        end = datetime.datetime.strptime(end_date, self.date_format)
+        schedule_columns = parsers.ColumnAccumulator()
+        split_days = None
+        while start <= end:
+            planned_days = planner.window_days(site_id)
+            window_end = min(start + datetime.timedelta(days=min(planned_days, split_days or planned_days) - 1), end)
+            days = (window_end - start).days + 1
+            date_range = (start.strftime(self.date_format), window_end.strftime(self.date_format))
+            print(str((site_id, *date_range)))
+            started = time.monotonic()
+            try:
+                schedule_response = self.get_schedule(start_date=date_range[0], end_date=date_range[1],
+                                                      site_id=site_id, xml_string=xml_string, **tags)
+            except Exception as error:
+                if not policies.is_window_error(error) or days <= planner.min_days:
+                    raise
+                # a window cut short by end_date or by an earlier split says nothing new about the planned length
+                if days == planned_days:
+                    planner.record_failure(site_id, days)
+                split_days = max(planner.min_days, days // 2)
+                continue
+            planner.record(site_id, days, len(schedule_response), time.monotonic() - started)
+            schedule_columns.extend(self._schedule_columns(schedule_response))
+            start = window_end + datetime.timedelta(days=1)
+            split_days = None
+        return schedule_columns
 
     def get_schedule_open(self, info=False):
         """
@@ -44,11 +178,12 @@ class ScheduleManipulation(ScheduleConnection):
         :param info: (bool) whether or not to print out progress
         :return: (DataFrame) of all entries from schedule which were not worked (reportedminutes == 0)
         """
-        if self.saved_schedule is None:
-            raise exceptions.APICallError('There must be a saved schedule from save_schedule_from_range.')
-        df = self.saved_schedule.copy()
-        open_df = df[df['providername'] == 'open']
-        return open_df
+        self._check_saved_schedule()
+        return self.saved_schedule[self._open_mask(self.saved_schedule)]
+
+    @staticmethod
+    def _open_mask(df):
+        return (df['providername'] == 'open').values
 
     def get_schedule_empties(self, info=False):
         """
@@ -57,12 +192,27 @@ class ScheduleManipulation(ScheduleConnection):
         :param info: (bool) whether or not to print out progress
         :return: (DataFrame) of all entries from schedule which were not worked (reportedminutes == 0)
         """
+        self._check_saved_schedule()
+        return self.saved_schedule[self._empty_mask(self.saved_schedule)]
+
+    @staticmethod
+    def _empty_mask(df):
+        # reportedminutes is a string unless the schedule is typed
+        minutes = df['reportedminutes']
+        return (minutes == 0 if pandas.api.types.is_numeric_dtype(minutes) else minutes == '0').values
+
+    def _check_saved_schedule(self, provider_primary_key=False):
+        """
+        Raises APICallError if there is no saved_schedule, or (with provider_primary_key) if it has no
+        provider_primary_key column
+        """
         if self.saved_schedule is None:
             raise exceptions.APICallError('There must be a saved schedule from save_schedule_from_range.')
-        df = self.saved_schedule.copy()
-        empties = df[df['reportedminutes'] == '0']
-        return empties
+        if provider_primary_key and not 'provider_primary_key' in self.saved_schedule.columns:
+            raise exceptions.APICallError('get_schedule_conflicts, and get_schedule_duplicates '
+                               'rely on use of provider_primary_key=True.')
 
+    @wrappers.timed('pandas')
     def get_schedule_conflicts(self, info=False):
         """
         Gets DataFrame of all entries where an employee worked a double-booked shift in the saved_schedule
@@ -70,40 +220,46 @@ class ScheduleManipulation(ScheduleConnection):
         :param info: (bool) whether or not to print out progress
         :return: (DataFrame) of all entries where an employee worked a double-booked shift
         """
-        if self.saved_schedule is None:
-            raise exceptions.APICallError('There must be a saved schedule from save_schedule_from_range.')
-        df = self.saved_schedule.copy()
-        if not 'provider_primary_key' in df.columns:
-            raise exceptions.APICallError('get_schedule_conflicts, and get_schedule_duplicates '
-                               'rely on use of provider_primary_key=True.')
-        df = df.sort_values(['shift_start_date', 'shift_end_date'])
-        conflict_df = pandas.DataFrame()
-        unique_ids = list(df['provider_primary_key'].dropna().unique())
-        for c, emp_id in enumerate(unique_ids):
-            if (c % 13 == 12 or c == len(unique_ids) - 1) and info:
-                print(f'{(c+1)/len(unique_ids)*100:>5.2f}%')
+        self._check_saved_schedule(provider_primary_key=True)
+        return self._schedule_conflicts(self.saved_schedule[self.schedule_keys], info)
+
+    @staticmethod
+    def _schedule_conflicts(df, info=False):
+        """
+        get_schedule_conflicts of the rows of df, which holds the schedule_keys columns of (some of) saved_schedule
+        """
+        df = df[df['provider_primary_key'].notna()].sort_values(['shift_start_date', 'shift_end_date'])
+        # group each provider's shifts together while keeping them in start order
+        codes = pandas.factorize(df['provider_primary_key'])[0]
+        order = numpy.argsort(codes, kind='stable')
+        starts = pandas.to_datetime(df['shift_start_date']).values[order]
+        ends = pandas.to_datetime(df['shift_end_date']).values[order]
+        bounds = [0, *(numpy.flatnonzero(numpy.diff(codes[order])) + 1), len(order)]
+        # a shift conflicts with every later shift of the same provider that starts before it ends
+        counts = numpy.zeros(len(order), dtype=int)
+        for c, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if (c % 13 == 12 or c == len(bounds) - 2) and info:
+                print(f'{(c+1)/(len(bounds)-1)*100:>5.2f}%')
             elif info:
-                print(f'{(c+1)/len(unique_ids)*100:>5.2f}%', end=',  ')
-            emp_sched = df.loc[df['provider_primary_key'] == emp_id]
-            for i, row in emp_sched.iterrows():
-                for j, row2 in emp_sched.iterrows():
-                    if j <= i:
-                        continue
-                    elif row2['shift_start_date'] > row['shift_end_date']:
-                        break
-                    if ((row['shift_start_date'] < row2['shift_end_date']) and (
-                            row['shift_end_date'] > row2['shift_start_date'])):
-                        row['conflict_shift_start_date'], row['conflict_shift_end_date'] = row2['shift_start_date'], \
-                                                                                           row2['shift_end_date']
-                        row['conflict_index'] = j
-                        conflict_df = conflict_df.append(
-                            row[['conflict_index', 'provider_primary_key', 'shift_start_date',
-                                 'shift_end_date', 'conflict_shift_start_date',
-                                 'conflict_shift_end_date']])
-        if not conflict_df.empty:
-            conflict_df['conflict_index'] = conflict_df['conflict_index'].astype(int)
+                print(f'{(c+1)/(len(bounds)-1)*100:>5.2f}%', end=',  ')
+            stops = numpy.searchsorted(starts[lo:hi], ends[lo:hi], side='left')
+            counts[lo:hi] = numpy.maximum(stops - numpy.arange(hi - lo) - 1, 0)
+        first, second = _pair_positions(counts)
+        if not len(first):
+            return pandas.DataFrame()
+        first, second = order[first], order[second]
+        labels = df.index.values
+        conflict_df = pandas.DataFrame({
+            'conflict_index': labels[second].astype(int),
+            'provider_primary_key': df['provider_primary_key'].values[first],
+            'shift_start_date': df['shift_start_date'].values[first],
+            'shift_end_date': df['shift_end_date'].values[first],
+            'conflict_shift_start_date': df['shift_start_date'].values[second],
+            'conflict_shift_end_date': df['shift_end_date'].values[second],
+        }, index=labels[first])
         return conflict_df
 
+    @wrappers.timed('pandas')
     def get_schedule_duplicates(self, info=False):
         """
         Gets DataFrame of all duplicate entries in the saved_schedule
@@ -111,38 +267,46 @@ class ScheduleManipulation(ScheduleConnection):
         :param info: (bool) whether or not to print out progress
         :return: (DataFrame) of all duplicate entries
         """
-        if self.saved_schedule is None:
-            raise exceptions.APICallError('There must be a saved schedule from save_schedule_from_range.')
-        df = self.saved_schedule.copy()
-        if not 'provider_primary_key' in df.columns:
-            raise exceptions.APICallError('get_schedule_conflicts, and get_schedule_duplicates '
-                               'rely on use of provider_primary_key=True.')
-        dupe_df = pandas.DataFrame()
-        unique_ids = list(df['provider_primary_key'].dropna().unique())
-        for c, emp_id in enumerate(unique_ids):
-            if (c % 13 == 12 or c == len(unique_ids) - 1) and info:
-                print(f'{(c+1)/len(unique_ids)*100:>5.2f}%')
-            elif info:
-                print(f'{(c+1)/len(unique_ids)*100:>5.2f}%', end=',  ')
-            emp_sched = df.loc[df['provider_primary_key'] == emp_id]
-            for i, row in emp_sched.iterrows():
-                for j, row2 in emp_sched.iterrows():
-                    if j <= i:
-                        continue
-                    elif row2['shift_start_date'] > row['shift_end_date']:
-                        break
-                    if ((row['shift_start_date'] == row2['shift_start_date']) and (
-                            row['shift_end_date'] == row2['shift_end_date'])):
-                        row['dupe_shift_start_date'], row['dupe_shift_end_date'] = row2['shift_start_date'], row2[
-                            'shift_end_date']
-                        row['dupe_index'] = j
-                        dupe_df = dupe_df.append(
-                            row[['dupe_index', 'provider_primary_key', 'shift_start_date', 'shift_end_date',
-                                 'dupe_shift_start_date', 'dupe_shift_end_date']])
-        if not dupe_df.empty:
-            dupe_df['dupe_index'] = dupe_df['dupe_index'].astype(int)
+        self._check_saved_schedule(provider_primary_key=True)
+        return self._schedule_duplicates(self.saved_schedule[self.schedule_keys])
+
+    @classmethod
+    def _schedule_duplicates(cls, df):
+        """
+        get_schedule_duplicates of the rows of df, which holds the schedule_keys columns of (some of) saved_schedule
+        """
+        keys = cls.schedule_keys
+        df = df[df['provider_primary_key'].notna()]
+        # rows sharing a provider, start and end hash to the same group; rows with a missing key are never duplicates
+        groups = df.groupby(keys, sort=False).ngroup().values
+        df = df[groups >= 0]
+        groups = groups[groups >= 0]
+        # every row is paired with each of the rows that follow it in its group
+        order = numpy.argsort(groups, kind='stable')
+        sorted_groups = groups[order]
+        sizes = numpy.bincount(sorted_groups)
+        group_starts = numpy.cumsum(sizes) - sizes
+        counts = sizes[sorted_groups] - (numpy.arange(len(order)) - group_starts[sorted_groups]) - 1
+        first, second = _pair_positions(counts)
+        if not len(first):
+            return pandas.DataFrame()
+        first, second = order[first], order[second]
+        # report pairs provider by provider, in saved_schedule order
+        provider_codes = pandas.factorize(df['provider_primary_key'])[0]
+        pair_order = numpy.lexsort((second, first, provider_codes[first]))
+        first, second = first[pair_order], second[pair_order]
+        labels = df.index.values
+        dupe_df = pandas.DataFrame({
+            'dupe_index': labels[second].astype(int),
+            'provider_primary_key': df['provider_primary_key'].values[first],
+            'shift_start_date': df['shift_start_date'].values[first],
+            'shift_end_date': df['shift_end_date'].values[first],
+            'dupe_shift_start_date': df['shift_start_date'].values[second],
+            'dupe_shift_end_date': df['shift_end_date'].values[second],
+        }, index=labels[first])
         return dupe_df
 
+    @wrappers.timed('pandas')
     def generate_duplicates_report(self, dupes):
         dupes = dupes.reset_index()
         # dupes_left will have originals, dupes_right will have duplicates of originals
@@ -151,17 +315,18 @@ class ScheduleManipulation(ScheduleConnection):
         dupes_left = self.saved_schedule.loc[dupes['index']].reset_index()
         dupes_right = self.saved_schedule.loc[dupes['dupe_index']].reset_index()
         # we append and sort on the two indices, the final result has alternating rows of orignals and duplicates
-        dupes_append = dupes_left.append(dupes_right).reset_index().sort_values(['level_0', 'index'])
+        dupes_append = pandas.concat([dupes_left, dupes_right]).reset_index().sort_values(['level_0', 'index'])
         dupes_append = dupes_append.set_index(['level_0'])
         return dupes_append
 
+    @wrappers.timed('pandas')
     def generate_conflicts_report(self, conflicts):
         conflicts = conflicts.reset_index()
         conflicts_left = self.saved_schedule.loc[conflicts['index']].reset_index()
         if not 'index' in conflicts.columns or not 'conflict_index' in conflicts.columns:
             return pandas.DataFrame()
         conflicts_right = self.saved_schedule.loc[conflicts['conflict_index']].reset_index()
-        conflicts_append = conflicts_left.append(conflicts_right).reset_index().sort_values(['level_0', 'index'])
+        conflicts_append = pandas.concat([conflicts_left, conflicts_right]).reset_index().sort_values(['level_0', 'index'])
         conflicts_append = conflicts_append.set_index(['level_0'])
         return conflicts_append
 
@@ -250,6 +415,46 @@ class ScheduleManipulation(ScheduleConnection):
                 'An unexpected number of entries were removed; this indicates an issue with the saved schedule.')
         print(f'Removed {rows_to_remove} conflicts.')
 
+    @wrappers.timed('pandas')
+    def clean_schedule(self, open=True, empties=True, duplicates=True, conflicts=True):
+        """
+        Removes open shifts, empties, duplicates and conflicts from the saved_schedule in one drop, like calling the
+        corresponding remove_schedule_* methods in that order, without copying saved_schedule for each of them.
+        Duplicates are looked for among the shifts that are left after open shifts and empties, and conflicts among
+        the shifts that are left after duplicates.
+
+        :param open: (bool) whether to remove open shifts (providername == 'open')
+        :param empties: (bool) whether to remove shifts that were not worked (reportedminutes == 0)
+        :param duplicates: (bool) whether to remove duplicates of other shifts
+        :param conflicts: (bool) whether to remove both shifts of every conflict
+        :return: (dict) the removed open shifts and empties, and the duplicates and conflicts reports, by kind
+        """
+        self._check_saved_schedule(provider_primary_key=duplicates or conflicts)
+        schedule = self.saved_schedule
+        keep = numpy.ones(len(schedule), dtype=bool)
+        reports = {}
+        for kind, remove, get_mask in (('open', open, self._open_mask), ('empties', empties, self._empty_mask)):
+            if remove:
+                removed = get_mask(schedule) & keep
+                reports[kind] = schedule[removed]
+                keep &= ~removed
+        if duplicates:
+            dupe_df = self._schedule_duplicates(schedule.loc[keep, self.schedule_keys])
+            reports['duplicates'] = self.generate_duplicates_report(dupe_df)
+            if not dupe_df.empty:
+                keep &= ~schedule.index.isin(dupe_df['dupe_index'])
+        if conflicts:
+            conflict_df = self._schedule_conflicts(schedule.loc[keep, self.schedule_keys])
+            reports['conflicts'] = self.generate_conflicts_report(conflict_df)
+            if not conflict_df.empty:
+                keep &= ~schedule.index.isin(numpy.concatenate([conflict_df.index.values,
+                                                                conflict_df['conflict_index'].values]))
+        rows_to_remove = len(keep) - int(keep.sum())
+        if rows_to_remove:
+            self.saved_schedule = schedule[keep]
+        print(f'Removed {rows_to_remove} shifts.')
+        return reports
+
 
 class ProviderReport(ProviderConnection):
 
@@ -263,30 +468,41 @@ class ProviderReport(ProviderConnection):
             self.df = pandas.read_excel(file)
         super(ProviderReport, self).__init__(*args, **kwargs)
 
-    def add_to_report(self, *args, key_column="provider_id"):
+    def add_to_report(self, *args, key_column="provider_id", batch_size=100, max_workers=None):
         """
-        Adds the specified provider information to an excel or csv report according to NPI (emp_id)
+        Adds the specified provider information to an excel or csv report according to NPI (emp_id). Only the
+        providers on the report are requested, batch_size emp_ids per request.
 
         :param args: (list) of provider fields to be retrieved from tangier and added to the report
         :param key_column: (str) indicates the header name of the column that contains npis or emp_ids on the report
+        :param batch_size: (int or None) most emp_ids sent in one request
+        :param max_workers: (int or None) number of requests sent concurrently
         :return: None
         """
         clean_ids = lambda x: int(float(x)) if not re.findall('[a-zA-Z]', f'{x}') else 0
         self.df[key_column] = self.df[key_column].apply(clean_ids)
         self.df[key_column] = self.df[key_column].astype(str)
-        provider_ids = list(self.df[key_column].unique())
-        info_list = self.provider_info_values_list(provider_ids=provider_ids)
+        # ids that could not be read are 0 and match no provider
+        provider_ids = [provider_id for provider_id in self.df[key_column].unique() if provider_id != '0']
+        info_list = self.provider_info_values_list(provider_ids=provider_ids, use_primary_keys=False,
+                                                   all_providers=False, batch_size=batch_size,
+                                                   max_workers=max_workers) if provider_ids else []
         get_if_in_keys = lambda x, key: x[key] if key in x.keys() else ''
         columns_to_add = {arg: f'provider_{arg}' for arg in args}
-        for column in columns_to_add.values():
-            self.df[column] = ''
+        # the first provider listed for an emp_id is the one that goes on the report
+        providers = {}
+        for provider_info in info_list:
+            providers.setdefault(provider_info.get("emp_id"), provider_info)
+        provider_df = pandas.DataFrame.from_dict(
+            {emp_id: {df_column: get_if_in_keys(provider_info, dict_key)
+                      for dict_key, df_column in columns_to_add.items()}
+             for emp_id, provider_info in providers.items()},
+            orient='index', columns=list(columns_to_add.values()))
+        matched = self.df[key_column].isin(provider_df.index)
+        for df_column in columns_to_add.values():
+            self.df[df_column] = self.df[key_column].map(provider_df[df_column]).where(matched, '')
         original_index_name = self.df.index.name
         self.df = self.df.reset_index()
-        for index, row in self.df.iterrows():
-            provider_info = [*filter(lambda x: x.get("emp_id") == row[key_column], info_list)]
-            if provider_info:
-                for dict_key, df_column in columns_to_add.items():
-                    self.df.loc[index, f'{df_column}'] = get_if_in_keys(provider_info[0], dict_key)
 
         columns = list(self.df.columns.values)
         reordered_columns = [key_column, *columns_to_add.values()]
@@ -321,33 +537,75 @@ class ScheduleWithData:
     def _get_location_info(self):
         self.locations = pandas.DataFrame(self.lconn.location_info_values_list(site_ids='ALL_SITE_IDS')).fillna('')
 
-    def save_schedule_from_range(self, start_date, end_date):
+    def save_schedule_from_range(self, start_date, end_date, max_workers=None):
         self._get_provider_info()
         self._get_location_info()
         self.sconn.save_schedule_from_range(start_date, end_date,
                                             site_ids=list(self.locations['site_id'].unique()),
-                                            include_provider_primary_key='true')
+                                            max_workers=max_workers, include_provider_primary_key='true')
         self.saved_schedule = self.sconn.saved_schedule
-        self.temp_locations = self.locations.drop(columns=['@action', 'is_scheduled']) \
-            .rename(columns={'name': 'site_name', 'short_name': 'site_short_name'})
-        self.temp_providers = self.providers.drop(
-            columns=['@action', 'processed', 'comment', 'street', 'city', 'state', 'zip'])
-        with_sites = self.saved_schedule.merge(self.temp_locations, how='left', left_on=['siteid'],
-                                               right_on=['site_id']).drop(columns=['location'])
-        with_all = with_sites.merge(self.temp_providers, how='left', left_on=['providerprimarykey'],
-                                    right_on=['provider_primary_key'])
-        with_all = with_all.drop(columns=['empid', 'siteid', 'providerprimarykey'])
-        self.saved_schedule = with_all.fillna('')
+        with wrappers.timing_tags(method='ScheduleWithData.save_schedule_from_range'), wrappers.stage_timer('pandas'):
+            self.temp_locations = self.locations.drop(columns=['@action', 'is_scheduled']) \
+                .rename(columns={'name': 'site_name', 'short_name': 'site_short_name'})
+            self.temp_providers = self.providers.drop(
+                columns=['@action', 'processed', 'comment', 'street', 'city', 'state', 'zip'])
+            with_sites = self.saved_schedule.merge(self.temp_locations, how='left', left_on=['siteid'],
+                                                   right_on=['site_id']).drop(columns=['location'])
+            with_all = with_sites.merge(self.temp_providers, how='left', left_on=['providerprimarykey'],
+                                        right_on=['provider_primary_key'])
+            with_all = with_all.drop(columns=['empid', 'siteid', 'providerprimarykey'])
+            self.saved_schedule = with_all.fillna('')
         self.sconn.saved_schedule = self.saved_schedule
 
 
+class StreamProgress:
+    """
+    ProviderLocations progress callback that writes every finished site_id to a stream, starting a new line before
+    the line gets longer than 79 characters
+
+    :param stream: (file-like) where progress is written, defaults to sys.stdout
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.current_line = ''
+
+    def __call__(self, site_id, completed, total):
+        stream = self.stream if self.stream else sys.stdout
+        new_line = f'{self.current_line + " " if self.current_line else ""}{site_id}'
+        if len(new_line) > 79:
+            new_line = f'{site_id} '
+            stream.write('\n')
+            stream.write(new_line)
+        else:
+            stream.write(f'{site_id} ')
+        stream.flush()
+        self.current_line = new_line
+
+
 class ProviderLocations:
 
-    def __init__(self, pconn, lconn):
+    def __init__(self, pconn, lconn, max_workers=None, progress=None):
+        """
+        :param pconn: (ProviderConnection) connection the provider info is requested with
+        :param lconn: (LocationConnection) connection the locations are requested with
+        :param max_workers: (int or None) number of sites to request providers for concurrently; sites are requested one at a time if not provided
+        :param progress: (callable) called as progress(site_id, completed, total) after the providers of each site are in, defaults to a StreamProgress writing to stdout
+        """
         self.pconn = pconn
         self.lconn = lconn
-        self.all_locations = lconn.location_info_values_list()
-        self.all_providers = pconn.provider_info_values_list(all_providers=True)
+        self.max_workers = max_workers
+        self.progress = progress if progress is not None else StreamProgress()
+        if max_workers and max_workers > 1:
+            # the locations and the providers do not depend on each other, so they are requested together
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                locations = executor.submit(contextvars.copy_context().run, lconn.location_info_values_list)
+                providers = executor.submit(contextvars.copy_context().run, pconn.provider_info_values_list,
+                                            all_providers=True)
+                self.all_locations, self.all_providers = locations.result(), providers.result()
+        else:
+            self.all_locations = lconn.location_info_values_list()
+            self.all_providers = pconn.provider_info_values_list(all_providers=True)
         self.all_location_provider_values = []
 
     @property
@@ -364,32 +622,28 @@ class ProviderLocations:
         self.__all_location_provider_values = [*val]
 
     def _get_all_location_provider_values(self):
-        values_list, current_line = [], ''
-        for location in self.all_locations:
-            values_list.extend(self.location_provider_values(location['site_id']))
-            current_line = self._print_stream(location['site_id'], current_line)
+        site_ids = [location['site_id'] for location in self.all_locations]
+        lock, completed = threading.Lock(), [0]
+
+        def get_site_values(site_id):
+            site_values = self.location_provider_values(site_id)
+            with lock:
+                completed[0] += 1
+                self.progress(site_id, completed[0], len(site_ids))
+            return site_values
+
+        values_list = []
+        for site_values in helpers.concurrent_map(get_site_values, site_ids, max_workers=self.max_workers):
+            values_list.extend(site_values)
         self.all_location_provider_values = [*values_list]
         return values_list
 
-    def _print_stream(self, current_item, current_line):
-        new_line = f'{current_line + " " if current_line else ""}{current_item}'
-        if len(new_line) > 79:
-            new_line = f'{current_item} '
-            sys.stdout.write('\n')
-            sys.stdout.write(new_line)
-        else:
-            sys.stdout.write(f'{current_item} ')
-        sys.stdout.flush()
-        return new_line
-
     def location_provider_info(self, site_id):
         """
         Sends a provider info request info for all provider_ids for one site_id
         :param site_id_in: (str) site_id to get provider info for
         :return: xml with a provider info response
         """
-        xml_string = self.pconn.base_xml
-        xml_string = xmlmanip.inject_tags(xml_string, injection_index=2, providers="")
         provider_dict = {
             'provider': {
                 "action": "info", "__inner_tag": {
@@ -398,8 +652,7 @@ class ProviderLocations:
                 }
             }
         }
-        xml_string = xmlmanip.inject_tags(xml_string, parent_tag="providers", **provider_dict)
-        return self.pconn.MaintainProviders(xml_string).encode('utf-8')
+        return self.pconn.MaintainProviders(self.pconn._providers_request(provider_dict)).encode('utf-8')
 
     def location_provider_values(self, site_id):
         location_provider_info_response = self.location_provider_info(site_id)
@@ -407,11 +660,14 @@ class ProviderLocations:
         location_provider_values = location_provider_info_schema.search(site_id__ne='')
         return location_provider_values
 
+    @wrappers.timed('pandas')
     def join_all_locations_with_all_providers(self):
-        normalized_provider_location_values = self.all_location_provider_values
-        normalized_provider_location_values_df = pandas.DataFrame(normalized_provider_location_values)
+        """
+        Inner join of the providers listed for every site with the info of all providers, in one merge on
+        (provider_primary_key, emp_id)
+
+        :return: (DataFrame)
+        """
+        location_providers_df = pandas.DataFrame(self.all_location_provider_values)
         provider_info_df = pandas.DataFrame(self.all_providers)
-        joined_df = normalized_provider_location_values_df.merge(provider_info_df, how='inner',
-                                                                 left_on=['provider_primary_key', 'emp_id'],
-                                                                 right_on=['provider_primary_key', 'emp_id'])
-        return joined_df
+        return location_providers_df.merge(provider_info_df, how='inner', on=['provider_primary_key', 'emp_id'])
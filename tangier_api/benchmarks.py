@@ -0,0 +1,298 @@
+"""
+Benchmarks that compare the optimized code paths against the implementations they replaced, and a suite that runs
+the end-to-end calls against a local fake_tangier server. Nothing here talks to Tangier; every benchmark runs against
+synthetic data.
+
+Run with ``python -m tangier_api.benchmarks``
+"""
+import datetime
+import random
+import time
+import timeit
+import tracemalloc
+
+import pandas
+import xmlmanip
+
+from tangier_api import fake_tangier
+from tangier_api import templates
+from tangier_api import wrappers
+from tangier_api.api import ScheduleManipulation, ProviderConnection, LocationConnection, ScheduleWithData
+
+
+def synthetic_schedule(providers=50, shifts_per_provider=40, seed=0):
+    """
+    Builds a DataFrame shaped like ScheduleManipulation.saved_schedule with a mix of overlapping and duplicate shifts
+
+    :param providers: (int) number of distinct provider_primary_keys
+    :param shifts_per_provider: (int) number of shifts scheduled for each provider
+    :param seed: (int) random seed, the same seed always produces the same schedule
+    :return: (DataFrame) sorted on shift_start_date, shift_end_date with a fresh RangeIndex
+    """
+    rnd = random.Random(seed)
+    origin = datetime.datetime(2018, 1, 1)
+    rows = []
+    for provider in range(1, providers + 1):
+        for _ in range(shifts_per_provider):
+            start = origin + datetime.timedelta(hours=rnd.randrange(0, 24 * 7 * 52, 2))
+            minutes = rnd.choice([0, 240, 480, 720, 1440])
+            row = {
+                'shift_end_date': (start + datetime.timedelta(minutes=minutes)).isoformat(),
+                'shift_start_date': start.isoformat(),
+                'providername': f'Provider {provider}',
+                'provider_primary_key': str(provider),
+                'siteid': f'SITE-{rnd.randint(1, 10)}',
+                'reportedminutes': str(minutes),
+            }
+            rows.append(row)
+            if rnd.random() < 0.05:
+                rows.append({**row})
+    df = pandas.DataFrame(rows)
+    df = df.sort_values(['shift_start_date', 'shift_end_date']).reset_index()
+    return df.drop(['index'], axis=1)
+
+
+def schedule_manipulation(saved_schedule):
+    """
+    ScheduleManipulation holding saved_schedule that never connects to Tangier
+    """
+    sconn = ScheduleManipulation.__new__(ScheduleManipulation)
+    sconn.saved_schedule = saved_schedule
+    return sconn
+
+
+def _append(df, row):
+    return pandas.concat([df, row.to_frame().T])
+
+
+def legacy_schedule_conflicts(saved_schedule):
+    """
+    The nested iterrows implementation that ScheduleManipulation.get_schedule_conflicts replaced
+    """
+    df = saved_schedule.copy()
+    df = df.sort_values(['shift_start_date', 'shift_end_date'])
+    conflict_df = pandas.DataFrame()
+    unique_ids = list(df['provider_primary_key'].dropna().unique())
+    for c, emp_id in enumerate(unique_ids):
+        emp_sched = df.loc[df['provider_primary_key'] == emp_id]
+        for i, row in emp_sched.iterrows():
+            for j, row2 in emp_sched.iterrows():
+                if j <= i:
+                    continue
+                elif row2['shift_start_date'] > row['shift_end_date']:
+                    break
+                if ((row['shift_start_date'] < row2['shift_end_date']) and (
+                        row['shift_end_date'] > row2['shift_start_date'])):
+                    row['conflict_shift_start_date'], row['conflict_shift_end_date'] = row2['shift_start_date'], \
+                                                                                       row2['shift_end_date']
+                    row['conflict_index'] = j
+                    conflict_df = _append(conflict_df, row[['conflict_index', 'provider_primary_key',
+                                                            'shift_start_date', 'shift_end_date',
+                                                            'conflict_shift_start_date', 'conflict_shift_end_date']])
+    if not conflict_df.empty:
+        conflict_df['conflict_index'] = conflict_df['conflict_index'].astype(int)
+    return conflict_df
+
+
+def legacy_schedule_duplicates(saved_schedule):
+    """
+    The nested iterrows implementation that ScheduleManipulation.get_schedule_duplicates replaced
+    """
+    df = saved_schedule.copy()
+    dupe_df = pandas.DataFrame()
+    unique_ids = list(df['provider_primary_key'].dropna().unique())
+    for c, emp_id in enumerate(unique_ids):
+        emp_sched = df.loc[df['provider_primary_key'] == emp_id]
+        for i, row in emp_sched.iterrows():
+            for j, row2 in emp_sched.iterrows():
+                if j <= i:
+                    continue
+                elif row2['shift_start_date'] > row['shift_end_date']:
+                    break
+                if ((row['shift_start_date'] == row2['shift_start_date']) and (
+                        row['shift_end_date'] == row2['shift_end_date'])):
+                    row['dupe_shift_start_date'], row['dupe_shift_end_date'] = row2['shift_start_date'], row2[
+                        'shift_end_date']
+                    row['dupe_index'] = j
+                    dupe_df = _append(dupe_df, row[['dupe_index', 'provider_primary_key', 'shift_start_date',
+                                                    'shift_end_date', 'dupe_shift_start_date', 'dupe_shift_end_date']])
+    if not dupe_df.empty:
+        dupe_df['dupe_index'] = dupe_df['dupe_index'].astype(int)
+    return dupe_df
+
+
+def _same_rows(legacy, current):
+    if legacy.empty or current.empty:
+        return legacy.empty and current.empty
+    return legacy.astype(str).equals(current[list(legacy.columns)].astype(str)) and \
+        list(legacy.index) == list(current.index)
+
+
+def _compare(name, legacy, current, number, same_output=_same_rows):
+    legacy_seconds = timeit.timeit(legacy, number=number) / number
+    current_seconds = timeit.timeit(current, number=number) / number
+    same = same_output(legacy(), current())
+    print(f'{name:<28} legacy {legacy_seconds:>9.6f}s   current {current_seconds:>9.6f}s   '
+          f'speedup {legacy_seconds / current_seconds:>8.1f}x   same output: {same}')
+    return legacy_seconds, current_seconds, same
+
+
+def benchmark_schedule_conflicts(providers=50, shifts_per_provider=40, number=1):
+    saved_schedule = synthetic_schedule(providers, shifts_per_provider)
+    sconn = schedule_manipulation(saved_schedule)
+    return _compare('get_schedule_conflicts', lambda: legacy_schedule_conflicts(saved_schedule),
+                    sconn.get_schedule_conflicts, number)
+
+
+def benchmark_schedule_duplicates(providers=50, shifts_per_provider=40, number=1):
+    saved_schedule = synthetic_schedule(providers, shifts_per_provider)
+    sconn = schedule_manipulation(saved_schedule)
+    return _compare('get_schedule_duplicates', lambda: legacy_schedule_duplicates(saved_schedule),
+                    sconn.get_schedule_duplicates, number)
+
+
+def legacy_request(xml_string, container, **tags):
+    """
+    The two inject_tags calls every request used to be built with
+    """
+    xml_string = xmlmanip.inject_tags(xml_string, injection_index=2, **{container: ""})
+    return xmlmanip.inject_tags(xml_string, parent_tag=container, **tags)
+
+
+def benchmark_request_templates(number=2000):
+    schedule_xml = xmlmanip.inject_tags('<tangier version="1.0" method="schedule.request"></tangier>',
+                                        user_name='username', user_pwd='password')
+    provider_xml = xmlmanip.inject_tags('<tangier version="1.0" method="provider.request"></tangier>',
+                                        admin_user='username', admin_pwd='password')
+
+    def schedule_tags():
+        return {'site_id': 'SITE-1', 'start_date': '2018-01-01', 'end_date': '2018-01-31'}
+
+    def provider_tags():
+        return {f'provider__{i}': {'action': 'info', '__inner_tag': {'emp_id': str(i)}} for i in range(20)}
+
+    results = []
+    for name, xml_string, container, tags in [('schedule request', schedule_xml, 'schedule', schedule_tags),
+                                              ('provider request', provider_xml, 'providers', provider_tags)]:
+        results.append(_compare(name, lambda: legacy_request(xml_string, container, **tags()),
+                                lambda: templates.build_request(xml_string, container, **tags()), number,
+                                same_output=lambda legacy, current: legacy == current))
+    return results
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def _measure(name, call, rows, memory=True):
+    """
+    Runs call once for time, throughput and the latency of its SOAP calls, then once more under tracemalloc for its
+    peak memory
+
+    :param name: (str) printed name of the benchmark
+    :param call: (callable) the benchmarked call
+    :param rows: (callable) rows(result) gives the number of rows (shifts, providers, ...) the call handled
+    :param memory: (bool) whether to measure the peak memory, which takes a second, slower run
+    :return: (dict) with seconds, rows, rows_per_second, requests, p50_ms and p95_ms (latency of the SOAP calls, None
+        if there were none) and peak_mib (None if memory is False)
+    """
+    latencies = []
+
+    def network_sink(stage, seconds, tags):
+        if stage == 'network':
+            latencies.append(seconds)
+
+    wrappers.add_timing_sink(network_sink)
+    try:
+        started = time.perf_counter()
+        result = call()
+        seconds = time.perf_counter() - started
+    finally:
+        wrappers.remove_timing_sink(network_sink)
+    peak_mib = None
+    if memory:
+        tracemalloc.start()
+        try:
+            call()
+            peak_mib = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    count = rows(result)
+    measurement = {
+        'seconds': seconds, 'rows': count, 'rows_per_second': count / seconds if seconds else None,
+        'requests': len(latencies),
+        'p50_ms': _percentile(latencies, 50) * 1000 if latencies else None,
+        'p95_ms': _percentile(latencies, 95) * 1000 if latencies else None,
+        'peak_mib': peak_mib,
+    }
+    latency = f"p50 {measurement['p50_ms']:>8.2f}ms p95 {measurement['p95_ms']:>8.2f}ms" if latencies else \
+        f'{"":>30}'
+    memory_text = f'peak {peak_mib:>8.1f}MiB' if peak_mib is not None else ''
+    print(f'{name:<42} {seconds:>9.3f}s {count:>9} rows {measurement["rows_per_second"] or 0:>11.0f} rows/s '
+          f'{len(latencies):>5} requests {latency} {memory_text}')
+    return measurement
+
+
+def benchmark_fake_tangier(sites=10, providers=200, shifts_per_day=6, days=120, max_workers=10, latency=0.0,
+                           memory=True, seed=0):
+    """
+    Runs get_schedule_values_list, save_schedule_from_range, ScheduleWithData.save_schedule_from_range and the
+    conflict and duplicate detectors against a fake_tangier server in a child process
+
+    :param sites: (int) number of sites, every one of which is requested
+    :param providers: (int) number of providers
+    :param shifts_per_day: (int) shifts per site and day
+    :param days: (int) length of the requested date range
+    :param max_workers: (int or None) passed on to the calls that request sites concurrently
+    :param latency: (float) seconds the server delays every response by
+    :param memory: (bool) whether to measure peak memory (runs every call twice)
+    :param seed: (int) random seed of the synthetic data
+    :return: (dict) of the _measure results, keyed by benchmark name
+    """
+    data = fake_tangier.FakeTangierData(sites=sites, providers=providers, shifts_per_day=shifts_per_day, seed=seed)
+    start = datetime.date(2018, 1, 1)
+    start_date, end_date = start.isoformat(), (start + datetime.timedelta(days=days - 1)).isoformat()
+    results = {}
+    with fake_tangier.FakeTangierProcess(data, latency) as server:
+        endpoints = server.endpoints
+        sconn = ScheduleManipulation(endpoint=endpoints['schedule'])
+        pconn = ProviderConnection(endpoint=endpoints['provider'])
+        lconn = LocationConnection(endpoint=endpoints['location'])
+        print(f'{sites} sites, {providers} providers, {shifts_per_day} shifts per site and day, {days} days, '
+              f'max_workers={max_workers}, latency={latency}s')
+        results['get_schedule_values_list'] = _measure(
+            'get_schedule_values_list',
+            lambda: sconn.get_schedule_values_list(start_date, end_date, list(data.site_ids), max_workers=max_workers),
+            len, memory)
+
+        def save_schedule_from_range():
+            sconn.save_schedule_from_range(start_date, end_date, list(data.site_ids), max_workers=max_workers)
+            return sconn.saved_schedule
+
+        results['save_schedule_from_range'] = _measure('save_schedule_from_range', save_schedule_from_range, len,
+                                                       memory)
+        with_data = ScheduleWithData(sconn, pconn, lconn)
+
+        def save_schedule_with_data():
+            with_data.save_schedule_from_range(start_date, end_date, max_workers=max_workers)
+            return with_data.saved_schedule
+
+        results['ScheduleWithData'] = _measure('ScheduleWithData.save_schedule_from_range', save_schedule_with_data,
+                                               len, memory)
+        # the detectors need provider_primary_key, which ScheduleWithData joins in; their rows are the shifts checked
+        scheduled = len(sconn.saved_schedule)
+        results['get_schedule_conflicts'] = _measure('get_schedule_conflicts', sconn.get_schedule_conflicts,
+                                                     lambda conflicts: scheduled, memory)
+        results['get_schedule_duplicates'] = _measure('get_schedule_duplicates', sconn.get_schedule_duplicates,
+                                                      lambda duplicates: scheduled, memory)
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_schedule_conflicts()
+    benchmark_schedule_duplicates()
+    benchmark_request_templates()
+    benchmark_fake_tangier()
@@ -0,0 +1,123 @@
+"""
+Shared pieces of the bulk maintenance calls (LocationConnection.maintain_locations and
+ProviderConnection.maintain_providers). Operations are packed many to a request and every element of a response is
+mapped back to the operation it answers, so a bad operation (or a failed request) only fails the operations it
+concerns.
+"""
+import io
+
+from lxml import etree
+
+from tangier_api import exceptions
+from tangier_api import helpers
+from tangier_api import parsers
+from tangier_api import wrappers
+
+# everything a single request can fail with
+CALL_ERRORS = helpers.CALL_ERRORS
+
+
+def operation_result(operation, result=None, error=None):
+    """
+    :param operation: (dict) operation as it was passed in
+    :param result: (dict or None) element of the response that answers the operation
+    :param error: (BaseException or None) why the operation failed, None if it succeeded
+    :return: (dict) with the keys "operation", "result" and "error"
+    """
+    return {'operation': operation, 'result': result, 'error': error}
+
+
+def prepare(operations, operation_tag, batch_size):
+    """
+    Builds the tag of every operation and splits the valid ones into batches
+
+    :param operations: (list) of operation dicts
+    :param operation_tag: (callable) operation_tag(operation) returns the tag for inject_tags or raises APICallError
+    :param batch_size: (int or None) most operations per request
+    :return: (tuple) results, with an error result for every invalid operation and None for the others, and a list
+        of batches, each a list of (index in operations, tag) tuples
+    """
+    results, pending = [None] * len(operations), []
+    for i, operation in enumerate(operations):
+        try:
+            pending.append((i, operation_tag(operation)))
+        except CALL_ERRORS as e:
+            results[i] = operation_result(operation, error=e)
+    return results, helpers.chunks(pending, batch_size)
+
+
+def collect(results, batches, batch_results):
+    """
+    Puts the results of every batch in place in results
+
+    :return: (list) results, one for every operation, in the order of the operations
+    """
+    for batch, results_of_batch in zip(batches, batch_results):
+        for (i, tag), result in zip(batch, results_of_batch):
+            results[i] = result
+    return results
+
+
+def response_items(response, container):
+    """
+    :param response: (str or bytes) response of a bulk request
+    :param container: (str) tag of the element holding one element per operation, i.e. "locations"
+    :return: (list or None) the children of container converted with parsers.element_to_dict, None if the response has
+        no container
+    """
+    if isinstance(response, str):
+        response = response.encode('utf-8')
+    root = etree.parse(io.BytesIO(response)).getroot()
+    element = next(root.iter(container), None)
+    if element is None:
+        return None
+    return [parsers.element_to_dict(child) for child in element if isinstance(child.tag, str)]
+
+
+@wrappers.timed('parse')
+def map_results(operations, response, container, id_keys):
+    """
+    Maps the elements of a bulk response to the operations of the request, in order if there is one element per
+    operation, otherwise on the first of id_keys they share. An operation whose element holds an error message (see
+    wrappers.element_errors) gets an APIError.
+
+    :param operations: (list) of the operations sent in the request, in the order they were sent
+    :param response: (str or bytes) response of the request
+    :param container: (str) tag of the element holding one element per operation, i.e. "locations"
+    :param id_keys: (tuple) keys identifying an operation, i.e. ("site_id",)
+    :return: (list) of operation_result dicts, one for every operation
+    """
+    items = response_items(response, container)
+    if not items:
+        # nothing to map, so an error anywhere in the response (bad credentials, ...) applies to every operation
+        errors = wrappers.Response(response).errors()
+        error = exceptions.APIError(errors if errors else f'The response has no <{container}/> results.')
+        return [operation_result(operation, error=error) for operation in operations]
+    if len(items) != len(operations):
+        items = _match_items(operations, items, id_keys)
+    results = []
+    for operation, item in zip(operations, items):
+        if item is None:
+            error = exceptions.APIError(f'The response has no result for {operation}.')
+        else:
+            errors = wrappers.element_errors(item) if isinstance(item, dict) else []
+            error = exceptions.APIError(errors) if errors else None
+        results.append(operation_result(operation, item, error))
+    return results
+
+
+def _match_items(operations, items, id_keys):
+    matched, claimed = [], set()
+    for operation in operations:
+        match = None
+        for j, item in enumerate(items):
+            if j in claimed or not isinstance(item, dict):
+                continue
+            key = next((key for key in id_keys if key in operation and key in item), None)
+            if key is not None and f'{operation[key]}' == item[key]:
+                match = j
+                break
+        if match is not None:
+            claimed.add(match)
+        matched.append(items[match] if match is not None else None)
+    return matched
@@ -0,0 +1,200 @@
+"""
+Response caches for the info calls of ProviderConnection and LocationConnection. Provider and location lists change
+rarely, so reports that re-fetch them on every run can read them from a cache instead. Entries are keyed on the
+request xml, expire after a per-entry ttl and are invalidated by any add/update/delete sent through the connection
+that owns the cache.
+"""
+import abc
+import collections
+import hashlib
+import os
+import re
+import threading
+import time
+
+_ACTION_PATTERN = re.compile(r'''action\s*=\s*["']([^"']*)["']''')
+
+
+def request_actions(xml_string):
+    """
+    :param xml_string: (str or bytes) request xml
+    :return: (list) the action attribute of every element of the request, in order
+    """
+    if isinstance(xml_string, bytes):
+        xml_string = xml_string.decode('utf-8')
+    return _ACTION_PATTERN.findall(xml_string)
+
+
+def is_info_request(xml_string):
+    """
+    Whether every action in a Maintain* request is "info", i.e. whether sending it cannot change anything
+
+    :param xml_string: (str or bytes) request xml
+    :return: (bool)
+    """
+    return all(action.lower() == 'info' for action in request_actions(xml_string))
+
+
+def _digest(key):
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    return hashlib.sha256(key).hexdigest()
+
+
+class BaseCache(abc.ABC):
+    """
+    Interface shared by the cache backends
+
+    :param ttl: (int or float) default number of seconds an entry stays valid
+    """
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+
+    @abc.abstractmethod
+    def get(self, key):
+        """
+        :return: the cached value, or None if key is missing or expired
+        """
+
+    @abc.abstractmethod
+    def set(self, key, value, ttl=None):
+        """
+        Caches value under key for ttl seconds (the cache's default ttl if not provided)
+        """
+
+    @abc.abstractmethod
+    def invalidate(self, key=None):
+        """
+        Removes key from the cache, or every entry if key is not provided
+        """
+
+    def _expires_at(self, ttl):
+        return time.time() + (self.ttl if ttl is None else ttl)
+
+
+class MemoryCache(BaseCache):
+    """
+    Thread-safe in-memory LRU cache
+
+    :param maxsize: (int) number of entries kept before the least recently used one is dropped
+    :param ttl: (int or float) default number of seconds an entry stays valid
+    """
+    def __init__(self, maxsize=128, ttl=3600):
+        super(MemoryCache, self).__init__(ttl)
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (self._expires_at(ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+class DiskCache(BaseCache):
+    """
+    Cache that writes every entry to its own text file in directory, so it survives between runs and can be shared by
+    several processes. Values must be (xml) strings: a file holds the expiry time on its first line and the value
+    after it, so nothing read from directory is ever unpickled or executed.
+
+    Only writes sent through a connection that was given a DiskCache on directory clear it (invalidate removes every
+    entry in directory, whichever DiskCache wrote it). Writes made without such a connection, by another tool or in
+    Tangier itself, are only picked up once the entries expire or after invalidate() is called (or the directory's
+    files are deleted).
+
+    :param directory: (str) directory the entries are written to; created (readable by its owner only) if it does not
+        exist
+    :param ttl: (int or float) default number of seconds an entry stays valid
+    """
+    suffix = '.tangier-cache'
+
+    def __init__(self, directory, ttl=3600):
+        super(DiskCache, self).__init__(ttl)
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, _digest(key) + self.suffix)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8', newline='') as f:
+                expires_at = float(f.readline())
+                value = f.read()
+        except (OSError, ValueError):
+            # missing, or not an entry this cache wrote
+            return None
+        if expires_at < time.time():
+            self._remove(path)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        if not isinstance(value, str):
+            raise TypeError(f'DiskCache only stores strings, not {value.__class__.__name__}.')
+        path = self._path(key)
+        # write to a temporary file first so that a concurrent reader never sees a partial entry
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}'
+        with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(f'{self._expires_at(ttl)!r}\n')
+            f.write(value)
+        os.replace(temp_path, path)
+
+    def invalidate(self, key=None):
+        if key is not None:
+            self._remove(self._path(key))
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                self._remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def cached(cache, key, fetch, cacheable=None):
+    """
+    Returns the value cached under key, calling fetch() and caching its result on a miss
+
+    :param cache: (BaseCache or None) cache to use; fetch() is always called if None
+    :param key: cache key
+    :param fetch: (callable) called with no arguments to produce the value
+    :param cacheable: (callable or None) cacheable(value) is false for values that must not be cached, e.g. error
+        responses; every value is cached if not provided
+    """
+    if cache is None:
+        return fetch()
+    value = cache.get(key)
+    if value is None:
+        value = fetch()
+        if cacheable is None or cacheable(value):
+            cache.set(key, value)
+    return value
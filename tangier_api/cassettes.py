@@ -0,0 +1,133 @@
+"""
+Record and replay of Tangier traffic. A Cassette in "record" mode stores every SOAP response (and the WSDL and XSD
+documents) the clients receive; in "replay" mode the clients are answered from it without any network access, so
+parsing and post-processing can be profiled on real payloads offline and expensive report pipelines can be rerun
+without hitting Tangier. Cassettes are gzip compressed JSON files. Requests are only stored as a hash, which keeps the
+credentials in them out of the file.
+
+    cassette = cassettes.Cassette('/tmp/nightly.json.gz', mode='record')
+    clients.set_cassette(cassette)
+    ...  # run the pipeline against Tangier
+    clients.set_cassette(None)  # saves the cassette
+"""
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+import requests.structures
+
+from tangier_api import exceptions
+
+MODES = ('record', 'replay')
+
+
+def request_key(address, message, headers):
+    """
+    :param address: (str) url the request is posted to
+    :param message: (bytes or str) SOAP envelope
+    :param headers: (dict) HTTP headers of the request
+    :return: (str) what a request is looked up by in a cassette
+    """
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+    digest = hashlib.sha256(f"{address}\n{headers.get('SOAPAction', '')}\n".encode('utf-8'))
+    digest.update(message)
+    return digest.hexdigest()
+
+
+class Cassette:
+    """
+    :param path: (str) cassette file; read if it exists, written by save in record mode
+    :param mode: (str) "record" to store the responses of real requests, "replay" to answer from the file
+    :param latency: (float, str or None) in replay mode, seconds to wait before every response, "recorded" to wait as
+        long as the recorded request took, or None to answer right away
+    """
+
+    def __init__(self, path, mode='replay', latency=None):
+        if mode not in MODES:
+            raise exceptions.APICallError(f'mode must be one of {", ".join(MODES)}, not {mode}.')
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.interactions = {}
+        self.documents = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                contents = json.load(f)
+            self.interactions = contents.get('interactions', {})
+            self.documents = contents.get('documents', {})
+        elif mode == 'replay':
+            raise exceptions.APICallError(f'Cassette {path} does not exist; record it first.')
+
+    @property
+    def recording(self):
+        return self.mode == 'record'
+
+    def record(self, address, message, headers, response, seconds):
+        """
+        Stores the response of a request
+
+        :param response: (requests.Response) what Tangier answered
+        :param seconds: (float) how long the request took
+        """
+        with self._lock:
+            self.interactions[request_key(address, message, headers)] = {
+                'address': address,
+                'action': headers.get('SOAPAction', ''),
+                'status': response.status_code,
+                'headers': {key: value for key, value in response.headers.items()
+                            if key.lower() in ('content-type', 'soapaction')},
+                'content': base64.b64encode(response.content).decode('ascii'),
+                'seconds': seconds,
+            }
+
+    def replay(self, address, message, headers):
+        """
+        :return: (requests.Response) the recorded response of the request, after the configured latency
+        :raises: exceptions.APICallError if the request was never recorded
+        """
+        interaction = self.interactions.get(request_key(address, message, headers))
+        if interaction is None:
+            raise exceptions.APICallError(f'Cassette {self.path} has no recorded response for this '
+                                          f'{headers.get("SOAPAction", "")} request to {address}.')
+        delay = interaction['seconds'] if self.latency == 'recorded' else self.latency
+        if delay:
+            time.sleep(delay)
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.headers = requests.structures.CaseInsensitiveDict(interaction['headers'])
+        response._content = base64.b64decode(interaction['content'])
+        response.url = address
+        return response
+
+    def record_document(self, url, content):
+        with self._lock:
+            self.documents[url] = base64.b64encode(content).decode('ascii')
+
+    def document(self, url):
+        """
+        :return: (bytes) the recorded WSDL or XSD document at url
+        :raises: exceptions.APICallError if it was never recorded
+        """
+        if url not in self.documents:
+            raise exceptions.APICallError(f'Cassette {self.path} has no recorded document for {url}.')
+        return base64.b64decode(self.documents[url])
+
+    def save(self):
+        """
+        Writes the cassette to path (in record mode only); the file is replaced atomically
+        """
+        if not self.recording:
+            return
+        with self._lock:
+            contents = {'version': 1, 'interactions': self.interactions, 'documents': self.documents}
+            temporary_path = f'{self.path}.tmp'
+            with gzip.open(temporary_path, 'wt', encoding='utf-8') as f:
+                json.dump(contents, f)
+            os.replace(temporary_path, self.path)
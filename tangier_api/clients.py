@@ -0,0 +1,205 @@
+"""
+Process-wide zeep clients. Every connection to the same endpoint shares one zeep.Client, and the WSDL and XSD
+documents behind it are kept in an on-disk zeep.cache.SqliteCache, so only the first connection a machine makes in
+wsdl_cache_timeout seconds downloads and parses anything. Every request they send goes through the CallPolicy
+returned by get_policy (see policies.py), over the pooled requests.Session returned by get_session, unless a
+cassette (see cassettes.py) records or replays them.
+"""
+import atexit
+import threading
+import time
+
+import requests
+import requests.adapters
+import zeep
+import zeep.cache
+import zeep.transports
+
+from tangier_api import cassettes
+from tangier_api import policies
+from tangier_api import settings
+
+_clients = {}
+_clients_lock = threading.Lock()
+_cache = None
+_session = None
+_session_lock = threading.Lock()
+_policy = None
+_policy_lock = threading.Lock()
+_cassette = None
+_cassette_loaded = False
+
+
+def get_cache():
+    """
+    The on-disk WSDL/XSD cache configured by wsdl_cache and wsdl_cache_timeout in tangier.conf
+
+    :return: (zeep.cache.SqliteCache or None) None when wsdl_cache_timeout is 0
+    """
+    global _cache
+    if not settings.WSDL_CACHE_TIMEOUT:
+        return None
+    if _cache is None:
+        _cache = zeep.cache.SqliteCache(path=settings.WSDL_CACHE or None, timeout=settings.WSDL_CACHE_TIMEOUT)
+    return _cache
+
+
+def get_session():
+    """
+    The requests.Session shared by every client, with the connection pool, keep-alive and compression configured by
+    http_pool_connections, http_pool_maxsize, http_keep_alive and http_compress in tangier.conf
+
+    :return: (requests.Session)
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                                                    pool_maxsize=settings.HTTP_POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['Connection'] = 'keep-alive' if settings.HTTP_KEEP_ALIVE else 'close'
+            session.headers['Accept-Encoding'] = 'gzip, deflate' if settings.HTTP_COMPRESS else 'identity'
+            _session = session
+        return _session
+
+
+def get_timeout():
+    """
+    :return: (tuple) (connect, read) timeout in seconds from http_connect_timeout and http_read_timeout in
+        tangier.conf, None for no limit
+    """
+    return settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT
+
+
+def get_policy():
+    """
+    The CallPolicy shared by every Tangier request of the process, configured by rate_limit, rate_burst,
+    retry_attempts, retry_backoff, retry_max_backoff, circuit_failures and circuit_reset in tangier.conf
+
+    :return: (policies.CallPolicy)
+    """
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = policies.CallPolicy(
+                rate_limit=policies.TokenBucket(settings.RATE_LIMIT, settings.RATE_BURST) if settings.RATE_LIMIT
+                else None,
+                retry=policies.RetryPolicy(settings.RETRY_ATTEMPTS, settings.RETRY_BACKOFF,
+                                           settings.RETRY_MAX_BACKOFF),
+                breaker=policies.CircuitBreaker(settings.CIRCUIT_FAILURES, settings.CIRCUIT_RESET)
+                if settings.CIRCUIT_FAILURES else None)
+        return _policy
+
+
+def set_policy(policy):
+    """
+    Replaces the CallPolicy of every client, including ones that already exist
+
+    :param policy: (policies.CallPolicy or None) None goes back to the policy configured in tangier.conf
+    """
+    global _policy
+    with _policy_lock:
+        _policy = policy
+
+
+class PolicyTransport(zeep.transports.Transport):
+    """
+    zeep Transport sending every request through get_policy(); only GetSchedule and "info" requests are retried
+    """
+
+    def post(self, address, message, headers):
+        send = super(PolicyTransport, self).post
+        return get_policy().call(lambda: send(address, message, headers),
+                                 idempotent=policies.is_idempotent(message, headers))
+
+
+class CassetteTransport(PolicyTransport):
+    """
+    PolicyTransport that records every response (and WSDL or XSD document) into a cassettes.Cassette, or answers
+    from one without touching the network
+    """
+
+    def __init__(self, cassette, *args, **kwargs):
+        self.cassette = cassette
+        super(CassetteTransport, self).__init__(*args, **kwargs)
+
+    def post(self, address, message, headers):
+        if not self.cassette.recording:
+            return self.cassette.replay(address, message, headers)
+        started = time.monotonic()
+        response = super(CassetteTransport, self).post(address, message, headers)
+        self.cassette.record(address, message, headers, response, time.monotonic() - started)
+        return response
+
+    def load(self, url):
+        if not self.cassette.recording:
+            return self.cassette.document(url)
+        content = super(CassetteTransport, self).load(url)
+        self.cassette.record_document(url, content)
+        return content
+
+
+def get_cassette():
+    """
+    The cassette set with set_cassette or, if there is none, the one configured by cassette and cassette_mode in
+    tangier.conf (saved when the interpreter exits)
+
+    :return: (cassettes.Cassette or None)
+    """
+    global _cassette, _cassette_loaded
+    with _clients_lock:
+        if not _cassette_loaded:
+            _cassette_loaded = True
+            if settings.CASSETTE:
+                _cassette = cassettes.Cassette(settings.CASSETTE, settings.CASSETTE_MODE or 'replay')
+                atexit.register(_cassette.save)
+        return _cassette
+
+
+def set_cassette(cassette):
+    """
+    Makes every client record into or replay from cassette; the clients created so far are replaced and the
+    previous cassette is saved
+
+    :param cassette: (cassettes.Cassette or None) None goes back to plain network access
+    """
+    global _cassette, _cassette_loaded
+    previous = get_cassette()
+    with _clients_lock:
+        _cassette, _cassette_loaded = cassette, True
+        _clients.clear()
+    if previous is not None and previous is not cassette:
+        previous.save()
+
+
+def get_client(endpoint):
+    """
+    Returns the zeep.Client for endpoint, creating it the first time the endpoint is requested
+
+    :param endpoint: where the WSDL info is with routing info and SOAP API definitions
+    :return: (zeep.Client)
+    """
+    cassette = get_cassette()
+    with _clients_lock:
+        if endpoint not in _clients:
+            options = dict(cache=get_cache(), session=get_session(), timeout=get_timeout(),
+                           operation_timeout=get_timeout())
+            transport = CassetteTransport(cassette, **options) if cassette is not None else PolicyTransport(**options)
+            _clients[endpoint] = zeep.Client(endpoint, transport=transport)
+        return _clients[endpoint]
+
+
+def clear_clients():
+    """
+    Forgets every client created by get_client and closes the shared session; the next connection to each endpoint
+    will load its WSDL again (from the on-disk cache, if it is enabled)
+    """
+    global _session
+    with _clients_lock:
+        _clients.clear()
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
@@ -3,4 +3,26 @@ class APICallError(BaseException):
 
 
 class APIError(BaseException):
-    pass
\ No newline at end of file
+    pass
+
+
+class ConcurrentCallError(APIError):
+    """
+    Raised when one or more of the calls made by helpers.concurrent_map failed.
+
+    errors is a list of (item, exception) pairs in input order and results holds the value returned for every item
+    (None where the call failed).
+    """
+    def __init__(self, errors, results):
+        self.errors = errors
+        self.results = results
+        details = '; '.join(f'{item}: {error!r}' for item, error in errors)
+        super(ConcurrentCallError, self).__init__(f'{len(errors)} of {len(results)} calls failed ({details})')
+
+
+class CircuitOpenError(APIError):
+    """
+    Raised without sending the request while the circuit breaker of policies.CallPolicy is open, i.e. after too many
+    Tangier requests in a row failed.
+    """
+    pass
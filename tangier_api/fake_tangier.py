@@ -0,0 +1,355 @@
+"""
+Local stand-in for the Tangier SOAP services, for benchmarks and offline development. FakeTangierServer serves WSDLs
+for the schedulerequest, ProviderMaintenance and LocationMaintenance services (generated here, shaped like the
+originals: one string in and one string out per operation) and answers GetSchedule, MaintainProviders and
+MaintainLocations from a FakeTangierData of synthetic sites, providers and shifts.
+"""
+import datetime
+import gzip
+import multiprocessing
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+NAMESPACE = 'http://tangierweb.com/webservices/'
+SOAP_NAMESPACE = 'http://schemas.xmlsoap.org/soap/envelope/'
+SERVICES = {
+    'schedule': ('/webservices/schedulerequest/schedulerequest.asmx', 'ScheduleRequest', 'GetSchedule'),
+    'provider': ('/webservices/ProviderMaintenance/ProviderMaintenance.asmx', 'ProviderMaintenance',
+                 'MaintainProviders'),
+    'location': ('/webservices/LocationMaintenance/LocationMaintenance.asmx', 'LocationMaintenance',
+                 'MaintainLocations'),
+}
+WSDL_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<wsdl:definitions xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/" xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+                  xmlns:s="http://www.w3.org/2001/XMLSchema" xmlns:tns="{namespace}" targetNamespace="{namespace}">
+  <wsdl:types>
+    <s:schema elementFormDefault="qualified" targetNamespace="{namespace}">
+      <s:element name="{operation}">
+        <s:complexType><s:sequence>
+          <s:element minOccurs="0" maxOccurs="1" name="xmlString" type="s:string"/>
+        </s:sequence></s:complexType>
+      </s:element>
+      <s:element name="{operation}Response">
+        <s:complexType><s:sequence>
+          <s:element minOccurs="0" maxOccurs="1" name="{operation}Result" type="s:string"/>
+        </s:sequence></s:complexType>
+      </s:element>
+    </s:schema>
+  </wsdl:types>
+  <wsdl:message name="{operation}SoapIn"><wsdl:part name="parameters" element="tns:{operation}"/></wsdl:message>
+  <wsdl:message name="{operation}SoapOut"><wsdl:part name="parameters" element="tns:{operation}Response"/></wsdl:message>
+  <wsdl:portType name="{service}Soap">
+    <wsdl:operation name="{operation}">
+      <wsdl:input message="tns:{operation}SoapIn"/>
+      <wsdl:output message="tns:{operation}SoapOut"/>
+    </wsdl:operation>
+  </wsdl:portType>
+  <wsdl:binding name="{service}Soap" type="tns:{service}Soap">
+    <soap:binding transport="http://schemas.xmlsoap.org/soap/http"/>
+    <wsdl:operation name="{operation}">
+      <soap:operation soapAction="{namespace}{operation}" style="document"/>
+      <wsdl:input><soap:body use="literal"/></wsdl:input>
+      <wsdl:output><soap:body use="literal"/></wsdl:output>
+    </wsdl:operation>
+  </wsdl:binding>
+  <wsdl:service name="{service}">
+    <wsdl:port name="{service}Soap" binding="tns:{service}Soap"><soap:address location="{address}"/></wsdl:port>
+  </wsdl:service>
+</wsdl:definitions>"""
+
+
+def generate_wsdl(service, address):
+    """
+    :param service: (str) "schedule", "provider" or "location"
+    :param address: (str) url the service is posted to
+    :return: (str) the WSDL of the service
+    """
+    path, name, operation = SERVICES[service]
+    return WSDL_TEMPLATE.format(namespace=NAMESPACE, service=name, operation=operation, address=address)
+
+
+def service_endpoints(url):
+    """
+    :param url: (str) root url of a FakeTangierServer, e.g. http://127.0.0.1:8000
+    :return: (dict) WSDL url of every service, keyed "schedule", "provider" and "location"
+    """
+    return {service: f'{url}{path}?WSDL' for service, (path, name, operation) in SERVICES.items()}
+
+
+def _element(parent, tag, text=None, **attributes):
+    element = etree.SubElement(parent, tag, **attributes)
+    if text is not None:
+        element.text = text
+    return element
+
+
+class FakeTangierData:
+    """
+    Synthetic sites, providers and schedules. Shifts are generated on demand from (seed, site_id, date), so any date
+    range can be requested without holding the schedule in memory and the same request always gets the same shifts.
+
+    :param sites: (int) number of sites (SITE-1, SITE-2, ...)
+    :param providers: (int) number of providers, with provider_primary_keys 1, 2, ... and emp_ids E1, E2, ...
+    :param shifts_per_day: (int) shifts scheduled per site and day
+    :param open_rate: (float) share of shifts without a provider (providername "open")
+    :param empty_rate: (float) share of shifts that were not worked (reportedminutes 0)
+    :param duplicate_rate: (float) share of shifts that are listed twice
+    :param seed: (int) random seed
+    """
+
+    def __init__(self, sites=10, providers=100, shifts_per_day=6, open_rate=0.05, empty_rate=0.05,
+                 duplicate_rate=0.02, seed=0):
+        self.site_ids = [f'SITE-{i}' for i in range(1, sites + 1)]
+        self.provider_keys = [str(i) for i in range(1, providers + 1)]
+        self.shifts_per_day = shifts_per_day
+        self.open_rate = open_rate
+        self.empty_rate = empty_rate
+        self.duplicate_rate = duplicate_rate
+        self.seed = seed
+
+    def location(self, site_id):
+        number = site_id.split('-')[-1]
+        return {'site_id': site_id, 'name': f'Site {number}', 'short_name': f'S{number}', 'is_scheduled': 'true'}
+
+    def provider(self, provider_key):
+        return {'provider_primary_key': provider_key, 'emp_id': f'E{provider_key}', 'npi': f'{provider_key:0>10}',
+                'first_name': f'First{provider_key}', 'last_name': f'Last{provider_key}',
+                'email': f'provider{provider_key}@example.com', 'street': f'{provider_key} Main St',
+                'city': 'Springfield', 'state': 'OK', 'zip': '73000', 'processed': 'true',
+                'comment': 'Provider found.'}
+
+    def shifts(self, site_id, date):
+        """
+        :param site_id: (str) site the shifts are at
+        :param date: (datetime.date) day the shifts start on
+        :return: (list) of shift dicts with the tags of a <shift/> in a GetSchedule response
+        """
+        rnd = random.Random(f'{self.seed}-{site_id}-{date.isoformat()}')
+        shifts = []
+        for _ in range(self.shifts_per_day):
+            start = datetime.datetime.combine(date, datetime.time(rnd.choice([0, 6, 7, 8, 12, 18, 19])))
+            minutes = 0 if rnd.random() < self.empty_rate else rnd.choice([480, 600, 720])
+            provider_key = rnd.choice(self.provider_keys)
+            is_open = rnd.random() < self.open_rate
+            shift = {
+                'actualstarttime': start.strftime('%m/%d/%Y %I:%M %p'),
+                'reportedminutes': str(minutes),
+                'providername': 'open' if is_open else f'Last{provider_key}, First{provider_key}',
+                'empid': '' if is_open else f'E{provider_key}',
+                'providerprimarykey': '' if is_open else provider_key,
+                'siteid': site_id,
+                'location': f'Unit {rnd.randint(1, 4)}',
+            }
+            shifts.append(shift)
+            if rnd.random() < self.duplicate_rate:
+                shifts.append(dict(shift))
+        return shifts
+
+    def get_schedule(self, request):
+        """
+        :param request: (lxml.etree._Element) root of a GetSchedule request
+        :return: (lxml.etree._Element) root of the response
+        """
+        start = datetime.datetime.strptime(request.findtext('.//start_date'), '%Y-%m-%d').date()
+        end = datetime.datetime.strptime(request.findtext('.//end_date'), '%Y-%m-%d').date()
+        site_id, emp_id = request.findtext('.//site_id'), request.findtext('.//emp_id')
+        with_keys = (request.findtext('.//include_provider_primary_key') or '').lower() == 'true'
+        site_ids = [site_id] if site_id else self.site_ids
+        root = etree.Element('tangier', version='1.0', method='schedule.reply')
+        schedule = _element(root, 'schedule')
+        date = start
+        while date <= end:
+            shifts = [shift for site in site_ids for shift in self.shifts(site, date)
+                      if not emp_id or shift['empid'] == emp_id]
+            if shifts:
+                shifts_element = _element(_element(schedule, 'date', shiftdate=date.strftime('%m/%d/%Y')), 'shifts')
+                for shift in shifts:
+                    shift_element = _element(shifts_element, 'shift')
+                    for key, value in shift.items():
+                        if key != 'providerprimarykey' or with_keys:
+                            _element(shift_element, key, value)
+            date += datetime.timedelta(days=1)
+        return root
+
+    def maintain_providers(self, request):
+        return self._maintain(request, 'providers', 'provider', 'provider_primary_key',
+                              [self.provider(key) for key in self.provider_keys], ('provider_primary_key', 'emp_id'))
+
+    def maintain_locations(self, request):
+        return self._maintain(request, 'locations', 'location', 'site_id',
+                              [self.location(site_id) for site_id in self.site_ids], ('site_id',))
+
+    def _maintain(self, request, container, tag, all_key, items, id_keys):
+        root = etree.Element('tangier', version='1.0', method=f'{tag}.reply')
+        reply = _element(root, container)
+        for operation in request.iter(tag):
+            action = operation.get('action', '')
+            ids = {key: operation.findtext(key) for key in id_keys if operation.findtext(key) is not None}
+            if action == 'info':
+                if ids.get(all_key, '').startswith('ALL'):
+                    matches = items
+                else:
+                    matches = [item for item in items if any(item[key] == value for key, value in ids.items())]
+                for item in matches:
+                    self._item_element(reply, tag, action, item)
+            else:
+                # adds, updates and deletes are acknowledged but do not change the data
+                self._item_element(reply, tag, action, {**{child.tag: child.text or '' for child in operation},
+                                                        'processed': 'true', 'comment': f'{tag} {action}d.'})
+        return root
+
+    @staticmethod
+    def _item_element(parent, tag, action, item):
+        element = _element(parent, tag, action=action)
+        for key, value in item.items():
+            _element(element, key, value)
+
+
+class FakeTangierServer:
+    """
+    HTTP server answering SOAP requests for the three Tangier services from data, on 127.0.0.1 and a free port
+    unless one is given. Use it as a context manager or call start and stop.
+
+    :param data: (FakeTangierData) what the services answer with, defaults to FakeTangierData()
+    :param latency: (float) seconds every SOAP request is delayed by before it is answered
+    :param port: (int) port to listen on, 0 for any free port
+    """
+
+    def __init__(self, data=None, latency=0.0, port=0):
+        self.data = data if data is not None else FakeTangierData()
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def endpoints(self):
+        """
+        :return: (dict) WSDL url of every service, keyed "schedule", "provider" and "location"
+        """
+        return service_endpoints(self.url)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def answer(self, service, envelope):
+        """
+        :param service: (str) "schedule", "provider" or "location"
+        :param envelope: (bytes) SOAP request
+        :return: (bytes) SOAP response
+        """
+        path, name, operation = SERVICES[service]
+        body = etree.fromstring(envelope).find(f'{{{SOAP_NAMESPACE}}}Body')
+        call = body.find(f'{{{NAMESPACE}}}{operation}')
+        request = etree.fromstring(call.findtext(f'{{{NAMESPACE}}}xmlString').encode('utf-8'))
+        handlers = {'schedule': self.data.get_schedule, 'provider': self.data.maintain_providers,
+                    'location': self.data.maintain_locations}
+        result = etree.tostring(handlers[service](request), encoding='unicode')
+        with self._lock:
+            self.requests += 1
+        return (f'<?xml version="1.0" encoding="utf-8"?><soap:Envelope xmlns:soap="{SOAP_NAMESPACE}"><soap:Body>'
+                f'<{operation}Response xmlns="{NAMESPACE}"><{operation}Result>{escape(result)}</{operation}Result>'
+                f'</{operation}Response></soap:Body></soap:Envelope>').encode('utf-8')
+
+    def _service(self, path):
+        return next((service for service, (service_path, name, operation) in SERVICES.items()
+                     if service_path == path), None)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                service = server._service(urlsplit(self.path).path)
+                if service is None:
+                    return self._reply(404, b'')
+                self._reply(200, generate_wsdl(service, f'{server.url}{SERVICES[service][0]}').encode('utf-8'))
+
+            def do_POST(self):
+                envelope = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                service = server._service(urlsplit(self.path).path)
+                if service is None:
+                    return self._reply(404, b'')
+                if server.latency:
+                    time.sleep(server.latency)
+                self._reply(200, server.answer(service, envelope))
+
+            def _reply(self, status, body):
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/xml; charset=utf-8')
+                if body and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body, compresslevel=1)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def _serve(data, latency, connection):
+    server = FakeTangierServer(data, latency).start()
+    connection.send(server.url)
+    connection.recv()
+    server.stop()
+
+
+class FakeTangierProcess:
+    """
+    FakeTangierServer run in a child process, so that it neither competes with the client for the GIL nor shows up in
+    the client's memory measurements. Use it as a context manager.
+
+    :param data: (FakeTangierData) what the services answer with, defaults to FakeTangierData()
+    :param latency: (float) seconds every SOAP request is delayed by before it is answered
+    """
+
+    def __init__(self, data=None, latency=0.0):
+        self.data = data if data is not None else FakeTangierData()
+        self.latency = latency
+        self.url = None
+
+    @property
+    def endpoints(self):
+        return service_endpoints(self.url)
+
+    def __enter__(self):
+        context = multiprocessing.get_context('spawn')
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=_serve, args=(self.data, self.latency, child_connection), daemon=True)
+        self._process.start()
+        self.url = self._connection.recv()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._connection.send('stop')
+        self._process.join(10)
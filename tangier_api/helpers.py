@@ -1,12 +1,228 @@
+import asyncio
+import contextvars
 import datetime
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from . import exceptions
 
-def date_ranges(start_date, end_date, date_format='%Y-%m-%d'):
+# everything a single call can fail with; APIError and APICallError are not Exception subclasses. KeyboardInterrupt,
+# SystemExit and CancelledError are not call errors and are never collected into a ConcurrentCallError.
+CALL_ERRORS = (Exception, exceptions.APIError, exceptions.APICallError)
+
+
+def date_ranges(start_date, end_date, date_format='%Y-%m-%d', anchor=None):
     start_date = datetime.datetime.strptime(start_date, date_format)
     end_date = datetime.datetime.strptime(end_date, date_format)
     ranges = []
+    if anchor is not None:
+        # windows line up with a grid of 8 week windows from anchor instead of starting at start_date, so only the
+        # first and last windows move when start_date or end_date does
+        offset = (start_date - datetime.datetime.strptime(anchor, date_format)).days % 57
+        first_end = start_date + datetime.timedelta(days=56 - offset)
+        if first_end < end_date:
+            ranges.append((start_date.strftime(date_format), first_end.strftime(date_format)))
+            start_date = first_end + datetime.timedelta(days=1)
     while start_date + datetime.timedelta(weeks=8) < end_date:
         ranges.append((start_date.strftime(date_format), (start_date + datetime.timedelta(weeks=8)).strftime(date_format)))
         start_date = start_date + datetime.timedelta(weeks=8, days=1)
     ranges.append((start_date.strftime(date_format), end_date.strftime(date_format)))
-    return ranges
\ No newline at end of file
+    return ranges
+
+
+class WindowPlanner:
+    """
+    Sizes the date windows a site's schedule is requested in from the response sizes and request times seen for that
+    site, instead of the fixed 8 week windows of date_ranges. A site's window is as long as it can be while its
+    response is expected to stay under target_bytes and target_seconds, so quiet sites are requested in a few long
+    windows and busy sites in many short ones. When a window fails (see record_failure) the next ones are bisected
+    between the longest window that worked and the shortest one that failed. Every window that works after that lets
+    the failed length grow by recovery, so one bad request does not keep a site on short windows for good.
+
+    :param path: (str or None) json file the per site stats are read from and saved to, so they carry over between runs
+    :param target_bytes: (int) response size a window should stay under
+    :param target_seconds: (float) request time a window should stay under
+    :param default_days: (int) window length for sites without stats; date_ranges windows are 57 days
+    :param min_days: (int) shortest window; a failing window of this length is not split further
+    :param max_days: (int) longest window
+    :param smoothing: (float) weight of the latest window in the running per day averages
+    :param recovery: (float) factor the failed length grows by with every window that works
+    """
+
+    def __init__(self, path=None, target_bytes=5000000, target_seconds=30.0, default_days=57, min_days=1,
+                 max_days=366, smoothing=0.5, recovery=1.5):
+        self.path = path
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self.default_days = default_days
+        self.min_days = min_days
+        self.max_days = max_days
+        self.smoothing = smoothing
+        self.recovery = recovery
+        self._lock = threading.Lock()
+        self.stats = {}
+        if path and os.path.exists(path):
+            with open(path) as stats_file:
+                self.stats = json.load(stats_file)
+
+    def window_days(self, site_id):
+        """
+        :param site_id: (str) site the window is for
+        :return: (int) number of days (end date included) the next window of site_id should cover
+        """
+        with self._lock:
+            stats = dict(self.stats.get(str(site_id), {}))
+        if not stats:
+            return self.default_days
+        days = self._limit_days(stats)
+        if stats.get('failed_days'):
+            # bisect between the longest window that worked and the shortest one that failed
+            days = min(days, (stats.get('ok_days', 0) + stats['failed_days']) // 2)
+        return max(self.min_days, min(self.max_days, days))
+
+    def _limit_days(self, stats):
+        """
+        :return: (int) longest window the per day rates in stats allow under target_bytes and target_seconds
+        """
+        limits = [target / stats[rate] for target, rate in ((self.target_bytes, 'bytes_per_day'),
+                                                           (self.target_seconds, 'seconds_per_day')) if stats.get(rate)]
+        return int(min(limits)) if limits else (self.max_days if 'bytes_per_day' in stats else self.default_days)
+
+    def record(self, site_id, days, size, seconds):
+        """
+        Updates the stats of site_id with a window that was requested successfully
+
+        :param site_id: (str) site the window was for
+        :param days: (int) number of days the window covered
+        :param size: (int) size of the response in bytes
+        :param seconds: (float) time the request took
+        """
+        observed = {'bytes_per_day': size / days, 'seconds_per_day': seconds / days}
+        with self._lock:
+            stats = self.stats.setdefault(str(site_id), {})
+            for rate, value in observed.items():
+                stats[rate] = self.smoothing * value + (1 - self.smoothing) * stats[rate] if rate in stats else value
+            stats['ok_days'] = max(days, stats.get('ok_days', 0))
+            if 'failed_days' not in stats:
+                return
+            # the failure may have been a passing one, so every window that works moves the failed length up
+            stats['failed_days'] = int(stats['failed_days'] * self.recovery) + 1
+            if stats['failed_days'] <= stats['ok_days'] or stats['failed_days'] > min(self._limit_days(stats),
+                                                                                       self.max_days):
+                # windows are back to the length the rates allow
+                del stats['failed_days']
+
+    def record_failure(self, site_id, days):
+        """
+        Records that a window of days days failed for site_id, so that the next one is shorter
+
+        :return: (bool) False if the window was already as short as windows get, so splitting it will not help
+        """
+        if days <= self.min_days:
+            return False
+        with self._lock:
+            stats = self.stats.setdefault(str(site_id), {})
+            stats['failed_days'] = min(days, stats.get('failed_days', days))
+            stats['ok_days'] = min(stats.get('ok_days', 0), days - 1)
+        return True
+
+    def save(self):
+        """
+        Writes the stats to path, if there is one
+        """
+        if not self.path:
+            return
+        with self._lock:
+            stats = json.dumps(self.stats, indent=2, sort_keys=True)
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as stats_file:
+            stats_file.write(stats)
+        os.replace(temp_path, self.path)
+
+
+def chunks(items, size):
+    """
+    :param items: (iterable) items to split up
+    :param size: (int or None) most items per chunk; None keeps every item in one chunk
+    :return: (list) of lists with at most size items each, in the order of items
+    """
+    items = list(items)
+    if not size:
+        return [items] if items else []
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def concurrent_map(func, items, max_workers=None):
+    """
+    Calls func once for every item in items using a bounded thread pool. Every call is allowed to finish even if some
+    of them fail so that the errors can be reported per item; KeyboardInterrupt and SystemExit stop the calls that have
+    not started yet and are raised right away.
+
+    :param func: (callable) called as func(item)
+    :param items: (iterable) arguments for func
+    :param max_workers: (int or None) maximum number of calls in flight at once; None or 1 calls func sequentially
+    :return: (list) of results in the same order as items
+    :raises: exceptions.ConcurrentCallError if any of the calls failed, however the calls were made
+    """
+    items = list(items)
+    if not max_workers or max_workers <= 1 or len(items) <= 1:
+        return _collect(items, [lambda item=item: func(item) for item in items])
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    futures = []
+    try:
+        for item in items:
+            # each call runs in a copy of the caller's context, so wrappers.timing_tags carry over to the threads
+            futures.append(executor.submit(contextvars.copy_context().run, func, item))
+        results = _collect(items, [future.result for future in futures])
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+        raise
+    executor.shutdown()
+    return results
+
+
+def _collect(items, calls):
+    # results of calls (one per item), raising a ConcurrentCallError with every failed item once all have been made
+    results, errors = [None] * len(items), []
+    for i, call in enumerate(calls):
+        try:
+            results[i] = call()
+        except CALL_ERRORS as e:
+            errors.append((items[i], e))
+    if errors:
+        raise exceptions.ConcurrentCallError(errors, results)
+    return results
+
+
+async def async_concurrent_map(coroutine_function, items, max_workers=None):
+    """
+    Awaits coroutine_function once for every item in items with at most max_workers of them in flight at once.
+    Every call is allowed to finish even if some of them fail so that the errors can be reported per item.
+
+    :param coroutine_function: (coroutine function) called as coroutine_function(item)
+    :param items: (iterable) arguments for coroutine_function
+    :param max_workers: (int or None) maximum number of calls in flight at once; None leaves the calls unbounded
+    :return: (list) of results in the same order as items
+    """
+    items = list(items)
+    semaphore = asyncio.Semaphore(max_workers) if max_workers else None
+
+    async def bounded(item):
+        if semaphore is None:
+            return await coroutine_function(item)
+        async with semaphore:
+            return await coroutine_function(item)
+
+    outcomes = await asyncio.gather(*[bounded(item) for item in items], return_exceptions=True)
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException) and not isinstance(outcome, CALL_ERRORS):
+            raise outcome
+    errors = [(item, outcome) for item, outcome in zip(items, outcomes) if isinstance(outcome, BaseException)]
+    if errors:
+        results = [None if isinstance(outcome, BaseException) else outcome for outcome in outcomes]
+        raise exceptions.ConcurrentCallError(errors, results)
+    return outcomes
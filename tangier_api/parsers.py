@@ -0,0 +1,168 @@
+"""
+Streaming parsers for Tangier responses. These read a response element by element and free every element once it
+has been converted, so memory use does not grow with the size of the response the way a full xmlmanip.XMLSchema does.
+"""
+import io
+
+import pandas
+from lxml import etree
+
+
+def _tag_name(element, name):
+    # xmltodict (and therefore xmlmanip) keeps namespace prefixes as written, i.e. "prefix:tag"
+    if not name.startswith('{'):
+        return name
+    qname = etree.QName(name)
+    prefix = next((p for p, uri in element.nsmap.items() if p and uri == qname.namespace), None)
+    return f'{prefix}:{qname.localname}' if prefix else qname.localname
+
+
+def element_to_dict(element):
+    """
+    Converts an element into the same structure xmltodict.parse gives for it: text only elements become their
+    stripped text (or None), attributes are keyed with a leading "@", repeated children become lists and text that
+    sits next to attributes or children is keyed "#text".
+
+    :param element: (lxml.etree._Element) element to convert
+    :return: (dict, str or None)
+    """
+    children = [child for child in element if isinstance(child.tag, str)]
+    text = ''.join([element.text or '', *(child.tail or '' for child in element)]).strip()
+    if not children and not element.attrib:
+        return text or None
+    item = {f'@{_tag_name(element, key)}': value for key, value in element.attrib.items()}
+    for child in children:
+        key, value = _tag_name(child, child.tag), element_to_dict(child)
+        if key not in item:
+            item[key] = value
+        elif isinstance(item[key], list):
+            item[key].append(value)
+        else:
+            item[key] = [item[key], value]
+    if text:
+        item['#text'] = text
+    return item
+
+
+def _release(element):
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def iter_schedule_shifts(schedule_response):
+    """
+    Yields every <shift/> of a GetSchedule response in document order along with the shiftdate of the <date/> it was
+    listed under. Shifts are converted with element_to_dict, so they are equal to the shift dicts found by searching
+    an xmlmanip.XMLSchema of the response for @shiftdate.
+
+    :param schedule_response: (bytes or str) GetSchedule response
+    :return: (generator) of (shiftdate, shift dict) tuples
+    """
+    if isinstance(schedule_response, str):
+        schedule_response = schedule_response.encode('utf-8')
+    for event, element in etree.iterparse(io.BytesIO(schedule_response), events=('end',)):
+        if element.get('shiftdate'):
+            _release(element)
+            continue
+        if element.tag != 'shift':
+            continue
+        shifts = element.getparent()
+        if shifts is None or shifts.tag != 'shifts':
+            continue
+        date = shifts.getparent()
+        if date is None or not date.get('shiftdate'):
+            continue
+        yield date.get('shiftdate'), element_to_dict(element)
+        _release(element)
+
+
+_MISSING = object()
+
+
+class ColumnAccumulator:
+    """
+    Collects rows as one list per column instead of one dict per row, so a whole schedule can be turned into a
+    DataFrame without building (and copying) a dict for every shift. Columns are kept in the order they first appear
+    in, and a row without some column is missing that value, exactly like pandas.DataFrame(list_of_dicts) does.
+    """
+    __slots__ = ('columns', 'length', '_padded')
+
+    def __init__(self):
+        self.columns = {}
+        self.length = 0
+        self._padded = set()
+
+    def __len__(self):
+        return self.length
+
+    def _column(self, key, length):
+        column = self.columns.get(key)
+        if column is None:
+            column = self.columns[key] = [_MISSING] * length
+            if length:
+                self._padded.add(key)
+        elif len(column) < length:
+            column.extend([_MISSING] * (length - len(column)))
+            self._padded.add(key)
+        return column
+
+    def _pad(self):
+        for key, column in self.columns.items():
+            if len(column) < self.length:
+                column.extend([_MISSING] * (self.length - len(column)))
+                self._padded.add(key)
+
+    def extend_rows(self, rows, **leading):
+        """
+        Adds rows, each given as a dict; leading columns go in front of the keys of the rows, the way
+        {"shift_end_date": ..., **shift} would put them
+
+        :param rows: (list) of dicts
+        :param leading: (kwargs) lists with one value for every row
+        """
+        if not rows:
+            return
+        start = self.length
+        for key, values in leading.items():
+            self._column(key, start).extend(values)
+        for i, row in enumerate(rows, start):
+            for key, value in row.items():
+                self._column(key, i).append(value)
+        self.length = start + len(rows)
+        self._pad()
+
+    def extend(self, other):
+        """
+        Adds the rows of another ColumnAccumulator
+        """
+        if not other.length:
+            return
+        start = self.length
+        for key, values in other.columns.items():
+            self._column(key, start).extend(values)
+        self._padded.update(other._padded)
+        self.length = start + other.length
+        self._pad()
+
+    def to_records(self):
+        """
+        :return: (list) of one dict per row, without the keys the row is missing
+        """
+        keys = list(self.columns)
+        if not keys:
+            return [{} for _ in range(self.length)]
+        if not self._padded:
+            return [dict(zip(keys, values)) for values in zip(*self.columns.values())]
+        return [{key: value for key, value in zip(keys, values) if value is not _MISSING}
+                for values in zip(*self.columns.values())]
+
+    def to_frame(self):
+        """
+        :return: (pandas.DataFrame) the same frame pandas.DataFrame(self.to_records()) gives, built column by column
+        """
+        return pandas.DataFrame({key: [float('nan') if value is _MISSING else value for value in column]
+                                 if key in self._padded else column for key, column in self.columns.items()},
+                                index=pandas.RangeIndex(self.length))
@@ -0,0 +1,266 @@
+"""
+Policies every SOAP request to Tangier goes through (see clients.PolicyTransport): a token bucket that keeps the
+request rate under what the servers accept, jittered exponential backoff that retries requests which cannot change
+anything (GetSchedule and "info" requests) after transient failures, and a circuit breaker that stops sending
+requests while the servers keep failing. One CallPolicy is shared by every connection in the process.
+"""
+import asyncio
+import random
+import threading
+import time
+
+import requests
+import zeep.exceptions
+
+from tangier_api import caches
+from tangier_api import exceptions
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# failures worth retrying: the request never got a usable answer
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, asyncio.TimeoutError, ConnectionError, TimeoutError)
+if aiohttp is not None:
+    TRANSIENT_ERRORS += (aiohttp.ClientConnectionError,)
+# throttled or briefly unavailable; a 500 usually carries a SOAP fault, which a retry will not fix
+RETRY_STATUSES = (429, 502, 503, 504)
+# the request asked for more than the server could put together in time
+WINDOW_STATUSES = (413, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average, with bursts of up to capacity requests
+
+    :param rate: (float) tokens added per second
+    :param capacity: (float or None) most tokens the bucket holds, defaults to rate (one second of requests)
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(self.rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token, going into debt if there is none
+
+        :return: (float) seconds to wait before using the token
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def async_acquire(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class RetryPolicy:
+    """
+    Jittered ("full jitter") exponential backoff: the nth retry waits a random time between 0 and
+    min(max_delay, base_delay * 2 ** n) seconds
+
+    :param attempts: (int) most times a request is sent, retries included
+    :param base_delay: (float) seconds the first retry waits at most
+    :param max_delay: (float) longest wait between two attempts
+    """
+
+    def __init__(self, attempts=3, base_delay=0.5, max_delay=30.0):
+        self.attempts = max(1, int(attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, retry):
+        """
+        :param retry: (int) 0 for the first retry, 1 for the second, ...
+        :return: (float) seconds to wait before that retry
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold failures in a row, failing every request right away with a CircuitOpenError for
+    reset_timeout seconds. After that one trial request is let through: the circuit closes again if it succeeds and
+    opens for another reset_timeout seconds if it fails.
+
+    :param failure_threshold: (int) failures in a row that open the circuit
+    :param reset_timeout: (float) seconds the circuit stays open
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        :raises: exceptions.CircuitOpenError if the request may not be sent
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self.trial_running:
+                raise exceptions.CircuitOpenError(
+                    f'Tangier requests are suspended after {self.failures} failures in a row; retry in '
+                    f'{max(remaining, 0):.0f}s.')
+            self.trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures, self.opened_at, self.trial_running = 0, None, False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at, self.trial_running = time.monotonic(), False
+
+
+def _status(response):
+    # requests responses have status_code, the aiohttp ones of the async transport have status
+    status = getattr(response, 'status_code', None)
+    return status if status is not None else getattr(response, 'status', None)
+
+
+def is_window_error(error):
+    """
+    Whether a GetSchedule request probably failed because its date window was too long: it timed out, the connection
+    dropped, or the server answered with one of WINDOW_STATUSES. Auth errors, SOAP faults, an open circuit and bugs
+    are not; a shorter window would fail the same way.
+
+    :param error: (BaseException) what the request raised
+    :return: (bool)
+    """
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    return isinstance(error, zeep.exceptions.TransportError) and error.status_code in WINDOW_STATUSES
+
+
+def is_idempotent(message, headers):
+    """
+    Whether a SOAP request can safely be sent again: GetSchedule requests and Maintain* requests whose every action is
+    "info"
+
+    :param message: (bytes or str) SOAP envelope
+    :param headers: (dict) HTTP headers of the request
+    :return: (bool)
+    """
+    soap_action = f"{headers.get('SOAPAction', '')} {headers.get('Content-Type', '')}"
+    if 'GetSchedule' in soap_action:
+        return True
+    if isinstance(message, bytes):
+        message = message.decode('utf-8')
+    actions = caches.request_actions(message.replace('&quot;', '"'))
+    return bool(actions) and all(action.lower() == 'info' for action in actions)
+
+
+class CallPolicy:
+    """
+    The rate limit, retries and circuit breaker one request goes through; any of them can be left out
+
+    :param rate_limit: (TokenBucket or None)
+    :param retry: (RetryPolicy or None) only used for idempotent requests
+    :param breaker: (CircuitBreaker or None)
+    """
+
+    def __init__(self, rate_limit=None, retry=None, breaker=None):
+        self.rate_limit = rate_limit
+        self.retry = retry
+        self.breaker = breaker
+
+    def _attempts(self, idempotent):
+        return self.retry.attempts if self.retry is not None and idempotent else 1
+
+    def _before_call(self):
+        if self.breaker is not None:
+            self.breaker.before_call()
+
+    def _after_call(self, response):
+        """
+        Counts one failure or success per request, however many attempts it took; response is None if it raised
+        """
+        if self.breaker is None:
+            return
+        if response is None or _status(response) in RETRY_STATUSES:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def call(self, send, idempotent=False):
+        """
+        :param send: (callable) sends the request and returns the requests.Response
+        :param idempotent: (bool) whether the request may be sent more than once
+        :return: the response of the last attempt
+        """
+        self._before_call()
+        response = None
+        try:
+            response = self._send(send, self._attempts(idempotent))
+        finally:
+            # anything raised, KeyboardInterrupt included, must not leave a half-open trial running
+            self._after_call(response)
+        return response
+
+    def _send(self, send, attempts):
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(self.retry.delay(attempt - 1))
+            if self.rate_limit is not None:
+                self.rate_limit.acquire()
+            try:
+                response = send()
+            except TRANSIENT_ERRORS:
+                if attempt + 1 < attempts:
+                    continue
+                raise
+            if _status(response) in RETRY_STATUSES and attempt + 1 < attempts:
+                continue
+            return response
+
+    async def async_call(self, send, idempotent=False):
+        """
+        call for coroutines; send is a coroutine function
+        """
+        self._before_call()
+        response = None
+        try:
+            response = await self._async_send(send, self._attempts(idempotent))
+        finally:
+            # CancelledError too
+            self._after_call(response)
+        return response
+
+    async def _async_send(self, send, attempts):
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(self.retry.delay(attempt - 1))
+            if self.rate_limit is not None:
+                await self.rate_limit.async_acquire()
+            try:
+                response = await send()
+            except TRANSIENT_ERRORS:
+                if attempt + 1 < attempts:
+                    continue
+                raise
+            if _status(response) in RETRY_STATUSES and attempt + 1 < attempts:
+                continue
+            return response
@@ -18,6 +18,23 @@ DEFAULTS = {
     'testing_npi': None,
     'log_dir': None,
     'debug': DEBUG,
+    'wsdl_cache': None,
+    'wsdl_cache_timeout': '86400',
+    'rate_limit': '',
+    'rate_burst': '',
+    'retry_attempts': '3',
+    'retry_backoff': '0.5',
+    'retry_max_backoff': '30',
+    'circuit_failures': '5',
+    'circuit_reset': '30',
+    'http_pool_connections': '10',
+    'http_pool_maxsize': '50',
+    'http_keep_alive': 'true',
+    'http_compress': 'true',
+    'http_connect_timeout': '10',
+    'http_read_timeout': '300',
+    'cassette': None,
+    'cassette_mode': 'replay',
 }
 
 
@@ -49,4 +66,32 @@ LOCATION_ENDPOINT = config_dict.get('location_endpoint')
 TESTING_SITE = config_dict.get('testing_site')
 TESTING_NPI = config_dict.get('testing_npi')
 LOG_DIR = config_dict.get('log_dir')
+# path of the sqlite file WSDL and XSD documents are cached in (zeep's default location if not set); the cache is
+# disabled when wsdl_cache_timeout is 0
+WSDL_CACHE = config_dict.get('wsdl_cache')
+WSDL_CACHE_TIMEOUT = int(config_dict.get('wsdl_cache_timeout') or 0)
+# requests per second sent to Tangier by the whole process, with bursts of up to rate_burst; unlimited if not set
+RATE_LIMIT = float(config_dict.get('rate_limit') or 0)
+RATE_BURST = float(config_dict.get('rate_burst') or 0)
+# GetSchedule and "info" requests are sent up to retry_attempts times after a connection error, a timeout or a 429,
+# 502, 503 or 504 response, waiting a random time of up to retry_backoff * 2 ** retry (at most retry_max_backoff)
+# seconds between attempts
+RETRY_ATTEMPTS = int(config_dict.get('retry_attempts') or 1)
+RETRY_BACKOFF = float(config_dict.get('retry_backoff') or 0)
+RETRY_MAX_BACKOFF = float(config_dict.get('retry_max_backoff') or 0)
+# after circuit_failures failed requests in a row, requests fail right away for circuit_reset seconds; 0 disables it
+CIRCUIT_FAILURES = int(config_dict.get('circuit_failures') or 0)
+CIRCUIT_RESET = float(config_dict.get('circuit_reset') or 0)
+# the HTTP session shared by every client keeps up to http_pool_maxsize connections open to each of up to
+# http_pool_connections hosts; set http_pool_maxsize to at least the max_workers you run with
+HTTP_POOL_CONNECTIONS = int(config_dict.get('http_pool_connections') or DEFAULTS['http_pool_connections'])
+HTTP_POOL_MAXSIZE = int(config_dict.get('http_pool_maxsize') or DEFAULTS['http_pool_maxsize'])
+HTTP_KEEP_ALIVE = (config_dict.get('http_keep_alive') or '').lower() in ('true', 'yes', 'on', '1')
+HTTP_COMPRESS = (config_dict.get('http_compress') or '').lower() in ('true', 'yes', 'on', '1')
+# seconds to wait for a connection and for each read of a response; no limit if not set
+HTTP_CONNECT_TIMEOUT = float(config_dict.get('http_connect_timeout') or 0) or None
+HTTP_READ_TIMEOUT = float(config_dict.get('http_read_timeout') or 0) or None
+# gzip file every request is recorded to (cassette_mode = record) or answered from (cassette_mode = replay)
+CASSETTE = config_dict.get('cassette')
+CASSETTE_MODE = config_dict.get('cassette_mode')
 now = datetime.datetime.now()
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Local store of downloaded schedules used by ScheduleManipulation.save_schedule_from_range for incremental syncs.
+Every (site, date window) that has been fetched is recorded along with when it was fetched, so windows that could no
+longer change at the time they were fetched are read back from disk instead of being downloaded again.
+"""
+import datetime
+import json
+import sqlite3
+import threading
+
+
+class ScheduleStore:
+    """
+    sqlite backed store of shift dicts, grouped by the (site_id, start_date, end_date, query) window they were
+    fetched in. query identifies any extra tags the window was requested with, since those change the response.
+
+    :param path: (str) sqlite database file; created if it does not exist
+    """
+    date_format = '%Y-%m-%d'
+    datetime_format = '%Y-%m-%dT%H:%M:%S'
+    window_anchor = '2000-01-01'  # windows are cut from 8 week windows starting here (see helpers.date_ranges)
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS windows (
+                    site_id TEXT NOT NULL,
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    fetched_at TEXT NOT NULL,
+                    PRIMARY KEY (site_id, start_date, end_date, query)
+                )
+            """)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS shifts (
+                    site_id TEXT NOT NULL,
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    shift TEXT NOT NULL
+                )
+            """)
+            self._connection.execute("""
+                CREATE INDEX IF NOT EXISTS shifts_window ON shifts (site_id, start_date, end_date, query, position)
+            """)
+
+    @staticmethod
+    def query_key(**tags):
+        """
+        Identifies the extra tags a window was requested with
+
+        :param tags: (kwargs) tags passed on to get_schedule
+        :return: (str)
+        """
+        return json.dumps(tags, sort_keys=True, default=str)
+
+    def fetched_at(self, site_id, start_date, end_date, query=''):
+        """
+        :return: (datetime.datetime or None) when the window was last fetched, None if it never was
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT fetched_at FROM windows WHERE site_id = ? AND start_date = ? AND end_date = ? AND query = ?',
+                (str(site_id), start_date, end_date, query)).fetchone()
+        return datetime.datetime.strptime(row[0], self.datetime_format) if row else None
+
+    def needs_refresh(self, site_id, start_date, end_date, query='', settle_days=7, max_age_days=None, now=None):
+        """
+        Whether a window has to be downloaded (again). A window is refreshed if it was never fetched, if it had not
+        been over for settle_days when it was fetched (so the schedule could still change), or if the copy is more
+        than max_age_days old.
+
+        :param site_id: (str) site_id of the window
+        :param start_date: (str) %Y-%m-%d start of the window
+        :param end_date: (str) %Y-%m-%d end of the window
+        :param query: (str) query_key of the tags the window is requested with
+        :param settle_days: (int) number of days after a window ends that its schedule may still be edited
+        :param max_age_days: (int or None) re-fetch every window older than this, even settled ones
+        :param now: (datetime.datetime) current time, defaults to datetime.datetime.now()
+        :return: (bool)
+        """
+        fetched_at = self.fetched_at(site_id, start_date, end_date, query)
+        if fetched_at is None:
+            return True
+        now = now if now else datetime.datetime.now()
+        settled_at = datetime.datetime.strptime(end_date, self.date_format) + datetime.timedelta(days=settle_days + 1)
+        if fetched_at < settled_at:
+            return True
+        return max_age_days is not None and now - fetched_at > datetime.timedelta(days=max_age_days)
+
+    def save_window(self, site_id, start_date, end_date, shifts, query='', fetched_at=None):
+        """
+        Saves the shifts of a window, replacing every stored window of the site and query that overlaps it (such as
+        the last window of a range whose end_date has moved since)
+
+        :param shifts: (list) of shift dicts returned for the window
+        :param fetched_at: (datetime.datetime) when the window was fetched, defaults to datetime.datetime.now()
+        """
+        fetched_at = (fetched_at if fetched_at else datetime.datetime.now()).strftime(self.datetime_format)
+        key = (str(site_id), start_date, end_date, query)
+        overlapping = (str(site_id), query, end_date, start_date)
+        with self._lock, self._connection:
+            for table in ('shifts', 'windows'):
+                self._connection.execute(
+                    f'DELETE FROM {table} WHERE site_id = ? AND query = ? AND start_date <= ? AND end_date >= ?',
+                    overlapping)
+            self._connection.executemany(
+                'INSERT INTO shifts (site_id, start_date, end_date, query, position, shift) VALUES (?, ?, ?, ?, ?, ?)',
+                [(*key, position, json.dumps(shift)) for position, shift in enumerate(shifts)])
+            self._connection.execute(
+                'INSERT INTO windows (site_id, start_date, end_date, query, fetched_at) VALUES (?, ?, ?, ?, ?)',
+                (*key, fetched_at))
+
+    def load_window(self, site_id, start_date, end_date, query=''):
+        """
+        :return: (list) of the stored shift dicts of a window, in the order they were saved
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT shift FROM shifts WHERE site_id = ? AND start_date = ? AND end_date = ? AND query = ? '
+                'ORDER BY position', (str(site_id), start_date, end_date, query)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
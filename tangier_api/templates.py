@@ -0,0 +1,150 @@
+"""
+Request builder for the schedule, provider and location services. Each request is base_xml with a container element
+(<schedule/>, <providers/> or <locations/>) injected into it and filled with tags, which used to take two
+xmlmanip.inject_tags calls (two parses and two serializations) per request. A RequestTemplate does the injection once,
+keeps the serialized xml on either side of the container, and then only has to escape and join the tags.
+"""
+import copy
+import functools
+import re
+import uuid
+
+import xmlmanip
+
+_TAG_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_.\-]*\Z')
+_NOT_XML_CHAR = re.compile('[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]')
+_PLAIN_TEXT = re.compile(r'[\w ,.:;/@#%()+=-]*\Z', re.ASCII)
+_names = set()
+
+
+class UnsupportedTags(Exception):
+    """
+    Raised for tags a template does not render (anything inject_tags would reject or that is not a str or dict);
+    build_request then falls back to inject_tags
+    """
+    pass
+
+
+def _escape_text(text):
+    if isinstance(text, str) and _PLAIN_TEXT.match(text):
+        return text
+    if not isinstance(text, str) or _NOT_XML_CHAR.search(text):
+        raise UnsupportedTags(text)
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\r', '&#13;')
+
+
+def _escape_attribute(value):
+    if isinstance(value, str) and _PLAIN_TEXT.match(value):
+        return value
+    return _escape_text(value).replace('"', '&quot;').replace('\n', '&#10;').replace('\t', '&#9;')
+
+
+def _escape_name(name):
+    if name not in _names:
+        if not _TAG_NAME.match(name):
+            raise UnsupportedTags(name)
+        _names.add(name)
+    return name
+
+
+def render_tags(**tags):
+    """
+    Serializes tags the way xmlmanip.inject_tags does, e.g. provider__0={"action": "info", "__inner_tag": {...}} or
+    start_date="2018-01-01"; tags are not modified
+
+    :param tags: (kwargs) tags as they would be passed to xmlmanip.inject_tags
+    :return: (str) the tags as xml; non-ascii characters are left for the caller to encode
+    """
+    return _render_tags(tags)
+
+
+def _render_tags(tags):
+    parts = []
+    for keyword, value in tags.items():
+        tag = _escape_name(keyword.split('__')[0])
+        if isinstance(value, dict):
+            inner_tag = value.get('__inner_tag', "")
+            if inner_tag and ('text' in value or not isinstance(inner_tag, dict)):
+                raise UnsupportedTags(keyword)
+            text = "" if inner_tag else value.get('text', "")
+            attributes = ''.join(f' {_escape_name(name)}="{_escape_attribute(attribute)}"'
+                                 for name, attribute in value.items() if name not in ('__inner_tag', 'text'))
+            content = _render_tags(inner_tag) if inner_tag else _escape_text(text)
+        elif isinstance(value, str):
+            attributes, content = '', _escape_text(value)
+        else:
+            raise UnsupportedTags(keyword)
+        parts.append(f'<{tag}{attributes}>{content}</{tag}>')
+    return ''.join(parts)
+
+
+class RequestTemplate:
+    """
+    base_xml compiled around the container element that request tags are injected into
+
+    :param xml_string: (xml str or bytes) base xml of the connection, credentials included
+    :param container: (str) name of the element injected into the root, i.e. "schedule"
+    :param injection_index: (int) where the container goes among the children of the root
+    """
+
+    def __init__(self, xml_string, container, injection_index=2):
+        marker = f'tangier-{uuid.uuid4().hex}'
+        compiled = xmlmanip.inject_tags(xml_string, injection_index=injection_index, **{container: marker})
+        self.prefix, separator, self.suffix = compiled.partition(f'>{marker}<'.encode('ascii'))
+        if not separator:
+            raise ValueError(f'Could not compile a template for <{container}/>')
+        self.prefix, self.suffix = self.prefix + b'>', b'<' + self.suffix
+        # with nothing injected into it the container is reparsed and written as <container/>
+        self.empty = _inject_request(xml_string, container, injection_index)
+
+    def render(self, **tags):
+        """
+        :param tags: (kwargs) tags to put in the container
+        :return: (bytes) the complete request
+        """
+        if not tags:
+            return self.empty
+        return b''.join([self.prefix, render_tags(**tags).encode('ascii', 'xmlcharrefreplace'), self.suffix])
+
+
+def _inject_request(xml_string, container, injection_index=2, **tags):
+    xml_string = xmlmanip.inject_tags(xml_string, injection_index=injection_index, **{container: ""})
+    return xmlmanip.inject_tags(xml_string, parent_tag=container, **tags)
+
+
+@functools.lru_cache(maxsize=64)
+def get_template(xml_string, container, injection_index=2):
+    """
+    Compiles (once per distinct xml_string) the template for a container, checking it against inject_tags
+
+    :return: (RequestTemplate or None) None if xml_string can not be templated, e.g. it already has a <container/>
+    """
+    try:
+        template = RequestTemplate(xml_string, container, injection_index)
+    except (ValueError, TypeError, xmlmanip.BadSchemaError):
+        return None
+    probe = {'probe': 'a&b', 'probe__1': {'id': '<1>', '__inner_tag': {'probe': '"2"'}}}
+    if template.render(**probe) != _inject_request(xml_string, container, injection_index, **probe):
+        return None
+    return template
+
+
+def build_request(xml_string, container, injection_index=2, **tags):
+    """
+    Same bytes as injecting an empty <container/> into xml_string at injection_index and then injecting tags into it
+    with xmlmanip.inject_tags, without parsing xml_string again; tags are not modified
+
+    :param xml_string: (xml str or bytes) base xml of the request
+    :param container: (str) name of the element to inject into the root of xml_string
+    :param injection_index: (int) where the container goes among the children of the root
+    :param tags: (kwargs) tags as they would be passed to xmlmanip.inject_tags
+    :return: (bytes) the request
+    """
+    template = get_template(xml_string, container, injection_index)
+    if template is not None:
+        try:
+            return template.render(**tags)
+        except UnsupportedTags:
+            pass
+    # inject_tags pops "__inner_tag" and "text" out of the dicts it is given
+    return _inject_request(xml_string, container, injection_index, **copy.deepcopy(tags))
@@ -83,5 +83,1113 @@ class TestLocationConnection(unittest.TestCase):
         self.assertTrue(len(list_response) > 0)
 
 
+class TestCallPolicy(unittest.TestCase):
+    """
+    Offline; the breaker must end every half-open trial, however the request ends
+    """
+    def test_trial_cleared_after_any_error(self):
+        from tangier_api import exceptions, policies
+
+        def fail(error):
+            def send():
+                raise error
+            return send
+
+        policy = policies.CallPolicy(breaker=policies.CircuitBreaker(1, 0))
+        self.assertRaises(ConnectionError, policy.call, fail(ConnectionError()))
+        self.assertRaises(ValueError, policy.call, fail(ValueError()))
+        self.assertFalse(policy.breaker.trial_running)
+        self.assertEqual(policy.call(lambda: 'ok'), 'ok')
+        self.assertIsNone(policy.breaker.opened_at)
+
+        policy = policies.CallPolicy(rate_limit=policies.TokenBucket(1), breaker=policies.CircuitBreaker(1, 0))
+        self.assertRaises(ConnectionError, policy.call, fail(ConnectionError()))
+        policy.rate_limit.acquire = fail(RuntimeError())
+        self.assertRaises(RuntimeError, policy.call, lambda: 'ok')
+        self.assertFalse(policy.breaker.trial_running)
+
+        policy = policies.CallPolicy(breaker=policies.CircuitBreaker(1, 60))
+        self.assertRaises(ConnectionError, policy.call, fail(ConnectionError()))
+        self.assertRaises(exceptions.CircuitOpenError, policy.call, lambda: 'ok')
+
+    def test_async_trial_cleared_after_cancel(self):
+        import asyncio
+        from tangier_api import policies
+        policy = policies.CallPolicy(breaker=policies.CircuitBreaker(1, 0))
+
+        async def fail():
+            raise ConnectionError()
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        async def ok():
+            return 'ok'
+
+        async def run():
+            with self.assertRaises(ConnectionError):
+                await policy.async_call(fail)
+            with self.assertRaises(asyncio.CancelledError):
+                await policy.async_call(cancelled)
+            self.assertFalse(policy.breaker.trial_running)
+            return await policy.async_call(ok)
+
+        self.assertEqual(asyncio.run(run()), 'ok')
+
+    def test_one_failure_per_call(self):
+        from tangier_api import policies
+        attempts = []
+
+        def send():
+            attempts.append(1)
+            raise ConnectionError()
+
+        policy = policies.CallPolicy(retry=policies.RetryPolicy(3, base_delay=0), breaker=policies.CircuitBreaker(2, 60))
+        self.assertRaises(ConnectionError, policy.call, send, idempotent=True)
+        self.assertEqual((len(attempts), policy.breaker.failures), (3, 1))
+        self.assertIsNone(policy.breaker.opened_at)
+
+
+class TestWindowPlanner(unittest.TestCase):
+    """
+    Offline; get_schedule is replaced so that no request is sent
+    """
+    def planned_connection(self, responses):
+        from tangier_api import parsers
+        from tangier_api.api import ScheduleManipulation
+        connection = ScheduleManipulation.__new__(ScheduleManipulation)
+        connection.windows = []
+
+        def get_schedule(start_date, end_date, site_id, **kwargs):
+            connection.windows.append((start_date, end_date))
+            response = responses.pop(0) if responses else b'<schedule/>'
+            if isinstance(response, BaseException):
+                raise response
+            return response
+
+        connection.get_schedule = get_schedule
+        connection._schedule_columns = lambda response: parsers.ColumnAccumulator()
+        return connection
+
+    def test_failure_does_not_pin_site(self):
+        from tangier_api.helpers import WindowPlanner
+        planner = WindowPlanner()
+        planner.record('SITE', 366, 1000, 1.0)
+        self.assertEqual(planner.window_days('SITE'), 366)
+        planner.record_failure('SITE', 6)
+        self.assertEqual(planner.window_days('SITE'), 5)
+        for _ in range(20):
+            days = planner.window_days('SITE')
+            planner.record('SITE', days, days * 3, days * 0.003)
+        self.assertEqual(planner.window_days('SITE'), 366)
+
+    def test_clamped_window_failure_not_recorded(self):
+        import requests
+        from tangier_api.helpers import WindowPlanner
+        planner = WindowPlanner(min_days=1)
+        planner.record('SITE', 366, 1000, 1.0)
+        connection = self.planned_connection([requests.Timeout()])
+        connection._planned_columns(planner, 'SITE', '2018-01-01', '2018-01-06')
+        self.assertEqual(connection.windows, [('2018-01-01', '2018-01-06'), ('2018-01-01', '2018-01-03'),
+                                              ('2018-01-04', '2018-01-06')])
+        self.assertNotIn('failed_days', planner.stats['SITE'])
+
+    def test_planned_window_failure_recorded(self):
+        import requests
+        from tangier_api.helpers import WindowPlanner
+        planner = WindowPlanner(default_days=10)
+        failures, record_failure = [], planner.record_failure
+        planner.record_failure = lambda site_id, days: failures.append(days) or record_failure(site_id, days)
+        connection = self.planned_connection([requests.Timeout()])
+        connection._planned_columns(planner, 'SITE', '2018-01-01', '2018-01-31')
+        self.assertEqual(connection.windows[:2], [('2018-01-01', '2018-01-10'), ('2018-01-01', '2018-01-05')])
+        self.assertEqual(failures, [10])
+
+    def test_other_errors_not_split(self):
+        from tangier_api import exceptions
+        from tangier_api.helpers import WindowPlanner
+        for error in (exceptions.CircuitOpenError('open'), exceptions.APICallError('auth'), ValueError('bug')):
+            planner = WindowPlanner(default_days=10)
+            connection = self.planned_connection([error])
+            self.assertRaises(type(error), connection._planned_columns, planner, 'SITE', '2018-01-01', '2018-01-31')
+            self.assertEqual(len(connection.windows), 1)
+            self.assertEqual(planner.stats, {})
+
+
+class TestScheduleStore(unittest.TestCase):
+    """
+    Offline; get_schedule_values_list is replaced so that no request is sent
+    """
+    def setUp(self):
+        import os
+        import tempfile
+        from tangier_api.store import ScheduleStore
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = ScheduleStore(os.path.join(directory.name, 'schedules.sqlite3'))
+        self.addCleanup(self.store.close)
+
+    def test_needs_refresh(self):
+        import datetime
+        fetched_at = datetime.datetime(2018, 3, 1)
+        self.assertTrue(self.store.needs_refresh('A', '2018-01-01', '2018-02-26'))
+        self.store.save_window('A', '2018-01-01', '2018-02-26', [], fetched_at=fetched_at)
+        self.assertTrue(self.store.needs_refresh('A', '2018-01-01', '2018-02-26', settle_days=7))
+        self.assertFalse(self.store.needs_refresh('A', '2018-01-01', '2018-02-26', settle_days=2))
+        self.assertTrue(self.store.needs_refresh('A', '2018-01-01', '2018-02-26', query='{"emp_id": "E1"}',
+                                                 settle_days=2))
+        self.assertFalse(self.store.needs_refresh('A', '2018-01-01', '2018-02-26', settle_days=2, max_age_days=30,
+                                                  now=fetched_at + datetime.timedelta(days=30)))
+        self.assertTrue(self.store.needs_refresh('A', '2018-01-01', '2018-02-26', settle_days=2, max_age_days=30,
+                                                 now=fetched_at + datetime.timedelta(days=31)))
+
+    def test_save_and_load_window(self):
+        shifts = [{'siteid': 'A', 'location': 'Unit 2'}, {'siteid': 'A', 'location': 'Unit 1'}]
+        self.store.save_window('A', '2018-01-01', '2018-02-26', shifts)
+        self.store.save_window('B', '2018-01-01', '2018-02-26', [{'siteid': 'B'}])
+        self.assertEqual(self.store.load_window('A', '2018-01-01', '2018-02-26'), shifts)
+        self.assertEqual(self.store.load_window('A', '2018-01-01', '2018-02-26', query='{"emp_id": "E1"}'), [])
+        self.store.save_window('A', '2018-01-01', '2018-02-26', shifts[:1])
+        self.assertEqual(self.store.load_window('A', '2018-01-01', '2018-02-26'), shifts[:1])
+        self.assertEqual(self.store.load_window('B', '2018-01-01', '2018-02-26'), [{'siteid': 'B'}])
+
+    def test_overlapping_windows_replaced(self):
+        self.store.save_window('A', '2018-01-01', '2018-02-20', [{'day': 20}])
+        self.store.save_window('A', '2018-02-21', '2018-02-26', [{'day': 26}])
+        self.store.save_window('A', '2018-01-01', '2018-02-21', [{'day': 21}])
+        self.assertIsNone(self.store.fetched_at('A', '2018-01-01', '2018-02-20'))
+        self.assertIsNone(self.store.fetched_at('A', '2018-02-21', '2018-02-26'))
+        self.assertEqual(self.store.load_window('A', '2018-01-01', '2018-02-20'), [])
+        self.assertEqual(self.store.load_window('A', '2018-01-01', '2018-02-21'), [{'day': 21}])
+
+    def test_anchored_date_ranges(self):
+        from tangier_api.helpers import date_ranges
+        self.assertEqual(date_ranges('2000-01-01', '2000-05-01', anchor='2000-01-01'),
+                         date_ranges('2000-01-01', '2000-05-01'))
+        ranges = date_ranges('2000-01-20', '2000-05-01', anchor='2000-01-01')
+        self.assertEqual(ranges, [('2000-01-20', '2000-02-26'), ('2000-02-27', '2000-04-23'),
+                                  ('2000-04-24', '2000-05-01')])
+        self.assertEqual(date_ranges('2000-01-21', '2000-05-02', anchor='2000-01-01')[1], ranges[1])
+        self.assertEqual(date_ranges('2000-01-20', '2000-01-25', anchor='2000-01-01'), [('2000-01-20', '2000-01-25')])
+
+    def test_sync_saves_sites_that_worked(self):
+        from tangier_api import exceptions
+        from tangier_api.api import ScheduleManipulation
+        connection, requests = ScheduleManipulation.__new__(ScheduleManipulation), []
+        failing = {'B'}
+
+        def get_schedule_values_list(start_date, end_date, site_ids, **kwargs):
+            requests.append(site_ids[0])
+            if site_ids[0] in failing:
+                raise exceptions.APIError(f'{site_ids[0]} failed')
+            return [{'siteid': site_ids[0], 'start_date': start_date}]
+
+        connection.get_schedule_values_list = get_schedule_values_list
+        date_range = ('2018-01-01', '2018-02-26')
+        for max_workers in (None, 2):
+            with self.assertRaises(exceptions.ConcurrentCallError):
+                connection._sync_schedule_window(self.store, date_range, ['A', 'B', 'C'], max_workers=max_workers)
+            self.assertEqual(self.store.load_window('C', *date_range, self.store.query_key()),
+                             [{'siteid': 'C', 'start_date': '2018-01-01'}])
+        requests.clear()
+        failing.clear()
+        values_list = connection._sync_schedule_window(self.store, date_range, ['A', 'B', 'C'])
+        self.assertEqual(requests, ['B'])
+        self.assertEqual([shift['siteid'] for shift in values_list], ['A', 'B', 'C'])
+
+
+class TestProviderReport(unittest.TestCase):
+    """
+    Offline; MaintainProviders is answered by fake_tangier.FakeTangierData
+    """
+    def test_add_to_report_batches_emp_ids(self):
+        import math
+        import pandas
+        from lxml import etree
+        from tangier_api import fake_tangier
+        from tangier_api.api import ProviderReport
+
+        class ProviderData(fake_tangier.FakeTangierData):
+            def provider(self, provider_key):
+                return {**super(ProviderData, self).provider(provider_key), 'emp_id': f'{1000 + int(provider_key)}'}
+
+        data, requests = ProviderData(providers=500), []
+
+        def maintain_providers(xml_string=""):
+            request = etree.fromstring(xml_string)
+            requests.append([element.text for element in request.iter('emp_id')])
+            return etree.tostring(data.maintain_providers(request)).decode('utf-8')
+
+        emp_ids = [1000 + key for key in range(1, 251)]
+        report = ProviderReport.__new__(ProviderReport)
+        report.df = pandas.DataFrame({'provider_id': emp_ids + ['unknown']})
+        report.base_xml, report.cache = '<tangier version="1.0" method="provider.request"></tangier>', None
+        report.MaintainProviders = maintain_providers
+        report.add_to_report('last_name', batch_size=100)
+        self.assertEqual(len(requests), math.ceil(len(emp_ids) / 100))
+        self.assertEqual(sorted(int(emp_id) for batch in requests for emp_id in batch), emp_ids)
+        self.assertEqual(list(report.df['provider_last_name']), [f'Last{key}' for key in range(1, 251)] + [''])
+
+
+class TestProviderInfoValuesList(unittest.TestCase):
+    """
+    Offline; MaintainProviders is answered by fake_tangier.FakeTangierData
+    """
+    def setUp(self):
+        from lxml import etree
+        from tangier_api import fake_tangier
+
+        self.data, self.requests = fake_tangier.FakeTangierData(providers=5), []
+
+        def maintain_providers(xml_string=""):
+            request = etree.fromstring(xml_string)
+            self.requests.append([(element.tag, element.text)
+                                  for element in request.iter('emp_id', 'provider_primary_key')])
+            return etree.tostring(self.data.maintain_providers(request)).decode('utf-8')
+
+        self.maintain_providers = maintain_providers
+
+    def connection(self, connection_class):
+        connection = connection_class.__new__(connection_class)
+        connection.base_xml, connection.cache = '<tangier version="1.0" method="provider.request"></tangier>', None
+        return connection
+
+    def test_provider_info_values_list_by_emp_id(self):
+        from tangier_api.api import ProviderConnection
+        provider = self.connection(ProviderConnection)
+        provider.MaintainProviders = self.maintain_providers
+        provider_list = provider.provider_info_values_list(provider_ids=['E2', 'E4'], use_primary_keys=False,
+                                                           all_providers=False)
+        self.assertEqual(self.requests, [[('emp_id', 'E2'), ('emp_id', 'E4')]])
+        self.assertEqual([provider['emp_id'] for provider in provider_list], ['E2', 'E4'])
+
+    def test_async_provider_info_values_list_by_emp_id(self):
+        import asyncio
+        from tangier_api.api.asynchronous import AsyncProviderConnection
+        provider = self.connection(AsyncProviderConnection)
+
+        async def maintain_providers(xml_string=""):
+            return self.maintain_providers(xml_string)
+
+        provider.MaintainProviders = maintain_providers
+        provider_list = asyncio.run(provider.provider_info_values_list(provider_ids=['E2', 'E4'],
+                                                                       use_primary_keys=False, all_providers=False))
+        self.assertEqual(self.requests, [[('emp_id', 'E2'), ('emp_id', 'E4')]])
+        self.assertEqual([provider['emp_id'] for provider in provider_list], ['E2', 'E4'])
+
+
+class TestRequestTemplates(unittest.TestCase):
+    base_xml = '<tangier version="1.0" method="schedule.request"><user_name>user</user_name>' \
+               '<user_pwd>password</user_pwd><client_name>client</client_name></tangier>'
+
+    def assertMatchesInjectTags(self, **tags):
+        """
+        build_request gives the same bytes (or raises the same exception type) as inject_tags, without changing tags
+        """
+        import copy
+        from tangier_api import templates
+
+        def inject_tags(**tags):
+            xml_string = xmlmanip.inject_tags(self.base_xml, injection_index=2, schedule="")
+            return xmlmanip.inject_tags(xml_string, parent_tag='schedule', **tags)
+
+        def build(build_request):
+            try:
+                return build_request(**copy.deepcopy(tags))
+            except Exception as e:
+                return type(e)
+
+        original = copy.deepcopy(tags)
+        request = build(lambda **tags: templates.build_request(self.base_xml, 'schedule', **tags))
+        self.assertEqual(request, build(inject_tags))
+        if isinstance(request, bytes):
+            templates.build_request(self.base_xml, 'schedule', **tags)
+            self.assertEqual(tags, original)
+        return request
+
+    def test_non_ascii(self):
+        request = self.assertMatchesInjectTags(
+            site_id='Clínica São José – 東京', provider__0={'action': 'info', '__inner_tag': {'last_name': 'Müller'}})
+        self.assertIn(b'M&#252;ller', request)
+
+    def test_quotes(self):
+        self.assertMatchesInjectTags(location={'name': 'O\'Brien "Main" <A&B>', 'text': 'x'},
+                                     comment='"quoted" \'single\' & <b>')
+
+    def test_whitespace(self):
+        self.assertMatchesInjectTags(comment='a\r\nb\tc', location={'name': 'a\r\nb\tc', 'text': 'a\r\nb\tc'})
+
+    def test_unsupported_values_fall_back(self):
+        self.assertMatchesInjectTags(site_id=123)
+        self.assertMatchesInjectTags(location={'site_id': 123, 'text': 'x'})
+        self.assertMatchesInjectTags(site_id=None)
+        self.assertMatchesInjectTags(location={'name': None, 'text': 'x'})
+        self.assertMatchesInjectTags(provider={'action': 'info', '__inner_tag': {'straße': 'Hauptstraße'}})
+
+    def test_empty_values(self):
+        self.assertMatchesInjectTags(site_id='', location={}, provider={'action': '', '__inner_tag': {}})
+        self.assertMatchesInjectTags()
+
+
+class TestBulk(unittest.TestCase):
+    """
+    Offline; responses are canned or answered by fake_tangier.FakeTangierData
+    """
+    response = '<tangier version="1.0" method="location.reply"><locations>{}</locations></tangier>'
+
+    @staticmethod
+    def location(site_id, comment='Location updated.'):
+        return f'<location action="update"><site_id>{site_id}</site_id><comment>{comment}</comment></location>'
+
+    def test_prepare_and_collect(self):
+        from tangier_api import bulk, exceptions
+
+        def operation_tag(operation):
+            if 'site_id' not in operation:
+                raise exceptions.APICallError('site_id is required')
+            return {'action': 'delete', '__inner_tag': {'site_id': operation['site_id']}}
+
+        operations = [{'site_id': 'A'}, {}, {'site_id': 'B'}, {'site_id': 'C'}]
+        results, batches = bulk.prepare(operations, operation_tag, 2)
+        self.assertEqual([[i for i, tag in batch] for batch in batches], [[0, 2], [3]])
+        self.assertEqual(batches[0][1][1], {'action': 'delete', '__inner_tag': {'site_id': 'B'}})
+        self.assertIsInstance(results[1]['error'], exceptions.APICallError)
+        self.assertEqual([results[i] for i in (0, 2, 3)], [None, None, None])
+        results = bulk.collect(results, batches, [['a', 'b'], ['c']])
+        self.assertEqual([results[0], results[2], results[3]], ['a', 'b', 'c'])
+        self.assertIs(results[1]['operation'], operations[1])
+
+    def test_map_results_in_order(self):
+        from tangier_api import bulk, exceptions
+        operations = [{'site_id': 'A'}, {'site_id': 'B'}]
+        response = self.response.format(self.location('A') + self.location('X', 'ERROR: no such site'))
+        results = bulk.map_results(operations, response, 'locations', ('site_id',))
+        self.assertEqual([result['operation'] for result in results], operations)
+        self.assertEqual([result['result']['site_id'] for result in results], ['A', 'X'])
+        self.assertIsNone(results[0]['error'])
+        self.assertIsInstance(results[1]['error'], exceptions.APIError)
+
+    def test_map_results_matches_ids(self):
+        from tangier_api import bulk, exceptions
+        operations = [{'site_id': 'A'}, {'site_id': 'B'}, {'site_id': 'A'}]
+        response = self.response.format(self.location('A') + self.location('A', 'ERROR: duplicate'))
+        results = bulk.map_results(operations, response.encode('utf-8'), 'locations', ('site_id',))
+        self.assertEqual([result['result'] and result['result']['comment'] for result in results],
+                         ['Location updated.', None, 'ERROR: duplicate'])
+        self.assertIsNone(results[0]['error'])
+        self.assertIn('no result', str(results[1]['error']))
+        self.assertIsInstance(results[2]['error'], exceptions.APIError)
+
+    def test_match_items(self):
+        from tangier_api import bulk
+        items = [{'emp_id': 'E2'}, 'text', {'provider_primary_key': '1', 'emp_id': 'E1'}]
+        operations = [{'provider_primary_key': 1}, {'emp_id': 'E2'}, {'emp_id': 'E2'}, {'npi': '1'}]
+        self.assertEqual(bulk._match_items(operations, items, ('provider_primary_key', 'emp_id')),
+                         [items[2], items[0], None, None])
+
+    def test_map_results_without_container(self):
+        from tangier_api import bulk
+        operations = [{'site_id': 'A'}, {'site_id': 'B'}]
+        response = '<tangier version="1.0" method="location.reply"><error>Invalid credentials</error></tangier>'
+        results = bulk.map_results(operations, response, 'locations', ('site_id',))
+        self.assertIs(results[0]['error'], results[1]['error'])
+        self.assertIn('Invalid credentials', str(results[0]['error']))
+
+
+class TestMaintainLocations(unittest.TestCase):
+    """
+    Offline; MaintainLocations is replaced by one that acknowledges every location it is sent
+    """
+    def connection(self, cache=None):
+        import types
+        from lxml import etree
+        from tangier_api import exceptions
+        from tangier_api.api import LocationConnection
+        self.requests = []
+
+        def maintain_locations(xml_string):
+            request = etree.fromstring(xml_string)
+            site_ids = [element.text for element in request.iter('site_id')]
+            self.requests.append(site_ids)
+            if 'BROKEN' in site_ids:
+                raise exceptions.APIError('The request timed out.')
+            locations = ''.join(f'<location action="{location.get("action")}"><site_id>{location.findtext("site_id")}'
+                                f'</site_id><comment>Location {location.get("action")}d.</comment></location>'
+                                for location in request.iter('location'))
+            return f'<tangier version="1.0" method="location.reply"><locations>{locations}</locations></tangier>'
+
+        connection = LocationConnection.__new__(LocationConnection)
+        connection.base_xml = '<tangier version="1.0" method="location.request"></tangier>'
+        connection.cache, connection.show_xml_request, connection.show_xml_response = cache, False, False
+        connection.client = types.SimpleNamespace(service=types.SimpleNamespace(MaintainLocations=maintain_locations))
+        return connection
+
+    def test_maintain_locations(self):
+        from tangier_api import exceptions
+        connection = self.connection()
+        operations = [
+            {'action': 'add', 'site_id': 'NEW', 'name': 'New Site', 'short_name': 'NEW'},
+            {'action': 'rename', 'site_id': 'OLD'},
+            {'action': 'update', 'site_id': 'BROKEN', 'name': 'Broken', 'short_name': 'BRK'},
+            {'action': 'delete', 'site_id': 'GONE'},
+            {'action': 'update', 'site_id': 'S1', 'name': 'Site 1', 'short_name': 'S1'},
+        ]
+        for max_workers in (None, 2):
+            self.requests.clear()
+            results = connection.maintain_locations(operations, batch_size=2, max_workers=max_workers)
+            self.assertEqual(sorted(self.requests), [['GONE', 'S1'], ['NEW', 'BROKEN']])
+            self.assertEqual([result['operation'] for result in results], operations)
+            self.assertEqual([type(result['error']) for result in results],
+                             [exceptions.APIError, exceptions.APICallError, exceptions.APIError, type(None),
+                              type(None)])
+            self.assertIs(results[0]['error'], results[2]['error'])
+            self.assertEqual([result['result'] and result['result']['site_id'] for result in results],
+                             [None, None, None, 'GONE', 'S1'])
+
+    def test_writes_invalidate_cache(self):
+        from tangier_api import caches
+        connection = self.connection(caches.MemoryCache())
+        first = connection.location_info_values_list()
+        self.assertEqual(connection.location_info_values_list(), first)
+        connection.maintain_locations([{'action': 'delete', 'site_id': 'S1'}])
+        connection.location_info_values_list()
+        connection.location_info_values_list()
+        self.assertEqual(self.requests, [['ALL_SITE_IDS'], ['S1'], ['ALL_SITE_IDS']])
+
+
+class TestMaintainProviders(unittest.TestCase):
+    """
+    Offline; MaintainProviders is replaced by one that knows three providers and acknowledges every write
+    """
+    def setUp(self):
+        import types
+        from lxml import etree
+        from tangier_api import caches
+        from tangier_api.api import ProviderConnection
+        self.requests, self.unavailable = [], False
+
+        def maintain_providers(xml_string):
+            request = etree.fromstring(xml_string)
+            self.requests.append([provider.get('action') for provider in request.iter('provider')])
+            if self.unavailable:
+                return '<tangier version="1.0" method="provider.reply"><error>Service unavailable</error></tangier>'
+            providers = ''
+            for provider in request.iter('provider'):
+                action = provider.get('action')
+                if action == 'info':
+                    providers += ''.join(f'<provider action="info"><provider_primary_key>{key}</provider_primary_key>'
+                                         f'<emp_id>E{key}</emp_id><last_name>Last{key}</last_name></provider>'
+                                         for key in (1, 2, 3))
+                    continue
+                comment = 'ERROR: provider not found' if provider.findtext('emp_id') == 'E404' else 'Provider updated.'
+                children = ''.join(f'<{child.tag}>{child.text}</{child.tag}>' for child in provider)
+                providers += f'<provider action="{action}">{children}<comment>{comment}</comment></provider>'
+            return f'<tangier version="1.0" method="provider.reply"><providers>{providers}</providers></tangier>'
+
+        self.connection = ProviderConnection.__new__(ProviderConnection)
+        self.connection.base_xml = '<tangier version="1.0" method="provider.request"></tangier>'
+        self.connection.cache = caches.MemoryCache()
+        self.connection.client = types.SimpleNamespace(
+            service=types.SimpleNamespace(MaintainProviders=maintain_providers))
+
+    def test_per_item_results(self):
+        from tangier_api import exceptions
+        operations = [
+            {'action': 'update', 'emp_id': 'E1', 'email': 'dr@example.com'},
+            {'action': 'update', 'email': 'nobody@example.com'},
+            {'action': 'update', 'emp_id': 'E404', 'email': 'missing@example.com'},
+            {'action': 'retire', 'emp_id': 'E2'},
+            {'action': 'delete', 'provider_primary_key': 3},
+        ]
+        results = self.connection.maintain_providers(operations, batch_size=2)
+        self.assertEqual(self.requests, [['update', 'update'], ['delete']])
+        self.assertEqual([result['operation'] for result in results], operations)
+        self.assertEqual([type(result['error']) for result in results],
+                         [type(None), exceptions.APICallError, exceptions.APIError, exceptions.APICallError,
+                          type(None)])
+        self.assertEqual(results[0]['result']['email'], 'dr@example.com')
+        self.assertEqual(results[4]['result']['provider_primary_key'], '3')
+
+    def test_writes_invalidate_cache(self):
+        first = self.connection.get_provider_info(all_providers=True)
+        self.assertEqual(self.connection.get_provider_info(all_providers=True), first)
+        self.assertEqual(len(self.requests), 1)
+        self.connection.maintain_providers([{'action': 'update', 'emp_id': 'E1', 'email': 'dr@example.com'}])
+        self.connection.get_provider_info(all_providers=True)
+        self.assertEqual(self.requests, [['info'], ['update'], ['info']])
+
+    def test_error_responses_not_cached(self):
+        self.unavailable = True
+        self.assertIn(b'Service unavailable', self.connection.get_provider_info(all_providers=True))
+        self.unavailable = False
+        self.assertIn(b'Last1', self.connection.get_provider_info(all_providers=True))
+        self.connection.get_provider_info(all_providers=True)
+        self.assertEqual(len(self.requests), 2)
+
+
+class TestProviderLocations(unittest.TestCase):
+    """
+    Offline; the connections are replaced by canned answers
+    """
+    def provider_locations(self, sites, max_workers=None, progress=None):
+        import threading
+        import time
+        import types
+        from lxml import etree
+        from tangier_api.api import ProviderConnection, ProviderLocations
+        lock, self.active, self.most_active = threading.Lock(), 0, 0
+
+        def maintain_providers(xml_string=""):
+            with lock:
+                self.active += 1
+                self.most_active = max(self.most_active, self.active)
+            time.sleep(0.02)
+            with lock:
+                self.active -= 1
+            site_id = etree.fromstring(xml_string).findtext('.//site_id')
+            providers = ''.join(f'<provider><site_id>{site_id}</site_id><provider_primary_key>{key}'
+                                f'</provider_primary_key><emp_id>E{key}</emp_id></provider>' for key in (1, 2))
+            return f'<tangier version="1.0" method="provider.reply"><providers>{providers}</providers></tangier>'
+
+        pconn = ProviderConnection.__new__(ProviderConnection)
+        pconn.base_xml, pconn.cache = '<tangier version="1.0" method="provider.request"></tangier>', None
+        pconn.MaintainProviders = maintain_providers
+        pconn.provider_info_values_list = lambda all_providers: [
+            {'provider_primary_key': f'{key}', 'emp_id': f'E{key}', 'last_name': f'Last{key}'} for key in (1, 2, 3)]
+        lconn = types.SimpleNamespace(
+            location_info_values_list=lambda: [{'site_id': f'S{site}'} for site in range(sites)])
+        return ProviderLocations(pconn, lconn, max_workers=max_workers, progress=progress)
+
+    def test_max_workers_and_progress(self):
+        for max_workers, most_active in ((None, 1), (4, 4)):
+            calls = []
+            provider_locations = self.provider_locations(12, max_workers, lambda *call: calls.append(call))
+            values = provider_locations.all_location_provider_values
+            self.assertEqual(self.most_active, most_active)
+            self.assertEqual([value['site_id'] for value in values], [f'S{site}' for site in range(12) for _ in (1, 2)])
+            self.assertEqual(sorted(site_id for site_id, completed, total in calls),
+                             sorted(f'S{site}' for site in range(12)))
+            self.assertEqual([(completed, total) for site_id, completed, total in calls],
+                             [(completed, 12) for completed in range(1, 13)])
+            joined = provider_locations.join_all_locations_with_all_providers()
+            self.assertEqual(len(joined), 24)
+            self.assertEqual(set(joined['last_name']), {'Last1', 'Last2'})
+
+    def test_stream_progress(self):
+        import io
+        from tangier_api.api.specialty import StreamProgress
+        stream = io.StringIO()
+        progress = StreamProgress(stream)
+        for completed in range(1, 21):
+            progress(f'SITE-{completed:02}', completed, 20)
+        lines = stream.getvalue().split('\n')
+        self.assertEqual(' '.join(lines).split(), [f'SITE-{completed:02}' for completed in range(1, 21)])
+        self.assertTrue(all(len(line) <= 80 for line in lines))
+        self.assertGreater(len(lines), 1)
+
+
+class TestMemoryCache(unittest.TestCase):
+    def test_least_recently_used_dropped(self):
+        from tangier_api import caches
+        cache = caches.MemoryCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        cache.set('a', 4)
+        cache.set('d', 5)
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual((cache.get('a'), cache.get('d')), (4, 5))
+
+    def test_entries_expire(self):
+        from unittest import mock
+        from tangier_api import caches
+        cache = caches.MemoryCache(ttl=60)
+        with mock.patch.object(caches.time, 'time', return_value=1000.0) as now:
+            cache.set('default', 1)
+            cache.set('short', 2, ttl=10)
+            now.return_value = 1010.0
+            self.assertEqual((cache.get('default'), cache.get('short')), (1, 2))
+            now.return_value = 1011.0
+            self.assertIsNone(cache.get('short'))
+            self.assertEqual(cache.get('default'), 1)
+            now.return_value = 1061.0
+            self.assertIsNone(cache.get('default'))
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.invalidate('a')
+        self.assertEqual((cache.get('a'), cache.get('b')), (None, 2))
+        cache.invalidate()
+        self.assertIsNone(cache.get('b'))
+
+    def test_is_info_request(self):
+        from tangier_api import caches
+        self.assertTrue(caches.is_info_request('<tangier><providers><provider action="info"/>'
+                                               '<provider action = \'INFO\'/></providers></tangier>'))
+        self.assertTrue(caches.is_info_request(b'<tangier><locations/></tangier>'))
+        self.assertFalse(caches.is_info_request('<tangier><providers><provider action="info"/>'
+                                                '<provider action="delete"/></providers></tangier>'))
+        self.assertFalse(caches.is_info_request(b'<tangier><location action="add"/></tangier>'))
+
+
+class TestCacheInvalidation(unittest.TestCase):
+    """
+    Offline; MaintainLocations is replaced by one that acknowledges every location it is sent
+    """
+    def location_connection(self, cache):
+        import types
+        from lxml import etree
+        from tangier_api.api import LocationConnection
+
+        def maintain_locations(xml_string):
+            self.requests.append(xml_string)
+            locations = ''.join(f'<location action="{location.get("action")}"><site_id>{location.findtext("site_id")}'
+                                f'</site_id></location>' for location in etree.fromstring(xml_string).iter('location'))
+            return f'<tangier version="1.0" method="location.reply"><locations>{locations}</locations></tangier>'
+
+        connection = LocationConnection.__new__(LocationConnection)
+        connection.base_xml = '<tangier version="1.0" method="location.request"></tangier>'
+        connection.cache, connection.show_xml_request, connection.show_xml_response = cache, False, False
+        connection.client = types.SimpleNamespace(service=types.SimpleNamespace(MaintainLocations=maintain_locations))
+        return connection
+
+    def test_location_writes_invalidate(self):
+        from tangier_api import caches
+        self.requests = []
+        connection = self.location_connection(caches.MemoryCache())
+        first = connection.location_info_values_list()
+        self.assertEqual(connection.location_info_values_list(), first)
+        self.assertEqual(len(self.requests), 1)
+        connection.add_location('NEW', name='New Site', short_name='NEW')
+        connection.location_info_values_list()
+        self.assertEqual(len(self.requests), 3)
+        connection.delete_location('NEW')
+        connection.location_info_values_list()
+        connection.location_info_values_list()
+        self.assertEqual(len(self.requests), 5)
+
+    def test_disk_cache_invalidation_shares_directory(self):
+        import tempfile
+        from tangier_api import caches
+        self.requests = []
+        with tempfile.TemporaryDirectory() as directory:
+            reader = self.location_connection(caches.DiskCache(directory))
+            writer = self.location_connection(caches.DiskCache(directory))
+            reader.location_info_values_list()
+            writer.location_info_values_list()
+            self.assertEqual(len(self.requests), 1)
+            writer.delete_location('S1')
+            reader.location_info_values_list()
+            self.assertEqual(len(self.requests), 3)
+
+
+class TestResponseSearch(unittest.TestCase):
+    """
+    wrappers.Response and element_errors against the xmlmanip.XMLSchema searches they replaced
+    """
+    def assertSearchesMatch(self, document, lookups):
+        from tangier_api import wrappers
+        response, schema = wrappers.Response(document), xmlmanip.XMLSchema(document)
+        for key, contains in lookups:
+            self.assertEqual(response.find(key, contains), schema.search(**{f'{key}__contains': contains}))
+        legacy_errors = schema.search(comment__contains='Error') or schema.search(error__contains='')
+        self.assertEqual(response.errors(), legacy_errors)
+        return response
+
+    def test_provider_documents(self):
+        for provider_keys in (range(1, 13), [3]):
+            providers = ''.join(f'<provider action="info"><provider_primary_key>{key}</provider_primary_key><emp_id>'
+                                f'E{key}</emp_id><npi>{key:0>10}</npi><last_name>Last{key}</last_name><comment>'
+                                f'Provider found.</comment></provider>' for key in provider_keys)
+            document = f'<tangier version="1.0" method="provider.reply"><providers>{providers}</providers></tangier>'
+            response = self.assertSearchesMatch(document.encode('utf-8'), [
+                ('provider_primary_key', ''), ('emp_id', 'E1'), ('last_name', 'last1'), ('@action', ''), ('npi', 'x')])
+            self.assertEqual(len(response.find('provider_primary_key')), len(provider_keys))
+
+    def test_location_and_schedule_documents(self):
+        locations = ''.join(f'<location action="info"><site_id>SITE-{site}</site_id><name>Site {site}</name>'
+                            f'<short_name>S{site}</short_name></location>' for site in range(1, 12))
+        self.assertSearchesMatch(f'<tangier version="1.0" method="location.reply"><locations>{locations}</locations>'
+                                 f'</tangier>'.encode('utf-8'),
+                                 [('site_id', ''), ('site_id', 'site-1'), ('name', 'site'), ('@action', 'INFO')])
+        dates = ''.join(f'<date shiftdate="01/0{day}/2018"><shifts>' + ''.join(
+            f'<shift><providername>{"open" if shift == 2 else f"Last{shift}, First{shift}"}</providername><empid>'
+            f'{"" if shift == 2 else f"E{shift}"}</empid><siteid>SITE-1</siteid></shift>' for shift in range(1, 4)) +
+            '</shifts></date>' for day in range(1, 4))
+        self.assertSearchesMatch(f'<tangier version="1.0" method="schedule.reply"><schedule>{dates}</schedule>'
+                                 f'</tangier>'.encode('utf-8'),
+                                 [('@shiftdate', ''), ('empid', ''), ('providername', 'open'), ('siteid', '')])
+
+    def test_error_documents(self):
+        from lxml import etree
+        from tangier_api import parsers, wrappers
+        documents = [
+            '<tangier><locations><location action="add"><site_id>A</site_id><comment>Location ERROR: exists'
+            '</comment></location><location action="add"><site_id>B</site_id><comment>Error: bad</comment>'
+            '</location><location action="add"><site_id>C</site_id><comment>Location added.</comment></location>'
+            '</locations></tangier>',
+            '<tangier><error>Invalid credentials</error></tangier>',
+            '<tangier><providers><provider><emp_id>E1</emp_id><error>Unknown</error></provider><provider>'
+            '<emp_id>E2</emp_id><error>Inactive</error></provider></providers></tangier>',
+            '<tangier><providers><provider><emp_id>E1</emp_id><comment>Provider found.</comment></provider>'
+            '</providers></tangier>',
+        ]
+        for document in documents:
+            self.assertSearchesMatch(document.encode('utf-8'), [('site_id', ''), ('emp_id', ''), ('comment', 'error')])
+            for container in etree.fromstring(document):
+                for element in container:
+                    legacy_schema = xmlmanip.XMLSchema(etree.tostring(element))
+                    self.assertEqual(wrappers.element_errors(parsers.element_to_dict(element)),
+                                     legacy_schema.search(comment__contains='Error') or
+                                     legacy_schema.search(error__contains=''))
+
+
+class TestCassettes(unittest.TestCase):
+    """
+    Offline; records from a fake_tangier.FakeTangierServer and replays without it
+    """
+    def setUp(self):
+        import os
+        import tempfile
+        from tangier_api import clients
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(clients.clear_clients)
+        self.addCleanup(clients.set_cassette, None)
+        self.path = os.path.join(directory.name, 'tangier.json.gz')
+
+    def schedule(self, endpoints, start_date='2018-01-01', end_date='2018-01-03'):
+        from tangier_api.api import ProviderConnection, ScheduleConnection
+        sconn = ScheduleConnection(endpoint=endpoints['schedule'])
+        pconn = ProviderConnection(endpoint=endpoints['provider'])
+        return (sconn.get_schedule_values_list(start_date, end_date, ['SITE-1', 'SITE-2']),
+                pconn.provider_info_values_list(all_providers=True))
+
+    def record(self):
+        from tangier_api import cassettes, clients, fake_tangier
+        with fake_tangier.FakeTangierServer(fake_tangier.FakeTangierData(sites=2, providers=5)) as server:
+            clients.set_cassette(cassettes.Cassette(self.path, mode='record'))
+            recorded = self.schedule(server.endpoints)
+            clients.set_cassette(None)
+            return server.endpoints, recorded, server.requests
+
+    def test_record_then_replay(self):
+        from tangier_api import cassettes, clients
+        endpoints, recorded, requests = self.record()
+        self.assertEqual(requests, 3)
+        self.assertTrue(recorded[0] and recorded[1])
+        # the server is gone, so everything has to come from the cassette
+        clients.set_cassette(cassettes.Cassette(self.path))
+        self.assertEqual(self.schedule(endpoints), recorded)
+
+    def test_cassette_is_gzipped_json(self):
+        import gzip
+        import json
+        from tangier_api import cassettes, settings
+        endpoints, recorded, requests = self.record()
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            contents = json.load(f)
+        self.assertEqual(len(contents['interactions']), requests)
+        self.assertEqual(set(contents['documents']), set(endpoints.values()) - {endpoints['location']})
+        if settings.TANGIER_PASSWORD:
+            self.assertNotIn(settings.TANGIER_PASSWORD, json.dumps(contents))
+        cassette = cassettes.Cassette(self.path)
+        self.assertEqual((cassette.interactions, cassette.documents), (contents['interactions'], contents['documents']))
+
+    def test_missing_interaction(self):
+        from tangier_api import cassettes, clients, exceptions
+        from tangier_api.api import ScheduleConnection
+        endpoints, recorded, requests = self.record()
+        clients.set_cassette(cassettes.Cassette(self.path))
+        sconn = ScheduleConnection(endpoint=endpoints['schedule'])
+        with self.assertRaises(exceptions.APICallError) as raised:
+            sconn.get_schedule('2018-01-01', '2018-01-04', site_id='SITE-1')
+        self.assertIn('no recorded response', str(raised.exception))
+        self.assertRaises(exceptions.APICallError, cassettes.Cassette, f'{self.path}.missing')
+
+
+class TestDiskCache(unittest.TestCase):
+    def test_entries_are_text(self):
+        import os
+        import pickle
+        import tempfile
+        from tangier_api import caches
+        with tempfile.TemporaryDirectory() as directory:
+            cache = caches.DiskCache(directory, ttl=60)
+            cache.set('request', '<tangier>\r\n<locations/></tangier>')
+            self.assertEqual(cache.get('request'), '<tangier>\r\n<locations/></tangier>')
+            cache.set('expired', '<tangier/>', ttl=-1)
+            self.assertIsNone(cache.get('expired'))
+            self.assertRaises(TypeError, cache.set, 'request', {'not': 'xml'})
+
+            class Exploit:
+                def __reduce__(self):
+                    return os.remove, (os.path.join(directory, 'canary'),)
+
+            open(os.path.join(directory, 'canary'), 'w').close()
+            with open(cache._path('planted'), 'wb') as f:
+                pickle.dump((float('inf'), Exploit()), f)
+            self.assertIsNone(cache.get('planted'))
+            self.assertTrue(os.path.exists(os.path.join(directory, 'canary')))
+
+    def test_base_cache_is_abstract(self):
+        from tangier_api import caches
+        self.assertRaises(TypeError, caches.BaseCache)
+
+
+class TestScheduleManipulation(unittest.TestCase):
+    """
+    Offline; the detectors run on benchmarks.synthetic_schedule and are checked against the nested iterrows versions
+    they replaced
+    """
+    def assertSameRows(self, legacy, current):
+        self.assertFalse(legacy.empty)
+        self.assertEqual(list(current.index), list(legacy.index))
+        self.assertTrue(legacy.astype(str).equals(current[list(legacy.columns)].astype(str)))
+
+    def synthetic_schedule(self, *args):
+        from tangier_api import benchmarks
+        saved_schedule = benchmarks.synthetic_schedule(*args)
+        saved_schedule.loc[saved_schedule.index % 17 == 0, 'providername'] = 'open'
+        return saved_schedule
+
+    def test_conflicts_match_legacy(self):
+        from tangier_api import benchmarks
+        saved_schedule = self.synthetic_schedule(50, 40)
+        conflicts = benchmarks.schedule_manipulation(saved_schedule).get_schedule_conflicts()
+        self.assertSameRows(benchmarks.legacy_schedule_conflicts(saved_schedule), conflicts)
+
+    def test_duplicates_match_legacy(self):
+        from tangier_api import benchmarks
+        saved_schedule = self.synthetic_schedule(50, 40)
+        duplicates = benchmarks.schedule_manipulation(saved_schedule).get_schedule_duplicates()
+        self.assertSameRows(benchmarks.legacy_schedule_duplicates(saved_schedule), duplicates)
+
+    def test_typed_detectors_match(self):
+        from tangier_api import benchmarks
+        from tangier_api.api.specialty import typed_schedule
+        saved_schedule = self.synthetic_schedule(50, 40)
+        sconn, typed = (benchmarks.schedule_manipulation(saved_schedule),
+                        benchmarks.schedule_manipulation(typed_schedule(saved_schedule)))
+        for detect in ('get_schedule_open', 'get_schedule_empties', 'get_schedule_duplicates',
+                       'get_schedule_conflicts'):
+            self.assertEqual(list(getattr(typed, detect)().index), list(getattr(sconn, detect)().index))
+
+    def test_clean_schedule_matches_remove_methods(self):
+        from tangier_api import benchmarks
+        saved_schedule = self.synthetic_schedule(30, 4)
+        sconn = benchmarks.schedule_manipulation(saved_schedule)
+        sconn.remove_schedule_open()
+        sconn.remove_schedule_empties()
+        sconn.remove_schedule_duplicates()
+        self.assertFalse(sconn.get_schedule_conflicts().empty)
+        sconn.remove_schedule_conflicts()
+        cleaned = benchmarks.schedule_manipulation(saved_schedule)
+        reports = cleaned.clean_schedule()
+        self.assertTrue(cleaned.saved_schedule.equals(sconn.saved_schedule))
+        self.assertEqual(sorted(reports), ['conflicts', 'duplicates', 'empties', 'open'])
+
+    def test_clean_schedule_overlapping_conflicts(self):
+        import numpy
+        from tangier_api import benchmarks
+        saved_schedule = self.synthetic_schedule(50, 40)
+        sconn = benchmarks.schedule_manipulation(saved_schedule)
+        sconn.remove_schedule_open()
+        sconn.remove_schedule_empties()
+        # some shifts have more than one duplicate, which remove_schedule_duplicates cannot drop either
+        sconn.saved_schedule = sconn.saved_schedule.drop(sconn.get_schedule_duplicates()['dupe_index'].unique())
+        conflicts = sconn.get_schedule_conflicts()
+        labels = numpy.concatenate([conflicts.index.values, conflicts['conflict_index'].values])
+        # a shift in more than one conflict is dropped twice, which the one by one removal cannot do
+        self.assertGreater(len(labels), len(set(labels)))
+        self.assertRaises(KeyError, sconn.remove_schedule_conflicts)
+        expected = sconn.saved_schedule.drop(numpy.unique(labels))
+        cleaned = benchmarks.schedule_manipulation(saved_schedule)
+        cleaned.clean_schedule()
+        self.assertTrue(cleaned.saved_schedule.equals(expected))
+        self.assertTrue(benchmarks.schedule_manipulation(expected).get_schedule_conflicts().empty)
+
+
+class TestAsyncSessions(unittest.TestCase):
+    def test_shared_until_last_release(self):
+        import asyncio
+        from unittest import mock
+        from tangier_api.api import asynchronous
+
+        class Session:
+            closed = False
+
+            async def close(self):
+                self.closed = True
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            with mock.patch.object(asynchronous, '_async_session', Session):
+                first, second = asynchronous._acquire_async_session(loop), asynchronous._acquire_async_session(loop)
+                self.assertIs(first, second)
+                await asynchronous._release_async_session(loop, first)
+                self.assertFalse(first.closed)
+                await asynchronous._release_async_session(loop, second)
+                self.assertTrue(first.closed)
+                self.assertNotIn(loop, asynchronous._async_sessions)
+                self.assertIsNot(asynchronous._acquire_async_session(loop), first)
+                asynchronous._async_sessions.clear()
+
+        asyncio.run(run())
+
+
+class TestConcurrentMap(unittest.TestCase):
+    def test_call_errors_collected(self):
+        from tangier_api import exceptions, helpers
+
+        def call(item):
+            if item == 2:
+                raise exceptions.APICallError('bad item')
+            return item
+
+        for max_workers in (None, 1, 3):
+            with self.assertRaises(exceptions.ConcurrentCallError) as raised:
+                helpers.concurrent_map(call, [1, 2, 3], max_workers=max_workers)
+            self.assertEqual(raised.exception.results, [1, None, 3])
+            self.assertEqual([item for item, error in raised.exception.errors], [2])
+
+    def test_interrupts_stop_the_batch(self):
+        import threading
+        import time
+        from tangier_api import helpers
+        calls, lock = [], threading.Lock()
+
+        def call(item):
+            with lock:
+                calls.append(item)
+            if item == 0:
+                raise SystemExit(1)
+            time.sleep(0.05)
+            return item
+
+        for max_workers in (None, 2):
+            del calls[:]
+            self.assertRaises(SystemExit, helpers.concurrent_map, call, range(40), max_workers=max_workers)
+            self.assertLess(len(calls), 5)
+
+
+class TestTiming(unittest.TestCase):
+    def setUp(self):
+        from tangier_api import wrappers
+        self.timings = []
+        wrappers.clear_timing_sinks()
+        wrappers.add_timing_sink(lambda stage, seconds, tags: self.timings.append((stage, tags)))
+        self.addCleanup(wrappers.clear_timing_sinks)
+
+    def test_stage_timer_and_tags(self):
+        from tangier_api import helpers, wrappers
+
+        def send_request(item):
+            with wrappers.stage_timer('network'):
+                return item
+
+        with wrappers.timing_tags(method='get_schedule', site_id='A', emp_id=None):
+            with wrappers.timing_tags(method='get_schedule_values_list', site_id='B'):
+                with wrappers.stage_timer('parse'):
+                    pass
+            helpers.concurrent_map(send_request, [1, 2], max_workers=2)
+        with wrappers.stage_timer('pandas'):
+            pass
+        self.assertEqual(self.timings, [('parse', {'method': 'get_schedule', 'site_id': 'B'}),
+                                        ('network', {'method': 'get_schedule', 'site_id': 'A'}),
+                                        ('network', {'method': 'get_schedule', 'site_id': 'A'}),
+                                        ('pandas', {})])
+
+    def test_timed(self):
+        import asyncio
+        from tangier_api import wrappers
+
+        @wrappers.timed('build')
+        def build_request():
+            return 'request'
+
+        @wrappers.timed('network')
+        async def send_request():
+            raise ValueError('send failed')
+
+        self.assertEqual(build_request(), 'request')
+        with wrappers.timing_tags(method='get_provider_info'):
+            with self.assertRaises(ValueError):
+                asyncio.run(send_request())
+        self.assertEqual(self.timings, [('build', {'method': 'build_request'}),
+                                        ('network', {'method': 'get_provider_info'})])
+
+    def test_nothing_timed_without_sinks(self):
+        from tangier_api import wrappers
+        wrappers.clear_timing_sinks()
+        self.assertIs(wrappers.stage_timer('parse'), wrappers.timing_tags(method='get_schedule'))
+
+    def test_logging_sink(self):
+        from tangier_api import wrappers
+        with self.assertLogs('tangier_api.timing', 'INFO') as logs:
+            wrappers.LoggingSink()('network', 0.5, {'method': 'get_schedule', 'site_id': 'A'})
+        self.assertEqual(logs.output, ['INFO:tangier_api.timing:network 0.500000s method=get_schedule site_id=A'])
+
+    def test_statsd_sink(self):
+        import socket
+        from tangier_api import wrappers
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        sink = wrappers.StatsdSink('127.0.0.1', server.getsockname()[1])
+        self.addCleanup(sink.socket.close)
+        sink('network', 0.8125, {'method': 'get_schedule', 'site_id': 'A', 'start_date': '2018-01-01'})
+        sink('parse', 0.002, {})
+        self.assertEqual(server.recv(1024), b'tangier.network:812.500|ms|#method:get_schedule,site_id:A')
+        self.assertEqual(server.recv(1024), b'tangier.parse:2.000|ms')
+
+    def test_histogram_sink(self):
+        from tangier_api import wrappers
+        sink = wrappers.HistogramSink(bounds=(0.1, 1, 10))
+        for seconds in (0.05, 0.5, 0.5, 5):
+            sink('network', seconds, {'method': 'get_schedule'})
+        sink('network', 50, {'method': 'get_provider_info'})
+        self.assertEqual(sink.summary()[('network', 'get_schedule')],
+                         {'count': 4, 'total': 6.05, 'mean': 1.5125, 'min': 0.05, 'max': 5})
+        self.assertEqual(sink.percentile('network', 50, method='get_schedule'), 1)
+        self.assertEqual(sink.percentile('network', 100, method='get_schedule'), 5)
+        self.assertEqual(sink.percentile('network', 100), 50)
+        self.assertIsNone(sink.percentile('parse', 50))
+        sink.reset()
+        self.assertEqual(sink.summary(), {})
+
+
+class TestScheduleParsing(unittest.TestCase):
+    def test_stream_and_schema_parsers_agree(self):
+        import pandas
+        from lxml import etree
+        from tangier_api import fake_tangier
+        from tangier_api.api import ScheduleConnection
+        request = etree.fromstring('<tangier><schedule_info><site_id>SITE-1</site_id><start_date>2018-01-01'
+                                   '</start_date><end_date>2018-01-14</end_date></schedule_info></tangier>')
+        response = etree.tostring(fake_tangier.FakeTangierData().get_schedule(request))
+        sconn = ScheduleConnection.__new__(ScheduleConnection)
+        stream = sconn._schedule_values_list(response, parser='stream')
+        self.assertTrue(stream)
+        self.assertEqual(stream, sconn._schedule_values_list(response, parser='schema'))
+        self.assertTrue(sconn._schedule_columns(response).to_frame().equals(pandas.DataFrame(stream)))
+
+    def test_bad_start_times_raise(self):
+        from tangier_api.api import ScheduleConnection
+        sconn = ScheduleConnection.__new__(ScheduleConnection)
+        shift = {'actualstarttime': '07:00 AM', 'reportedminutes': '60'}
+        self.assertEqual(sconn._shift_start_end(['01/01/2018', '01/01/2018'],
+                                                [shift, {**shift, 'actualstarttime': '01/02/2018 07:00 PM'}]),
+                         (['2018-01-01T08:00:00', '2018-01-02T20:00:00'], ['2018-01-01T07:00:00', '2018-01-02T19:00:00']))
+        for start_time in (None, '', 'later', '13:99 PM'):
+            with self.assertRaises(ValueError):
+                sconn._shift_start_end(['01/01/2018', '01/01/2018'], [shift, {**shift, 'actualstarttime': start_time}])
+        with self.assertRaises(ValueError):
+            sconn._shift_start_end(['01/01/2018'], [{'reportedminutes': '60'}])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,8 +1,22 @@
+from collections import defaultdict
 from functools import wraps
+import bisect
+import contextlib
+import contextvars
+import inspect
+import logging
+import socket
+import threading
+import time
+import xmltodict
 import xmlmanip
 
 from . import exceptions
 
+_timing_sinks = []
+_timing_tags = contextvars.ContextVar('tangier_timing_tags', default={})
+_not_timed = contextlib.nullcontext()
+
 
 def debug_options(method):
     @wraps(method)
@@ -24,10 +38,371 @@ def handle_response(method):
     @wraps(method)
     def _impl(self, *method_args, **method_kwargs):
         response = method(self, *method_args, **method_kwargs)
-        schema = xmlmanip.XMLSchema(response.encode('utf-8'))
-        if schema.search(comment__contains='Error'):
-            raise exceptions.APIError(schema.search(comment__contains='Error'))
-        if schema.search(error__contains=''):
-            raise exceptions.APIError(schema.search(error__contains=''))
+        return check_response(response)
+    return _impl
+
+
+def add_timing_sink(sink):
+    """
+    Starts timing the stages of every call: request building ("build"), the SOAP call ("network"), reading the
+    response ("parse") and DataFrame work ("pandas"). Nothing is timed while there are no sinks.
+
+    :param sink: (callable) called as sink(stage, seconds, tags) for every timed stage, from the thread that ran it;
+        tags is a dict that can hold method, site_id, emp_id, start_date and end_date
+    """
+    global _timing_sinks
+    _timing_sinks = [*_timing_sinks, sink]
+
+
+def remove_timing_sink(sink):
+    global _timing_sinks
+    _timing_sinks = [other for other in _timing_sinks if other is not sink]
+
+
+def clear_timing_sinks():
+    global _timing_sinks
+    _timing_sinks = []
+
+
+class _TimingTags:
+    def __init__(self, tags):
+        self.tags = tags
+
+    def __enter__(self):
+        current = _timing_tags.get()
+        tags = {**current, **{key: value for key, value in self.tags.items() if value is not None}}
+        if 'method' in current:
+            # the public method the caller started with, not the ones it calls
+            tags['method'] = current['method']
+        self.token = _timing_tags.set(tags)
+
+    def __exit__(self, *exc_info):
+        _timing_tags.reset(self.token)
+
+
+def timing_tags(**tags):
+    """
+    Tags every stage timed inside the with block, e.g. with timing_tags(method='get_schedule', site_id=site_id). Inner
+    blocks override the tags of outer ones, except method, which stays the outermost one. None values are skipped.
+
+    :return: (context manager)
+    """
+    if not _timing_sinks:
+        return _not_timed
+    return _TimingTags(tags)
+
+
+def _record_timing(stage, seconds, name=None):
+    tags = _timing_tags.get()
+    if name and 'method' not in tags:
+        tags = {'method': name, **tags}
+    for sink in _timing_sinks:
+        sink(stage, seconds, tags)
+
+
+class _StageTimer:
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        _record_timing(self.stage, time.perf_counter() - self.started)
+
+
+def stage_timer(stage):
+    """
+    Times the with block as stage
+
+    :param stage: (str) "build", "network", "parse" or "pandas"
+    :return: (context manager)
+    """
+    if not _timing_sinks:
+        return _not_timed
+    return _StageTimer(stage)
+
+
+def timed(stage):
+    """
+    Times every call of the decorated function or coroutine function as stage; the method tag defaults to its name
+
+    :param stage: (str) "build", "network", "parse" or "pandas"
+    """
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def _impl(*args, **kwargs):
+                if not _timing_sinks:
+                    return await function(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    _record_timing(stage, time.perf_counter() - started, function.__name__)
+        else:
+            @wraps(function)
+            def _impl(*args, **kwargs):
+                if not _timing_sinks:
+                    return function(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    _record_timing(stage, time.perf_counter() - started, function.__name__)
+        return _impl
+    return decorator
+
+
+class LoggingSink:
+    """
+    Timing sink that logs every stage
+
+    :param logger: (logging.Logger) defaults to the "tangier_api.timing" logger
+    :param level: (int) logging level of the messages
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger if logger else logging.getLogger('tangier_api.timing')
+        self.level = level
+
+    def __call__(self, stage, seconds, tags):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, '%s %.6fs %s', stage, seconds,
+                            ' '.join(f'{key}={value}' for key, value in tags.items()))
+
+
+class StatsdSink:
+    """
+    Timing sink that sends every stage to a StatsD server over UDP as a timer, e.g.
+    "tangier.network:812.5|ms|#method:get_schedule,site_id:123" (tags in the DogStatsD format)
+
+    :param host: (str) StatsD host
+    :param port: (int) StatsD port
+    :param prefix: (str) prepended to the stage name
+    :param tag_keys: (tuple) tags to send; the rest (e.g. start_date) would make too many distinct series
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='tangier', tag_keys=('method', 'site_id')):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.tag_keys = tag_keys
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, stage, seconds, tags):
+        metric = f'{self.prefix}.{stage}:{seconds * 1000:.3f}|ms'
+        tags = ','.join(f'{key}:{tags[key]}' for key in self.tag_keys if key in tags)
+        try:
+            self.socket.sendto(f'{metric}|#{tags}'.encode('utf-8') if tags else metric.encode('utf-8'), self.address)
+        except OSError:
+            # metrics are best effort and must never fail a call
+            pass
+
+
+class HistogramSink:
+    """
+    Timing sink that keeps an in-memory histogram of the durations of every (stage, method)
+
+    :param bounds: (tuple) upper bounds of the buckets in seconds; slower calls go into a last, unbounded bucket
+    """
+    default_bounds = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, bounds=default_bounds):
+        self.bounds = tuple(bounds)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def __call__(self, stage, seconds, tags):
+        key = (stage, tags.get('method'))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'count': 0, 'total': 0.0, 'min': seconds, 'max': seconds,
+                                                    'buckets': [0] * (len(self.bounds) + 1)}
+            histogram['count'] += 1
+            histogram['total'] += seconds
+            histogram['min'] = min(histogram['min'], seconds)
+            histogram['max'] = max(histogram['max'], seconds)
+            histogram['buckets'][bisect.bisect_left(self.bounds, seconds)] += 1
+
+    def percentile(self, stage, q, method=None):
+        """
+        :param stage: (str) timed stage
+        :param q: (float) percentile from 0 to 100
+        :param method: (str or None) method tag, None for every method combined
+        :return: (float or None) upper bound of the bucket the percentile falls in (the max for the last bucket),
+            None if the stage was never timed
+        """
+        with self._lock:
+            histograms = [histogram for (other_stage, other_method), histogram in self.histograms.items()
+                          if other_stage == stage and (method is None or other_method == method)]
+            if not histograms:
+                return None
+            buckets = [sum(counts) for counts in zip(*(histogram['buckets'] for histogram in histograms))]
+            slowest = max(histogram['max'] for histogram in histograms)
+        rank, seen = q / 100 * sum(buckets), 0
+        for bound, count in zip(self.bounds, buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, slowest)
+        return slowest
+
+    def summary(self):
+        """
+        :return: (dict) {(stage, method): {"count", "total", "mean", "min", "max"}}
+        """
+        with self._lock:
+            return {key: {'count': histogram['count'], 'total': histogram['total'],
+                          'mean': histogram['total'] / histogram['count'], 'min': histogram['min'],
+                          'max': histogram['max']}
+                    for key, histogram in self.histograms.items()}
+
+
+@timed('parse')
+def check_response(response):
+    """
+    Raises an APIError if the xml response contains an error message, otherwise returns the response as a Response,
+    which keeps the tree parsed here for the caller
+    """
+    response = Response(response)
+    errors = response.errors()
+    if errors:
+        raise exceptions.APIError(errors)
+    return response
+
+
+def element_errors(element):
+    """
+    The checks check_response makes, for a single element of a response (e.g. one <location/> of a bulk request)
+
+    :param element: (dict) element as parsed by xmltodict
+    :return: (list) of the elements holding an error message, empty if there are none
+    """
+    index = defaultdict(list)
+    _index_elements(element, index)
+    return _errors(index)
+
+
+def _errors(index):
+    for key, contains in (('comment', 'ERROR'), ('error', '')):
+        errors = [element for element in index.get(key, []) if contains in element[key].upper()]
+        if errors:
+            return [xmlmanip.SchemaInnerDict(error) for error in sort_elements(errors, key)]
+    return []
+
+
+def _index_elements(obj, index):
+    # same depth first walk xmlmanip's locate does, so ties keep the order XMLSchema.search gives them
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if isinstance(value, str):
+                index[key].append(obj)
+            else:
+                _index_elements(value, index)
+    elif isinstance(obj, list):
+        for item in obj:
+            _index_elements(item, index)
+
+
+def _sort_key(value):
+    return (0, int(value), '') if value.isdigit() else (1, 0, value)
+
+
+def sort_elements(elements, key):
+    """
+    Sorts elements on the text of key the way xmlmanip.XMLSchema.search does, numerically if the text is all digits
+
+    :param elements: (list) of dicts that all have key
+    :param key: (str) tag (or "@attribute") to sort on
+    :return: (list)
+    """
+    return sorted(elements, key=lambda element: _sort_key(element[key]))
+
+
+class Response(str):
+    """
+    xml response string that is parsed at most once. The first call to find parses the response into the same
+    structure xmlmanip.XMLSchema holds and indexes every element by the keys of its text children, so any number of
+    lookups can be made without parsing the response again.
+    """
+
+    def __new__(cls, response):
+        if isinstance(response, Response):
+            return response
+        if isinstance(response, bytes):
+            response = response.decode('utf-8')
+        response = super(Response, cls).__new__(cls, response)
+        response._tree, response._index = None, None
         return response
-    return _impl
\ No newline at end of file
+
+    def __reduce__(self):
+        # the parsed tree is rebuilt on demand instead of being pickled
+        return Response, (str(self),)
+
+    @property
+    def tree(self):
+        """
+        :return: (xmlmanip.SchemaInnerDict) the response as parsed by xmltodict
+        """
+        if self._tree is None:
+            self._tree = xmlmanip.SchemaInnerDict(xmltodict.parse(self.encode('utf-8')))
+        return self._tree
+
+    def errors(self):
+        """
+        :return: (list) of elements with a <comment/> containing "Error" or, if there are none, with an <error/>
+        """
+        return _errors(self._get_index())
+
+    def _get_index(self):
+        if self._index is None:
+            index = defaultdict(list)
+            _index_elements(self.tree, index)
+            self._index = dict(index)
+        return self._index
+
+    def find(self, key, contains=''):
+        """
+        Same result as xmlmanip.XMLSchema(response).search(**{f'{key}__contains': contains}): every element with a
+        text child named key whose text contains contains (case insensitive), sorted on that text.
+
+        :param key: (str) tag (or "@attribute") to look for
+        :param contains: (str) text the value of key must contain
+        :return: (list) of xmlmanip.SchemaInnerDict
+        """
+        contains = contains.upper()
+        elements = [element for element in self._get_index().get(key, []) if contains in element[key].upper()]
+        return [xmlmanip.SchemaInnerDict(element) for element in sort_elements(elements, key)]
+
+
+def async_debug_options(method):
+    """
+    debug_options for coroutine methods
+    """
+    @wraps(method)
+    async def _impl(self, *method_args, **method_kwargs):
+        if not method_args:
+            raise exceptions.APICallError('argument "xml_string" must be provided to '
+                                          'api.AsyncLocationConnection.MaintainLocations')
+        if self.show_xml_request:
+            xmlmanip.print_xml(method_args[0])
+        response = await method(self, *method_args, **method_kwargs)
+        if self.show_xml_response:
+            xmlmanip.print_xml(response)
+        return response
+    return _impl
+
+
+def async_handle_response(method):
+    """
+    handle_response for coroutine methods
+    """
+    @wraps(method)
+    async def _impl(self, *method_args, **method_kwargs):
+        response = await method(self, *method_args, **method_kwargs)
+        return check_response(response)
+    return _impl